@@ -2,23 +2,28 @@
 # -*- coding=utf-8 -*-
 
 import argparse
-import colorama
-import readline
 import os
 import sys
 
-from pecan.lang.lark.parser import UnexpectedToken
-
-import spot
+from pecan.settings import settings
 
-import pecan.tools.theorem_generator as theorem_generator
-from pecan import program
+# Note: Everything else (spot, the parser, the IR, etc.) is imported only once we know we need it, so that things like
+# --help or --use-var-map start quickly. See test/test_startup.py.
 
-from pecan.settings import settings
+def setup_runtime():
+    import colorama
+    import spot
 
-from pecan import utility
+    colorama.init()
+    spot.setup()
 
 def run_repl(env):
+    import readline
+
+    from pecan import program
+    from pecan import utility
+    from pecan.lang.lark.parser import UnexpectedToken
+
     utility.touch(settings.get_history_file())
     readline.read_history_file(settings.get_history_file())
 
@@ -34,6 +39,13 @@ def run_repl(env):
                 if len(parts) > 1:
                     if parts[1] == 'debug':
                         settings.set_debug_level(1 if settings.get_debug_level() <= 0 else 0)
+            elif prog_str.startswith(':reload'):
+                # Forget imported modules (all of them, or just the given file), so the next #import loads them again
+                from pecan.tools.module_registry import module_registry
+
+                parts = prog_str.split(' ', 1)
+                count = module_registry.reload(parts[1].strip() if len(parts) > 1 else None)
+                print('Unloaded {} module(s); #import them again to reload.'.format(count))
             else:
                 prog = program.from_source(prog_str)
                 settings.log(0, lambda: str(prog))
@@ -65,19 +77,65 @@ def main():
     parser.add_argument('--heuristics', help='Use heuristics to determine how to simplify automata. This flag is typically useful with large automata (>10000 states), and can cause worse performance with smaller automata.', required=False, action='store_true')
     parser.add_argument('--extract-implications', help='Alternate mode of running a program involving going through each theorem, extracting the top-level implication that needs to be checked (if applicable).', required=False, action='store_true')
     parser.add_argument('--use-var-map', help='Use the var_map from the specified file and convert the main file to use the same var map (i.e., the argument corresponding to <file>)', required=False, type=str)
-    parser.add_argument('--stats', help='Write out statistics about each predicate defined and theorem tested (i.e., in save_aut and assert_prop)', required=False, action='store_true')
-    parser.add_argument('--output-hoa', help='Outputs encountered Buchi automata into the file', required=False, type=str, dest="output_hoa", metavar="HOA_FILE")
+    parser.add_argument('--stats', help='Write out statistics about each predicate defined and theorem tested (i.e., in save_aut and assert_prop), including memory use. This traces Python allocations, which slows down the Python parts of Pecan', required=False, action='store_true')
+    parser.add_argument('--memory-budget', help='Abort any definition (reporting it as failed) once Pecan uses more than MB megabytes of memory, and continue with the next one', required=False, type=int, metavar='MB')
+    parser.add_argument('--output-hoa', help='Outputs encountered Buchi automata into the file, with a comment describing the operation that produced each one. Compressed if the name ends in .gz or .xz', required=False, type=str, dest="output_hoa", metavar="HOA_FILE")
+    parser.add_argument('--trace-min-states', help='Only output automata with at least N states to the --output-hoa file', required=False, type=int, default=0, metavar='N')
+    parser.add_argument('--trace-preds', help='Only output automata built while evaluating these (comma separated) predicates to the --output-hoa file', required=False, type=str, metavar='PREDS')
+    parser.add_argument('--trace-sample-rate', help='Only output this fraction (between 0 and 1) of the automata to the --output-hoa file', required=False, type=float, default=1.0, metavar='RATE')
+    parser.add_argument('--eager-load', help='Load the automata in #load directives immediately, instead of when they are first used', required=False, action='store_true')
+    parser.add_argument('--finite-words', help='Evaluate everything with deterministic finite automata, treating every variable as a natural number (i.e., a finite word padded with zeros). Much faster for theories over the naturals, but wrong for variables that can be infinite words.', required=False, action='store_true')
+    parser.add_argument('--simplify-min-states', help='Do not simplify automata with fewer than N states after each operation (default: {})'.format(settings.get_simplify_min_states()), required=False, type=int, metavar='N')
+    parser.add_argument('--simplify-min-gain', help='Stop running expensive simplification passes (e.g., merge_states) once they remove less than this fraction of states on average (default: {})'.format(settings.get_simplify_min_gain()), required=False, type=float, metavar='FRACTION')
+    parser.add_argument('--profile', help='Record the evaluation tree (time, automata sizes and operations of every node) into PREFIX.json, and as Chrome trace events (e.g., for chrome://tracing or speedscope) into PREFIX.trace.json', required=False, type=str, metavar='PREFIX')
+    parser.add_argument('--cache-dir', help='Directory used to cache evaluated predicates between runs (default: {})'.format(settings.get_default_cache_dir()), required=False, type=str, metavar='DIR')
+    parser.add_argument('--cache-size', help='Maximum size of the cache directory (evaluated predicates, parsed files and library snapshots), in megabytes (default: 1024). Least recently used entries are evicted first.', required=False, type=int, metavar='MB')
+    parser.add_argument('--no-snapshots', help='Do not snapshot evaluated libraries (std.pn and #import-ed files) in the cache directory', required=False, action='store_true')
+    parser.add_argument('--no-cache', help='Do not read or write the predicate cache', required=False, action='store_true')
+    parser.add_argument('-j', '--jobs', help='Check assertions (#assert_prop and Theorem) in up to N worker processes at once (default: 1). Output stays in source order.', required=False, type=int, default=1, metavar='N')
+    parser.add_argument('--memo-size', help='Maximum total size (states + edges) of the automata remembered for repeated subformulas within a run; 0 disables this (default: {})'.format(settings.get_eval_memo_size()), required=False, type=int, metavar='N')
+    parser.add_argument('--memo-min-nodes', help='Only remember the automata of repeated subformulas with at least N nodes; 1 remembers every subformula (default: {})'.format(settings.get_eval_memo_min_nodes()), required=False, type=int, metavar='N')
 
     args = parser.parse_args()
 
     settings.set_quiet(args.quiet)
+    settings.set_eager_load(args.eager_load)
+    settings.set_finite_words(args.finite_words)
+    settings.set_profile(args.profile)
+    if args.simplify_min_states is not None:
+        settings.set_simplify_min_states(args.simplify_min_states)
+    if args.simplify_min_gain is not None:
+        settings.set_simplify_min_gain(args.simplify_min_gain)
+    settings.set_use_snapshots(not args.no_snapshots)
     settings.set_opt_level(0 if args.no_opt else 1)
     settings.set_load_stdlib(args.no_stdlib)
     settings.set_use_heuristics(args.heuristics)
     settings.set_min_opt(args.min_opt)
     settings.set_extract_implications(args.extract_implications)
     settings.set_write_statistics(args.stats)
+    if args.stats:
+        from pecan.tools.mem_stats import start_heap_tracing
+        start_heap_tracing()
+    if args.memory_budget is not None:
+        settings.set_memory_budget(args.memory_budget * 1024 * 1024)
     settings.set_output_hoa(args.output_hoa)
+    settings.set_trace_min_states(args.trace_min_states)
+    settings.set_trace_sample_rate(args.trace_sample_rate)
+    if args.trace_preds is not None:
+        settings.set_trace_preds(set(args.trace_preds.split(',')))
+
+    if args.no_cache:
+        settings.set_cache_dir(None)
+    else:
+        settings.set_cache_dir(args.cache_dir or settings.get_default_cache_dir())
+
+    if args.cache_size is not None:
+        settings.set_cache_max_size(args.cache_size * 1024 * 1024)
+
+    if args.memo_size is not None:
+        settings.set_eval_memo_size(args.memo_size)
+    if args.memo_min_nodes is not None:
+        settings.set_eval_memo_min_nodes(args.memo_min_nodes)
 
     if args.debug is None:
         settings.set_debug_level(0)
@@ -89,6 +147,8 @@ def main():
             print('If --use-var-map is specified, you must also specify <file>!')
             exit(1)
 
+        setup_runtime()
+
         from pecan.tools.hoa_loader import load_hoa
         use_var_map_aut = load_hoa(args.use_var_map)
         main_file_aut = load_hoa(args.file)
@@ -109,22 +169,34 @@ def main():
 
         return
 
+    if args.generate is None and args.file is None and not args.interactive:
+        parser.print_help()
+        return
+
+    setup_runtime()
+
+    from pecan import program
+    from pecan.lang.lark.parser import UnexpectedToken
+
     env = None
     if args.generate is not None:
+        import pecan.tools.theorem_generator as theorem_generator
+
         for pred in theorem_generator.gen_thms(args.generate):
             print(pred)
     elif args.file is not None:
         try:
             prog = program.load(args.file)
             if not settings.get_extract_implications():
-                env = prog.evaluate()
+                env = prog.evaluate(jobs=args.jobs)
+
+                if settings.should_write_statistics():
+                    from pecan.automata.buchi import BuchiAutomaton
+                    print('[INFO] AP substitutions: {} performed, {} avoided'.format(BuchiAutomaton.substitutions_performed, BuchiAutomaton.substitutions_avoided))
         except UnexpectedToken as e:
             print(e)
             return None
 
-    elif not args.interactive:
-        parser.print_help()
-
     if args.interactive:
         if env is None:
             prog = program.from_source('')
@@ -136,7 +208,5 @@ if __name__ == '__main__':
     # Increase a little bit (default is 1000) because Praline is very inefficient.
     sys.setrecursionlimit(2000)
 
-    colorama.init()
-    spot.setup()
     main()
 
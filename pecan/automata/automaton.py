@@ -1,7 +1,13 @@
 #!/usr/bin/env python3.6
 # -*- coding=utf-8 -*-
 
+from pecan.utility import VarMap
+
 class Automaton:
+    # Whether the simplifier has simplified us since we last changed (see pecan.lang.simplifier). This is a class attribute
+    # so that unpickled automata (e.g., from the cache), which don't go through __init__, start out unsimplified.
+    simplified = False
+
     def __init__(self, aut_type_name):
         self.aut_type_name = aut_type_name
 
@@ -23,6 +29,13 @@ class Automaton:
     def complement(self):
         raise NotImplementedError
 
+    def get_var_map(self):
+        raise NotImplementedError
+
+    # Should return a copy that can be modified without affecting this automaton
+    def clone(self):
+        raise NotImplementedError
+
     def substitute(self, subs, env_var_map):
         raise NotImplementedError
 
@@ -35,6 +48,10 @@ class Automaton:
     def truth_value(self):
         raise NotImplementedError
 
+    # Whether we accept every word. Subclasses should override this if they can do better than complementing
+    def is_universal(self):
+        return self.complement().is_empty()
+
     def num_states(self):
         raise NotImplementedError
 
@@ -44,6 +61,11 @@ class Automaton:
     def accepting_word(self):
         raise NotImplementedError
 
+    # Like accepting_word, but decoded into integers where possible, given a dict from variables to decoders
+    # (see pecan.tools.numeration)
+    def accepting_values(self, decoders):
+        raise NotImplementedError
+
     def to_str(self):
         raise NotImplementedError
 
@@ -69,30 +91,49 @@ class Automaton:
     def merge_states(self):
         return self
 
+    # The passes to run to simplify the result of each operation, as (name, function returning the simplified automaton,
+    # whether it's expensive) triples. Expensive passes are only run while they pay off (see pecan.lang.simplifier)
+    def simplification_passes(self):
+        return [('simplify_edges', lambda aut: aut.simplify_edges(), False),
+                ('simplify_states', lambda aut: aut.simplify_states(), False)]
+
     # Allows conversion between types of automata, if desired
     def custom_convert(self, other):
         raise NotImplementedError
 
-    def shuffle(self, is_disj, other):
+    def shuffle(self, is_disj, other, postprocess=None):
         raise NotImplementedError
 
     def relabel(self):
         return self
 
+    # Like relabel, but renames to a standard choice of labels for each variable, rather than fresh ones
+    def canonicalize(self):
+        return self
+
     def simplify(self):
         return self
 
     # -------------------------------------------------------
     # Default implementations:
     # -------------------------------------------------------
+
+    # Should be called by any operation that modifies the automaton in place, so that the simplifier looks at it again
+    def mark_changed(self):
+        self.simplified = False
+
     def __and__(self, other):
         return self.conjunction(self.convert(other))
 
     def __or__(self, other):
         return self.disjunction(self.convert(other))
 
+    # Equivalent to (self & other).project(var_refs, env_var_map), but subclasses may avoid building the whole product
+    def conjunction_project(self, other, var_refs, env_var_map):
+        return (self & other).project(var_refs, env_var_map)
+
     def contains(self, other):
-        return (self.complement() | other).truth_value() == 'true'
+        return (self.complement() | other).is_universal()
 
     def convert(self, other):
         if self.get_aut_type() == other.get_aut_type():
@@ -113,6 +154,12 @@ class TrueAutomaton(Automaton):
     def complement(self):
         return FalseAutomaton()
 
+    def get_var_map(self):
+        return VarMap()
+
+    def clone(self):
+        return self
+
     def substitute(self, arg_map, env_var_map):
         return self
 
@@ -125,6 +172,9 @@ class TrueAutomaton(Automaton):
     def truth_value(self):
         return 'true'
 
+    def is_universal(self):
+        return True
+
     def num_states(self):
         return -1
 
@@ -151,6 +201,12 @@ class FalseAutomaton(Automaton):
     def complement(self):
         return TrueAutomaton()
 
+    def get_var_map(self):
+        return VarMap()
+
+    def clone(self):
+        return self
+
     def substitute(self, arg_map, env_var_map):
         return self
 
@@ -163,6 +219,9 @@ class FalseAutomaton(Automaton):
     def truth_value(self):
         return 'false'
 
+    def is_universal(self):
+        return False
+
     def num_states(self):
         return -1
 
@@ -1,15 +1,41 @@
 #!/usr/bin/env python3.6
 # -*- coding=utf-8 -*-
 
+import re
+import time
+
 import buddy
 import spot
 
 from pecan.automata.automaton import Automaton, FalseAutomaton
+from pecan.tools.aut_trace import trace_aut
+from pecan.tools.profiler import profile_op
 from pecan.tools.shuffle_automata import ShuffleAutomata
 from pecan.utility import VarMap
 from pecan.settings import settings
 
-def merge(merge_f, aut_a, aut_b):
+# Whether some ap is used for different variables in the two var maps
+def ap_conflict(map_a, map_b):
+    owners = {}
+    for var, aps in map_a.items():
+        for ap in aps:
+            owners[ap] = var
+
+    for var, aps in map_b.items():
+        for ap in aps:
+            if owners.get(ap, var) != var:
+                return True
+
+    return False
+
+# Renames the aps of the smaller automaton so that both automata use the same aps for the same variables.
+# Usually both automata already use the canonical aps (see BuchiAutomaton.canonical_ap), so there's nothing to rename.
+def merge_operands(aut_a, aut_b):
+    if ap_conflict(aut_a.get_var_map(), aut_b.get_var_map()):
+        # This can only happen with automata that didn't get their aps from us (e.g., loaded from a file)
+        settings.log(3, lambda: 'merge: relabeling to resolve ap conflict: {}, {}'.format(aut_a.get_var_map(), aut_b.get_var_map()))
+        aut_b = aut_b.relabel()
+
     if aut_a.num_states() < aut_b.num_states():
         merged_var_map, subs = aut_b.get_var_map().merge_with(aut_a.get_var_map())
         # print('merge(a into b)', merged_var_map, subs)
@@ -21,8 +47,76 @@ def merge(merge_f, aut_a, aut_b):
         new_a = aut_a
         new_b = BuchiAutomaton(aut_b.get_aut(), aut_b.get_var_map()).ap_substitute(subs)
 
+    BuchiAutomaton.count_substitution(subs)
+
+    return new_a, new_b, merged_var_map
+
+def merge(merge_f, aut_a, aut_b):
+    new_a, new_b, merged_var_map = merge_operands(aut_a, aut_b)
     return BuchiAutomaton(merge_f(new_a.get_aut(), new_b.get_aut()), merged_var_map)
 
+def shift_acceptance(acc_code, n):
+    return re.sub(r'(Inf|Fin)\((\d+)\)', lambda m: '{}({})'.format(m.group(1), int(m.group(2)) + n), str(acc_code))
+
+# Builds the product of aut_a and aut_b with the aps in `proj_aps` existentially quantified away, without building the full
+# product first. Only reachable pairs of states are created, and edges between the same pair of states with the same
+# acceptance marks are collapsed into one as we go, which is where the savings come from: once the projected aps are
+# gone, many edges of the product become identical.
+def product_project(aut_a, aut_b, proj_aps):
+    bdd_dict = aut_a.get_dict()
+    res = spot.make_twa_graph(bdd_dict)
+
+    proj_ap_set = set(proj_aps)
+    for ap in list(aut_a.ap()) + list(aut_b.ap()):
+        if ap.ap_name() not in proj_ap_set:
+            res.register_ap(ap)
+
+    proj_cube = buddy.bddtrue
+    for ap in proj_aps:
+        proj_cube &= buddy.bdd_ithvar(res.register_ap(ap))
+
+    num_sets_a = aut_a.num_sets()
+    acceptance = '({}) & ({})'.format(aut_a.get_acceptance(), shift_acceptance(aut_b.get_acceptance(), num_sets_a))
+    res.set_acceptance(num_sets_a + aut_b.num_sets(), spot.acc_code(acceptance))
+
+    state_nums = {}
+    todo = []
+    def get_state(qa, qb):
+        if (qa, qb) not in state_nums:
+            state_nums[(qa, qb)] = res.new_state()
+            todo.append((qa, qb))
+        return state_nums[(qa, qb)]
+
+    res.set_init_state(get_state(aut_a.get_init_state_number(), aut_b.get_init_state_number()))
+
+    while todo:
+        qa, qb = todo.pop()
+        src = state_nums[(qa, qb)]
+
+        out_edges = {}
+        for ea in aut_a.out(qa):
+            for eb in aut_b.out(qb):
+                cond = ea.cond & eb.cond
+                if cond == buddy.bddfalse:
+                    continue
+
+                cond = buddy.bdd_exist(cond, proj_cube)
+                acc = tuple(ea.acc.sets()) + tuple(s + num_sets_a for s in eb.acc.sets())
+                dst = get_state(ea.dst, eb.dst)
+
+                if (dst, acc) in out_edges:
+                    out_edges[(dst, acc)] |= cond
+                else:
+                    out_edges[(dst, acc)] = cond
+
+        for (dst, acc), cond in out_edges.items():
+            res.new_edge(src, dst, cond, list(acc))
+
+    for ap in proj_aps:
+        res.unregister_ap(res.register_ap(ap))
+
+    return res
+
 def merge_maps(aut, map_a: VarMap, map_b: VarMap):
     merged_var_map, subs = map_a.merge_with(map_b)
     return BuchiAutomaton(aut, merged_var_map).ap_substitute(subs)
@@ -35,6 +129,26 @@ class BuchiAutomaton(Automaton):
         BuchiAutomaton.id += 1
         return label
 
+    # Each (variable, index) pair always gets the same ap, so that automata built separately already agree on their aps,
+    # and merging or substituting them doesn't need to rewrite any edge labels.
+    canonical_aps = {}
+    @staticmethod
+    def canonical_ap(var_name, idx):
+        key = (var_name, idx)
+        if key not in BuchiAutomaton.canonical_aps:
+            BuchiAutomaton.canonical_aps[key] = BuchiAutomaton.fresh_ap()
+        return BuchiAutomaton.canonical_aps[key]
+
+    # How many ap substitutions we did, and how many we didn't need to do because the aps already agreed (shown with --stats)
+    substitutions_performed = 0
+    substitutions_avoided = 0
+    @staticmethod
+    def count_substitution(ap_subs):
+        if any(k != v for k, v in ap_subs.items()):
+            BuchiAutomaton.substitutions_performed += 1
+        else:
+            BuchiAutomaton.substitutions_avoided += 1
+
     # This exists so that we ensure all names generated are fresh.
     # It gets called by the various methods that may create an automaton which already uses of the reserved __ap#N names
     # such as loading an automaton from a file.
@@ -52,6 +166,8 @@ class BuchiAutomaton(Automaton):
             return BuchiAutomaton(spot.translate('1'), VarMap())
         elif aut.get_aut_type() == 'false':
             return BuchiAutomaton(spot.translate('0'), VarMap())
+        elif aut.get_aut_type() == 'finite' and aut.nat_words:
+            return aut.to_buchi()
         else:
             raise NotImplementedError
 
@@ -76,32 +192,34 @@ class BuchiAutomaton(Automaton):
 
         return self
 
+    def clone(self):
+        res = BuchiAutomaton(spot.make_twa_graph(self.aut, spot.twa_prop_set.all()), self.var_map.clone())
+        res.simplified = self.simplified
+        return res
+
     def make_empty_aut(self):
         return BuchiAutomaton.as_buchi(FalseAutomaton()).with_var_map(self.var_map)
 
     def conjunction(self, other):
+        start_time = time.time()
         result = merge(spot.product, self, other)
-        result.dump_aut()
+        trace_aut('conjunction', result, start_time)
         return result
 
     def disjunction(self, other):
+        start_time = time.time()
         result = merge(spot.product_or, self, other)
-        result.dump_aut()
+        trace_aut('disjunction', result, start_time)
         return result
 
     def complement(self):
+        start_time = time.time()
         if settings.get_simplication_level() > 0:
             self.postprocess()
         result = BuchiAutomaton(spot.complement(self.get_aut()), self.var_map)
-        result.dump_aut()
+        trace_aut('complement', result, start_time)
         return result
 
-    def dump_aut(self):
-        hoa_file = settings.get_output_hoa()
-        if hoa_file:
-            with open(hoa_file, "a") as fd:
-                fd.write(self.get_aut().to_str() + "\n\n")
-
     def relabel(self):
         level_before = settings.get_simplication_level()
         settings.set_simplification_level(0)
@@ -125,6 +243,30 @@ class BuchiAutomaton(Automaton):
         settings.set_simplification_level(level_before)
         return res
 
+    # Renames our aps to the canonical aps of our variables
+    def canonicalize(self):
+        ap_subs = {}
+        for var, aps in self.var_map.items():
+            for i, ap in enumerate(aps):
+                if ap in ap_subs:
+                    # Two variables share an ap (e.g., after substituting P(x, x)), so we can't give them different ones
+                    return self
+                ap_subs[ap] = self.canonical_ap(var, i)
+
+        # Make sure we don't rename anything to an ap that's already in the automaton, but not used for a variable
+        stray_aps = set(ap.ap_name() for ap in self.aut.ap()) - set(ap_subs)
+        if stray_aps & set(ap_subs.values()):
+            return self.relabel().canonicalize()
+
+        BuchiAutomaton.count_substitution(ap_subs)
+
+        level_before = settings.get_simplication_level()
+        settings.set_simplification_level(0)
+        res = self.ap_substitute(ap_subs)
+        settings.set_simplification_level(level_before)
+
+        return res
+
     def substitute(self, arg_map, env_var_map):
         new_var_map = VarMap()
         ap_subs = {}
@@ -134,7 +276,9 @@ class BuchiAutomaton(Automaton):
             formal_aps = self.var_map[formal_arg]
 
             # Get the aps for the actual argument in the current environment
-            actual_aps = env_var_map.get_or_gen(actual_arg, self.fresh_ap, len(formal_aps))
+            if actual_arg not in env_var_map:
+                env_var_map[actual_arg] = [self.canonical_ap(actual_arg, i) for i in range(len(formal_aps))]
+            actual_aps = env_var_map[actual_arg]
 
             # Set up the substitutions we need to do
             for formal_ap, actual_ap in zip(formal_aps, actual_aps):
@@ -145,7 +289,12 @@ class BuchiAutomaton(Automaton):
 
         # print('substitute()', arg_map, new_var_map, env_var_map, ap_subs)
 
-        return BuchiAutomaton(self.aut, new_var_map).ap_substitute(ap_subs)
+        BuchiAutomaton.count_substitution(ap_subs)
+
+        start_time = time.time()
+        result = BuchiAutomaton(self.aut, new_var_map).ap_substitute(ap_subs)
+        profile_op('substitute', result, start_time)
+        return result
 
     def ap_substitute(self, ap_subs):
         # If we try something like [x/x]P, just don't do anything
@@ -183,12 +332,15 @@ class BuchiAutomaton(Automaton):
 
     def project(self, var_refs, env_var_map):
         from pecan.lang.ir.prog import VarRef
+        start_time = time.time()
         aps = []
         pecan_var_names = []
 
         for v in var_refs:
             if type(v) is VarRef:
-                aps.extend(self.var_map[v.var_name])
+                # As below, it may not be there; e.g., if it was already projected away early
+                if v.var_name in self.var_map:
+                    aps.extend(self.var_map[v.var_name])
                 pecan_var_names.append(v.var_name)
 
         result = self.ap_project(aps)
@@ -205,6 +357,46 @@ class BuchiAutomaton(Automaton):
             if var_name in env_var_map:
                 env_var_map.pop(var_name)
 
+        profile_op('project', result, start_time)
+        return result
+
+    def conjunction_project(self, other, var_refs, env_var_map):
+        from pecan.lang.ir.prog import VarRef
+
+        other = self.convert(other)
+        if other.get_aut_type() != 'buchi':
+            return super().conjunction_project(other, var_refs, env_var_map)
+
+        new_a, new_b, merged_var_map = merge_operands(self, other)
+
+        proj_aps = []
+        pecan_var_names = []
+        for v in var_refs:
+            if type(v) is VarRef:
+                if v.var_name in merged_var_map:
+                    proj_aps.extend(merged_var_map[v.var_name])
+                pecan_var_names.append(v.var_name)
+
+        if not proj_aps:
+            return BuchiAutomaton(spot.product(new_a.get_aut(), new_b.get_aut()), merged_var_map).project(var_refs, env_var_map)
+
+        settings.log(3, lambda: 'conjunction_project: {}'.format(proj_aps))
+
+        start_time = time.time()
+        result = BuchiAutomaton(product_project(new_a.get_aut(), new_b.get_aut(), proj_aps), merged_var_map)
+        trace_aut('conjunction_project', result, start_time)
+
+        if settings.get_simplication_level() > 0:
+            result.merge_states()
+            result.postprocess()
+
+        for var_name in pecan_var_names:
+            if var_name in result.get_var_map():
+                result.get_var_map().pop(var_name)
+
+            if var_name in env_var_map:
+                env_var_map.pop(var_name)
+
         return result
 
     def ap_project(self, aps):
@@ -233,11 +425,90 @@ class BuchiAutomaton(Automaton):
     def truth_value(self):
         if self.aut.is_empty(): # If we accept nothing, we are false
             return 'false'
-        elif self.complement().is_empty(): # If our complement accepts nothing, we accept everything, so we are true
+        elif self.is_universal(): # If we accept everything, we are true
             return 'true'
         else: # Otherwise, we are neither true nor false: i.e., not all variables have been eliminated
             return 'sometimes'
 
+    def is_universal(self):
+        aut = self.get_aut()
+
+        if aut.num_states() == 0:
+            return False
+
+        # With no APs there is only one word, so we accept everything iff we accept anything
+        if len(aut.ap()) == 0:
+            return not aut.is_empty()
+
+        if self.has_universal_loop(aut):
+            return True
+
+        # Most non-universal automata reject one of the constant words (e.g., 0^ω), and checking that is linear
+        if self.rejects_constant_word(aut):
+            return False
+
+        return self.complement_for_check(aut).is_empty()
+
+    # The common trivial case: the initial state loops on every letter, and that loop is accepting
+    def has_universal_loop(self, aut):
+        init = aut.get_init_state_number()
+        for e in aut.out(init):
+            if e.dst == init and e.cond == buddy.bddtrue and aut.acc().accepting(e.acc):
+                return True
+        return False
+
+    def rejects_constant_word(self, aut):
+        for val in [False, True]:
+            word_aut = spot.make_twa_graph(aut.get_dict())
+            cond = buddy.bddtrue
+            for ap in aut.ap():
+                var = buddy.bdd_ithvar(word_aut.register_ap(ap))
+                cond &= var if val else buddy.bdd_not(var)
+
+            word_aut.set_buchi()
+            word_aut.new_states(1)
+            word_aut.set_init_state(0)
+            word_aut.new_edge(0, 0, cond, [0])
+
+            if not aut.intersects(word_aut):
+                settings.log(3, lambda: 'Refuted universality with constant word {}'.format(int(val)))
+                return True
+
+        return False
+
+    # Computes an automaton for the complement of `aut`, for use in emptiness checks only: the result may have any
+    # acceptance condition. This avoids general Büchi complementation whenever we can get a deterministic automaton cheaply,
+    # because then complementing is just dualizing, which is linear.
+    def complement_for_check(self, aut):
+        if not spot.is_deterministic(aut):
+            # Weak automata (e.g., most things built from arithmetic) can be determinized by a powerset construction
+            if spot.is_weak_automaton(aut):
+                det_aut = spot.minimize_obligation(aut)
+                if spot.is_deterministic(det_aut):
+                    settings.log(3, lambda: 'Determinized weak automaton for complementation: {} -> {} states'.format(aut.num_states(), det_aut.num_states()))
+                    aut = det_aut
+
+        if not spot.is_deterministic(aut):
+            aut = spot.simulation(aut)
+            settings.log(3, lambda: 'after simulation: {} states'.format(aut.num_states()))
+
+        if spot.is_deterministic(aut):
+            return spot.dualize(aut)
+        else:
+            return spot.complement(aut)
+
+    # Note: `self.contains(other)` is true iff everything we accept is accepted by `other`
+    def contains(self, other):
+        other = self.convert(other)
+
+        if other.get_aut_type() != 'buchi':
+            return super().contains(other)
+
+        if self.aut.is_empty():
+            return True
+
+        return merge(lambda aut_a, aut_b: spot.product(aut_a, self.complement_for_check(aut_b)), self, other).is_empty()
+
     def num_states(self):
         return self.aut.num_states()
 
@@ -255,6 +526,29 @@ class BuchiAutomaton(Automaton):
         return self.merge_edges()
 
     def simplify_states(self):
+        self.purge_states()
+
+        if self.should_merge_states():
+            self.merge_states()
+
+        return self
+
+    # merge_states is by far the most expensive pass, so the simplification scheduler only runs it while it pays off
+    def simplification_passes(self):
+        passes = [('merge_edges', lambda aut: aut.merge_edges(), False),
+                  ('purge_states', lambda aut: aut.purge_states(), False)]
+
+        if self.should_merge_states():
+            passes.append(('merge_states', lambda aut: aut.merge_states(), True))
+
+        return passes
+
+    def should_merge_states(self):
+        return settings.use_heuristics() or self.num_states() < 50000
+
+    # Removes dead, unreachable and useless states (i.e., everything but merging equivalent states)
+    def purge_states(self):
+        self.mark_changed()
         self.get_aut().purge_dead_states()
         settings.log(3, lambda: 'after purge_dead_states: {}'.format(self.num_states()))
         self.get_aut().purge_unreachable_states()
@@ -267,12 +561,6 @@ class BuchiAutomaton(Automaton):
             self.aut = spot.sat_minimize(self.get_aut())
             settings.log(3, lambda: 'after sat_minimize: {}'.format(self.num_states()))
 
-        if settings.use_heuristics():
-            self.merge_states()
-        else:
-            if self.num_states() < 50000:
-                self.merge_states()
-
         return self
 
     def postprocess(self):
@@ -290,7 +578,10 @@ class BuchiAutomaton(Automaton):
 
             settings.log(3, lambda: 'Postprocessing (before) using {}: {} states and {} edges'.format(postprocess_settings, self.num_states(), self.num_edges()))
 
+            start_time = time.time()
+            self.mark_changed()
             self.aut = self.aut.postprocess(*postprocess_settings)
+            profile_op('postprocess', self, start_time)
 
             settings.log(3, lambda: 'Postprocessing (after): {} states and {} edges'.format(self.num_states(), self.num_edges()))
         return self
@@ -299,11 +590,13 @@ class BuchiAutomaton(Automaton):
         return self.postprocess()
 
     def merge_states(self):
+        self.mark_changed()
         self.get_aut().merge_states()
         settings.log(3, lambda: 'after merge_states: {}'.format(self.num_states()))
         return self
 
     def merge_edges(self):
+        self.mark_changed()
         self.get_aut().merge_edges()
         return self
 
@@ -315,75 +608,93 @@ class BuchiAutomaton(Automaton):
 
         acc_word.simplify()
 
-        var_names = []
-        for formula in list(acc_word.prefix) + list(acc_word.cycle):
-            for f in spot.atomic_prop_collect(spot.bdd_to_formula(formula)):
-                var_names.append(f.ap_name())
+        # Read the assignments straight out of the BDDs, instead of going through formulas
+        ap_vars = {self.aut.register_ap(ap): ap.ap_name() for ap in self.aut.ap()}
+        prefixes = self.word_bits(ap_vars, acc_word.prefix)
+        cycles = self.word_bits(ap_vars, acc_word.cycle)
 
+        result = {}
         for var, aps in self.var_map.items():
-            for ap in aps:
-                if not ap in var_names:
-                    var_names.append(ap)
+            result[var] = [(prefixes.get(ap, [False] * len(acc_word.prefix)), cycles.get(ap, [False] * len(acc_word.cycle))) for ap in aps]
 
-        var_names = sorted(list(set(var_names)))
-        prefixes = self.to_binary(var_names, acc_word.prefix)
-        cycles = self.to_binary(var_names, acc_word.cycle)
+        return result
 
-        ap_result = {}
-        for var_name in var_names:
-            ap_result[var_name] = (prefixes[var_name], cycles[var_name])
+    # Returns a dict from each ap in ap_vars.values() to its list of values in the sequence of letters `bdd_list`.
+    # Each BDD should be a cube (i.e., a conjunction of literals), which is guaranteed after simplifying the word.
+    def word_bits(self, ap_vars, bdd_list):
+        bits = {ap: [] for ap in ap_vars.values()}
 
-        result = {}
-        for var, aps in self.var_map.items():
-            result[var] = [ap_result[ap] for ap in aps]
+        for letter in bdd_list:
+            # If we don't find a value for a variable in this letter, that means it can be either True or False.
+            # We arbitrarily choose False.
+            vals = {}
+
+            cube = buddy.bdd_satone(letter)
+            while cube != buddy.bddtrue and cube != buddy.bddfalse:
+                var = buddy.bdd_var(cube)
+                if buddy.bdd_low(cube) == buddy.bddfalse:
+                    vals[var] = True
+                    cube = buddy.bdd_high(cube)
+                else:
+                    vals[var] = False
+                    cube = buddy.bdd_low(cube)
 
-        return result
+            for var, ap in ap_vars.items():
+                bits[ap].append(vals.get(var, False))
 
-    def to_binary(self, var_names, bdd_list):
-        var_vals = {k: [] for k in var_names}
+        return bits
 
-        for bdd in bdd_list[::-1]:
-            formula = spot.bdd_to_formula(bdd)
+    # Decodes an accepting word into integers, using `decoders`, a dict from variables to one of the functions in
+    # pecan.tools.numeration for its numeration system. Variables without a decoder, represented by more than one ap, or
+    # whose value isn't finite (i.e., doesn't end in 0^ω) are None.
+    def accepting_values(self, decoders):
+        word = self.accepting_word()
 
-            next_vals = {}
-            self.process_formula(next_vals, formula)
+        if word is None:
+            return None
 
-            # If we didn't find a value for a variable in this part of the formula, that means it can be either True or False.
-            # We arbitrarily choose False.
-            for var_name in var_names:
-                var_vals[var_name].insert(0, next_vals.get(var_name, False))
-
-        return var_vals
-
-    def process_formula(self, next_vals, formula):
-        if formula._is(spot.op_ap):
-            next_vals[formula.ap_name()] = True
-        elif formula._is(spot.op_Not):
-            next_vals[formula[0].ap_name()] = False
-        elif formula._is(spot.op_And):
-            for i in range(formula.size()):
-                self.process_formula(next_vals, formula[i])
-        elif formula._is(spot.op_tt):
-            pass
-        else:
-            raise Exception('Cannot process formula: {}'.format(formula))
+        result = {}
+        for var, reps in word.items():
+            decoder = decoders.get(var)
+            if decoder is None or len(reps) != 1 or any(reps[0][1]):
+                result[var] = None
+            else:
+                result[var] = decoder(reps[0][0])
+
+        return result
 
     def custom_convert(self, other):
         return BuchiAutomaton.as_buchi(other)
 
-    def shuffle(self, is_disj, other):
+    def shuffle(self, is_disj, other, postprocess=None):
         # Don't need to convert ourselves, but may need to convert other aut to Buchi
         aut_a = self
         aut_b = self.convert(other)
 
-        return merge_maps(ShuffleAutomata(aut_a.get_aut(), aut_b.get_aut()).shuffle(is_disj), aut_a.get_var_map(), aut_b.get_var_map())
+        return merge_maps(ShuffleAutomata(aut_a.get_aut(), aut_b.get_aut()).shuffle(is_disj, postprocess), aut_a.get_var_map(), aut_b.get_var_map())
 
     def to_str(self):
         return 'VAR_MAP: {}\n{}'.format(self.var_map.to_str(), self.aut.to_str('hoa'))
 
+    # Spot automata can't be pickled directly, so we go through HOA (e.g., to send automata between processes)
+    def __getstate__(self):
+        return { 'aut_type_name': self.aut_type_name, 'hoa': self.aut.to_str('hoa'), 'var_map': self.var_map.var_reps }
+
+    def __setstate__(self, state):
+        self.aut_type_name = state['aut_type_name']
+        self.aut = spot.automaton(state['hoa'])
+        self.var_map = VarMap(state['var_map'])
+
+        for ap in self.aut.ap():
+            BuchiAutomaton.update_counter(ap.ap_name())
+
     def save(self, filename):
-        with open(filename, 'w') as f:
-            f.write(self.to_str())
+        if filename.endswith('.pbin'):
+            from pecan.tools.pecan_bin import save_pecan_bin
+            save_pecan_bin(self, filename)
+        else:
+            with open(filename, 'w') as f:
+                f.write(self.to_str())
 
 def buchi_transform(original_aut, builder):
     # Build a new automata with different edges
@@ -437,18 +748,68 @@ class Substitution(Builder):
     def __init__(self, subs):
         self.subs = subs
 
+        # Most edges of an automaton share a small number of distinct labels, so we remember the
+        # rewritten condition for each BDD we have already seen (keyed by the BDD's node id).
+        self.memo = {}
+
+        self.pair = None
+        self.temp_vars = []
+
     def pre_build(self, new_aut):
         for k, v in self.subs.items():
             if type(v) is str:
                 self.subs[k] = buddy.bdd_ithvar(new_aut.register_ap(v))
 
-    def build_cond(self, cond):
-        # TODO: ideally we could use the bdd_veccompose to do them all at once instead of
-        #   one at a time, but spot doesn't expose the bdd_newpair function to python at the moment...
-        for var, new_formula in self.subs.items():
-            # old = cond
-            cond = buddy.bdd_compose(cond, new_formula, var)
-            # print('after ({} |-> {}), is now {}, was {}'.format(spot.bdd_to_formula(buddy.bdd_ithvar(var)), spot.bdd_to_formula(new_formula), spot.bdd_to_formula(cond), spot.bdd_to_formula(old)))
+        if hasattr(buddy, 'bdd_newpair'):
+            # Apply the whole substitution in one go via bdd_veccompose
+            self.pair = buddy.bdd_newpair()
+            for var, new_formula in self.subs.items():
+                buddy.bdd_setbddpair(self.pair, var, new_formula)
+        else:
+            # Older versions of spot don't expose bdd_newpair to python, so we have to compose one variable at a time.
+            # The substitution is meant to be simultaneous (e.g., swapping two aps), so if any of the new formulas mentions
+            # a variable that we are substituting, go through fresh temporary variables first.
+            support = buddy.bddtrue
+            for new_formula in self.subs.values():
+                support &= buddy.bdd_support(new_formula)
+
+            if any(buddy.bdd_implies(support, buddy.bdd_ithvar(var)) for var in self.subs):
+                first_stage = {}
+                second_stage = {}
+                for var, new_formula in self.subs.items():
+                    temp_var = new_aut.register_ap(BuchiAutomaton.fresh_ap())
+                    self.temp_vars.append(temp_var)
+                    first_stage[var] = buddy.bdd_ithvar(temp_var)
+                    second_stage[temp_var] = new_formula
+
+                self.stages = [first_stage, second_stage]
+            else:
+                self.stages = [self.subs]
+
+    def post_build(self, new_aut):
+        if self.pair is not None:
+            buddy.bdd_freepair(self.pair)
+            self.pair = None
+
+        for temp_var in self.temp_vars:
+            new_aut.unregister_ap(temp_var)
+
+    def compose(self, cond):
+        if self.pair is not None:
+            return buddy.bdd_veccompose(cond, self.pair)
+
+        for stage in self.stages:
+            for var, new_formula in stage.items():
+                cond = buddy.bdd_compose(cond, new_formula, var)
 
         return cond
 
+    def build_cond(self, cond):
+        key = cond.id()
+
+        new_cond = self.memo.get(key)
+        if new_cond is None:
+            new_cond = self.compose(cond)
+            self.memo[key] = new_cond
+
+        return new_cond
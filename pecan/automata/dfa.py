@@ -0,0 +1,119 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# Explicit DFAs over finite words, with integer states and integer symbols (0, ..., num_symbols - 1).
+# A DFA is always complete, and stores its transitions in one flat array: delta[q * num_symbols + a] is the successor of q on a.
+# FiniteAutomaton works symbolically (see pecan.automata.guarded_dfa), and uses these for minimization over its minterms.
+
+from array import array
+
+class DFA:
+    def __init__(self, num_symbols, delta, accepting, init):
+        self.num_symbols = num_symbols
+        self.delta = delta
+        self.accepting = accepting
+        self.init = init
+
+    def num_states(self):
+        return len(self.accepting)
+
+    def succ(self, q, sym):
+        return self.delta[q * self.num_symbols + sym]
+
+    def reachable_states(self):
+        m = self.num_symbols
+        seen = bytearray(self.num_states())
+        seen[self.init] = 1
+        order = [self.init]
+
+        i = 0
+        while i < len(order):
+            q = order[i]
+            for dst in self.delta[q * m:(q + 1) * m]:
+                if not seen[dst]:
+                    seen[dst] = 1
+                    order.append(dst)
+            i += 1
+
+        return order
+
+    # Hopcroft's algorithm. The result only has reachable states, numbered in BFS order, so equal languages give equal DFAs.
+    def minimize(self):
+        m = self.num_symbols
+        order = self.reachable_states()
+        n = len(order)
+        index = {q: i for i, q in enumerate(order)}
+
+        delta = array('i', [0]) * (n * m)
+        for i, q in enumerate(order):
+            for sym, dst in enumerate(self.delta[q * m:(q + 1) * m]):
+                delta[i * m + sym] = index[dst]
+        accepting = [self.accepting[q] for q in order]
+
+        # inv[sym][q] are the predecessors of q on sym
+        inv = [[[] for _ in range(n)] for _ in range(m)]
+        for q in range(n):
+            for sym in range(m):
+                inv[sym][delta[q * m + sym]].append(q)
+
+        blocks = [block for block in [set(q for q in range(n) if accepting[q]), set(q for q in range(n) if not accepting[q])] if block]
+        block_of = array('i', [0]) * n
+        for b, block in enumerate(blocks):
+            for q in block:
+                block_of[q] = b
+
+        work = set([min(range(len(blocks)), key=lambda b: len(blocks[b]))]) if len(blocks) > 1 else set()
+        while work:
+            splitter = list(blocks[work.pop()])
+
+            for sym in range(m):
+                touched = {}
+                for q in splitter:
+                    for p in inv[sym][q]:
+                        touched.setdefault(block_of[p], set()).add(p)
+
+                for b, states in touched.items():
+                    block = blocks[b]
+                    if len(states) == len(block):
+                        continue
+
+                    block -= states
+                    new_b = len(blocks)
+                    blocks.append(states)
+                    for q in states:
+                        block_of[q] = new_b
+
+                    if b in work or len(states) <= len(block):
+                        work.add(new_b)
+                    else:
+                        work.add(b)
+
+        quotient_delta = array('i', [0]) * (len(blocks) * m)
+        quotient_accepting = bytearray(len(blocks))
+        for b, block in enumerate(blocks):
+            q = next(iter(block))
+            quotient_accepting[b] = accepting[q]
+            for sym in range(m):
+                quotient_delta[b * m + sym] = block_of[delta[q * m + sym]]
+
+        quotient = DFA(m, quotient_delta, quotient_accepting, block_of[0])
+        return quotient.renumber()
+
+    # Renumbers the reachable states in BFS order from the initial state (visiting successors in symbol order)
+    def renumber(self):
+        m = self.num_symbols
+        order = self.reachable_states()
+        index = {q: i for i, q in enumerate(order)}
+
+        delta = array('i')
+        for q in order:
+            delta.extend(index[dst] for dst in self.delta[q * m:(q + 1) * m])
+
+        return DFA(m, delta, bytearray(self.accepting[q] for q in order), 0)
+
+    def __eq__(self, other):
+        return other is not None and type(other) is DFA and self.num_symbols == other.num_symbols and \
+               self.init == other.init and self.accepting == other.accepting and self.delta == other.delta
+
+    def __hash__(self):
+        return hash((self.num_symbols, self.init, bytes(self.accepting)))
@@ -3,13 +3,138 @@
 
 import itertools as it
 
+import buddy
+import spot
+
 from pecan.automata.automaton import Automaton, FalseAutomaton
+from pecan.automata.guarded_dfa import GuardedNFA, GuardedDFA, SubsetConstruction, bit_var, bdd_iff
 from pecan.utility import VarMap
 from pecan.settings import settings
 
-import PySimpleAutomata.NFA as NFA
-
-# import foma.foma.python.foma as foma
+# Letters are encoded symbolically (see pecan.automata.guarded_dfa): the i-th letter of a variable's (sorted) alphabet is
+# i written in binary over that variable's bits, which are called __fin_<var>_<j>.
+
+def normalize_var_map(var_map):
+    return {v: (idx, tuple(sorted(alphabet))) for v, (idx, alphabet) in var_map.items()}
+
+def alphabets_of(var_map):
+    alphabets = [None] * len(var_map)
+    for v, (idx, alphabet) in var_map.items():
+        alphabets[idx] = alphabet
+    return alphabets
+
+def num_bits(alphabet):
+    return max(1, (len(alphabet) - 1).bit_length())
+
+def var_bits(var_name, alphabet):
+    return [bit_var('__fin_{}_{}'.format(var_name, j)) for j in range(num_bits(alphabet))]
+
+def var_cube(var_name, alphabet):
+    cube = buddy.bddtrue
+    for var in var_bits(var_name, alphabet):
+        cube &= buddy.bdd_ithvar(var)
+    return cube
+
+def letter_guard(var_name, alphabet, letter_idx):
+    guard = buddy.bddtrue
+    for j, var in enumerate(var_bits(var_name, alphabet)):
+        guard &= buddy.bdd_ithvar(var) if (letter_idx >> j) & 1 else buddy.bdd_not(buddy.bdd_ithvar(var))
+    return guard
+
+# The encodings of valid letters of every variable in the var map
+def domain_of(var_map):
+    domain = buddy.bddtrue
+    for v, (_, alphabet) in var_map.items():
+        valid = buddy.bddfalse
+        for i in range(len(alphabet)):
+            valid |= letter_guard(v, alphabet, i)
+        domain &= valid
+    return domain
+
+# The states of the Büchi automaton `aut` (with state-based acceptance) from which it accepts 0^ω, where `zero` is the
+# letter 0: i.e., the states that can reach an accepting cycle using only edges that can read `zero`
+def zero_accepting_states(aut, zero):
+    n = aut.num_states()
+    succs = [[] for _ in range(n)]
+    for e in aut.edges():
+        if e.cond & zero != buddy.bddfalse:
+            succs[e.src].append((e.dst, aut.acc().accepting(e.acc)))
+
+    # Tarjan's algorithm (iteratively, so deep automata don't overflow the stack) to find the SCCs with an accepting cycle
+    index = [-1] * n
+    low = [0] * n
+    on_stack = bytearray(n)
+    stack = []
+    good = set()
+    counter = 0
+
+    for root in range(n):
+        if index[root] >= 0:
+            continue
+
+        work = [(root, 0)]
+        while work:
+            q, i = work.pop()
+            if i == 0:
+                index[q] = low[q] = counter
+                counter += 1
+                stack.append(q)
+                on_stack[q] = 1
+
+            if i < len(succs[q]):
+                work.append((q, i + 1))
+                dst, _ = succs[q][i]
+                if index[dst] < 0:
+                    work.append((dst, 0))
+                elif on_stack[dst]:
+                    low[q] = min(low[q], index[dst])
+                continue
+
+            for dst, _ in succs[q]:
+                if on_stack[dst] and index[dst] > index[q]:
+                    low[q] = min(low[q], low[dst])
+
+            if low[q] == index[q]:
+                scc = set()
+                while True:
+                    p = stack.pop()
+                    on_stack[p] = 0
+                    scc.add(p)
+                    if p == q:
+                        break
+
+                if any(acc and dst in scc for p in scc for dst, acc in succs[p]):
+                    good |= scc
+
+    # Everything that can reach an accepting cycle
+    preds = [[] for _ in range(n)]
+    for q in range(n):
+        for dst, _ in succs[q]:
+            preds[dst].append(q)
+
+    todo = list(good)
+    while todo:
+        q = todo.pop()
+        for p in preds[q]:
+            if p not in good:
+                good.add(p)
+                todo.append(p)
+
+    return good
+
+# A guard matching the letter 0 of every variable in the var map (i.e., the padding of natural numbers)
+def zero_guard(var_map):
+    guard = buddy.bddtrue
+    for v, (_, alphabet) in var_map.items():
+        guard &= letter_guard(v, alphabet, 0)
+    return guard
+
+# A guard matching exactly the symbol given by `letters` (one for each variable, in the order of the var map)
+def symbol_guard(var_map, letters):
+    guard = buddy.bddtrue
+    for v, (idx, alphabet) in var_map.items():
+        guard &= letter_guard(v, alphabet, alphabet.index(letters[idx]))
+    return guard
 
 class FiniteAutomaton(Automaton):
     fresh_counter = 0
@@ -28,6 +153,143 @@ class FiniteAutomaton(Automaton):
             ap_num = int(ap_name.split('var')[1])
             FiniteAutomaton.id = max(FiniteAutomaton.id, ap_num) + 1
 
+    # Builds an automaton from the PySimpleAutomata-style dictionary format used by .fsa files (see finite_loader.py),
+    # which may be nondeterministic
+    @classmethod
+    def from_dict(cls, aut, var_map):
+        var_map = normalize_var_map(var_map)
+
+        initial_states = aut['initial_states'] if 'initial_states' in aut else {aut['initial_state']}
+
+        state_ids = {}
+        nfa = GuardedNFA()
+        for state in aut['states']:
+            state_ids[state] = nfa.add_state(state in aut['accepting_states'])
+        nfa.initial_states = set(state_ids[state] for state in initial_states)
+
+        guards = {}
+        for (src, sym_str), dsts in aut['transitions'].items():
+            if sym_str not in guards:
+                guards[sym_str] = symbol_guard(var_map, sym_str.split(' ') if len(var_map) > 0 else [])
+
+            for dst in ([dsts] if isinstance(dsts, str) else dsts):
+                nfa.add_edge(state_ids[src], guards[sym_str], state_ids[dst])
+
+        return FiniteAutomaton(nfa.determinize(domain_of(var_map)), var_map)
+
+    # Builds the DFA accepting the finite words w such that `buchi` accepts w0^ω. If every variable is a natural number,
+    # this loses nothing, and everything else (complement, projection, checking universality, etc.) is much cheaper.
+    # Each variable's letter is the tuple of its aps, so its bits are exactly its aps.
+    @classmethod
+    def from_buchi(cls, buchi):
+        # Make sure we have state-based Büchi acceptance, which zero_accepting_states relies on. Postprocessing works in
+        # place, and `buchi` may be shared (e.g., a predicate's evaluated body, or a memoized automaton), so use a copy
+        aut = buchi.get_aut()
+        if not aut.is_sba():
+            aut = buchi.clone().postprocess().get_aut()
+
+        var_map = {}
+        renames = {}
+        constraint = buddy.bddtrue
+        zero = buddy.bddtrue
+        for i, (v, aps) in enumerate(buchi.get_var_map().items()):
+            alphabet = [format(n, '0{}b'.format(len(aps))) for n in range(1 << len(aps))] if len(aps) > 0 else ['0']
+            var_map[v] = (i, alphabet)
+
+            for ap, bit in zip(aps, var_bits(v, alphabet)):
+                ap_var = aut.register_ap(ap)
+                zero &= buddy.bdd_not(buddy.bdd_ithvar(ap_var))
+
+                # Variables sharing an ap are equal
+                if ap_var in renames:
+                    constraint &= bdd_iff(renames[ap_var], buddy.bdd_ithvar(bit))
+                else:
+                    renames[ap_var] = buddy.bdd_ithvar(bit)
+
+        # Anything that isn't part of a variable can be anything
+        other_aps = buddy.bddtrue
+        for ap in aut.ap():
+            if aut.register_ap(ap) not in renames:
+                other_aps &= buddy.bdd_ithvar(aut.register_ap(ap))
+
+        memo = {}
+        def rename(cond):
+            if cond.id() not in memo:
+                guard = buddy.bdd_exist(cond, other_aps)
+                for ap_var, bit in renames.items():
+                    guard = buddy.bdd_compose(guard, bit, ap_var)
+                memo[cond.id()] = (cond, guard & constraint)
+            return memo[cond.id()][1]
+
+        accepting = zero_accepting_states(aut, zero)
+
+        nfa = GuardedNFA([aut.get_init_state_number()])
+        for q in range(aut.num_states()):
+            nfa.add_state(q in accepting)
+        for e in aut.edges():
+            nfa.add_edge(e.src, rename(e.cond), e.dst)
+
+        return FiniteAutomaton(SubsetConstruction(nfa, domain_of(var_map)), var_map, nat_words=True)
+
+    # The inverse of from_buchi: accepts w0^ω for each w that we accept
+    def to_buchi(self):
+        from pecan.automata.buchi import BuchiAutomaton
+        from pecan.automata.automaton import TrueAutomaton
+
+        if self.special_attr == 'true':
+            return BuchiAutomaton.as_buchi(TrueAutomaton())
+        elif self.special_attr == 'false':
+            return BuchiAutomaton.as_buchi(FalseAutomaton())
+
+        twa = spot.make_twa_graph()
+        twa.set_buchi()
+
+        buchi_var_map = VarMap()
+        renames = {}
+        zero = buddy.bddtrue
+        for v in self.var_order():
+            _, alphabet = self.var_map[v]
+            num_aps = len(alphabet[0]) if len(alphabet) > 1 else 0
+            buchi_var_map[v] = [BuchiAutomaton.canonical_ap(v, j) for j in range(num_aps)]
+
+            for j, bit in enumerate(var_bits(v, alphabet)):
+                if j < num_aps:
+                    renames[bit] = buddy.bdd_ithvar(twa.register_ap(buchi_var_map[v][j]))
+                    zero &= buddy.bdd_not(renames[bit])
+                else:
+                    renames[bit] = buddy.bddfalse
+
+        memo = {}
+        def rename(guard):
+            if guard.id() not in memo:
+                cond = guard
+                for bit, ap in renames.items():
+                    cond = buddy.bdd_compose(cond, ap, bit)
+                memo[guard.id()] = (guard, cond)
+            return memo[guard.id()][1]
+
+        dead = self.aut.dead_states()
+
+        # The extra state at the end reads the padding 0^ω
+        padding = self.aut.num_states()
+        twa.new_states(self.aut.num_states() + 1)
+        twa.set_init_state(self.aut.init)
+
+        for q, out in enumerate(self.aut.edges):
+            if q in dead:
+                continue
+
+            for guard, dst in out:
+                if dst not in dead:
+                    twa.new_edge(q, dst, rename(guard))
+
+            if self.aut.accepting[q]:
+                twa.new_edge(q, padding, zero)
+
+        twa.new_edge(padding, padding, zero, [0])
+
+        return BuchiAutomaton(twa, buchi_var_map)
+
     @classmethod
     def as_finite(cls, aut):
         if aut.get_aut_type() == 'true':
@@ -38,46 +300,67 @@ class FiniteAutomaton(Automaton):
             raise NotImplementedError('No known conversion from {} to NFA.'.format(aut.get_aut_type()))
 
     def custom_convert(self, other):
+        if other.get_aut_type() in ['true', 'false']:
+            return self.constant(other.get_aut_type())
+        elif self.nat_words and other.get_aut_type() == 'buchi':
+            return FiniteAutomaton.from_buchi(other)
         return FiniteAutomaton.as_finite(other)
 
     @classmethod
     def true_aut(cls):
-        f = FiniteAutomaton({
-                'alphabet': set(),
-                'states': set(),
-                'initial_states': set(),
-                'accepting_states': set(),
-                'transitions': {}
-            }, {})
+        f = FiniteAutomaton(None, {})
         f.special_attr = 'true'
         return f
 
     @classmethod
     def false_aut(cls):
-        f = FiniteAutomaton({
-                'alphabet': set(),
-                'states': set(),
-                'initial_states': set(),
-                'accepting_states': set(),
-                'transitions': {}
-            }, {})
+        f = FiniteAutomaton(None, {})
         f.special_attr = 'false'
         return f
 
-    def __init__(self, aut, var_map):
+    def __init__(self, aut, var_map, nat_words=False):
         super().__init__('finite')
 
-        # The internal automaton representation
-        self.aut = aut
+        # The internal automaton representation (see pecan.automata.guarded_dfa): a GuardedDFA, or, after a projection, a
+        # SubsetConstruction that is only finished (and minimized) once something needs the whole DFA
+        self._aut = aut
 
         # A map (V \to (N x Sigma)) mapping variables to their index in the symbol and the alphabet of the symbol
-        self.var_map = var_map
+        self.var_map = normalize_var_map(var_map)
 
         self.special_attr = None
 
+        # Whether each word w stands for the infinite word w0^ω (i.e., every variable is a natural number, written in
+        # binary, least significant digit first), so that we accept w iff we accept w0 (see from_buchi)
+        self.nat_words = nat_words
+
+    # A new automaton over the same kind of words as this one
+    def derive(self, aut, var_map):
+        return FiniteAutomaton(aut, var_map, self.nat_words)
+
+    # The special true or false automaton, over the same kind of words as this one
+    def constant(self, truth_value):
+        res = self.derive(None, {})
+        res.special_attr = truth_value
+        return res
+
+    @property
+    def aut(self):
+        if isinstance(self._aut, SubsetConstruction):
+            self._aut = self._aut.result().minimize()
+        return self._aut
+
     def get_var_map(self):
         return self.var_map
 
+    def clone(self):
+        # Automata are never modified in place, so we can share it
+        res = self.derive(self._aut, dict(self.var_map))
+        res.special_attr = self.special_attr
+        res.simplified = self.simplified
+        return res
+
+    # Guards only mention the bits of the variables they constrain, so the automata themselves don't need to change
     def augment_vars(self, other):
         new_var_map = dict(self.var_map)
         cur_idx = len(new_var_map)
@@ -87,48 +370,7 @@ class FiniteAutomaton(Automaton):
                 new_var_map[v] = (cur_idx, alphabet)
                 cur_idx += 1
 
-        new_l = self.with_var_map(new_var_map)
-        new_r = other.with_var_map(new_var_map)
-
-        return new_l, new_r, new_var_map
-
-    def with_var_map(self, new_var_map):
-        alphabets = list(range(len(new_var_map)))
-        for v, (idx, alphabet) in new_var_map.items():
-            alphabets[idx] = alphabet
-
-        if len(alphabets) == 0:
-            new_alphabet = set()
-        else:
-            new_alphabet = set(' '.join(syms) for syms in it.product(*alphabets))
-
-        new_transitions = {}
-        for (src, sym), dsts in self.aut['transitions'].items():
-            new_syms = list(range(len(new_var_map)))
-
-            # Copy over the old symbols
-            syms = sym.split(' ')
-            for v, (idx, alphabet) in self.var_map.items():
-                # If a symbol isn't in the new map, just drop it
-                if v in new_var_map:
-                    new_syms[new_var_map[v][0]] = [syms[idx]]
-
-            for v, (idx, alphabet) in new_var_map.items():
-                if not v in self.var_map:
-                    new_syms[idx] = alphabet
-
-            for new_sym in it.product(*new_syms):
-                new_transitions[(src, ' '.join(new_sym))] = dsts
-
-        # Rename all states because PySimpleAutomata can't union automata with the same state names...
-        # TODO: Probably very inefficient.
-        return NFA.rename_nfa_states({
-            'alphabet': new_alphabet,
-            'states': self.aut['states'],
-            'initial_states': self.aut['initial_states'],
-            'accepting_states': self.aut['accepting_states'],
-            'transitions': new_transitions
-        }, FiniteAutomaton.fresh_ap())
+        return self.aut, other.aut, new_var_map
 
     def conjunction(self, other):
         if self.special_attr == 'true' or other.special_attr == 'false':
@@ -137,100 +379,92 @@ class FiniteAutomaton(Automaton):
             return self
         else:
             aut_l, aut_r, new_var_map = self.augment_vars(other)
-            return FiniteAutomaton(NFA.nfa_intersection(aut_l, aut_r), new_var_map)
+            return self.derive(aut_l.product(aut_r, lambda a, b: a and b), new_var_map)
 
     def disjunction(self, other):
-        if self.special_attr == 'true' or other.special_attr == 'true':
+        if self.special_attr == 'true' or other.special_attr == 'false':
             return self
-        elif self.special_attr == 'false' or other.special_attr == 'false':
+        elif self.special_attr == 'false' or other.special_attr == 'true':
             return other
         else:
             aut_l, aut_r, new_var_map = self.augment_vars(other)
-            return FiniteAutomaton(NFA.nfa_union(aut_l, aut_r), new_var_map)
+            return self.derive(aut_l.product(aut_r, lambda a, b: a or b), new_var_map)
 
     def complement(self):
         if self.special_attr == 'true':
-            return FiniteAutomaton.false_aut()
+            return self.constant('false')
         elif self.special_attr == 'false':
-            return FiniteAutomaton.true_aut()
+            return self.constant('true')
         else:
-            # print('PERFORMING COMPLEMENT')
-            # print(self.relabel_states().to_str())
-            new_aut = NFA.nfa_complementation(self.aut)
-
-            # Convert to an NFA
-            new_aut['initial_states'] = {new_aut.pop('initial_state')}
-            new_aut['transitions'] = {k: [v] for k, v in new_aut.pop('transitions').items()}
-
-            res = FiniteAutomaton(new_aut, self.var_map)
-            # print(res.relabel_states().to_str())
-            return res
+            return self.derive(self.aut.complement(), self.var_map)
 
     def relabel(self):
         return self
 
     def substitute(self, arg_map, env_var_map):
+        if self.special_attr is not None:
+            return self
+
         new_var_map = {}
-        unified = {}
 
         for formal_arg, actual_arg in arg_map.items():
-            # If we see repeats, only keep the first in the var map, but we need to keep track so we can adjust transitions appropriately later
-            if actual_arg in new_var_map:
-                unified[formal_arg] = new_var_map[actual_arg][0]
-            else:
+            # If we see repeats, only keep the first in the var map: the other formal arguments will read the same letter
+            if actual_arg not in new_var_map:
                 new_var_map[actual_arg] = self.var_map[formal_arg]
 
+        # Variables we weren't given an argument for keep their name
+        for v in self.var_map:
+            if v not in arg_map and v not in new_var_map:
+                new_var_map[v] = self.var_map[v]
+
         # Re-index the var map because we may have lost some variables to unification
         for i, v in enumerate(new_var_map.keys()):
             _, alphabet = new_var_map[v]
             new_var_map[v] = (i, alphabet)
 
-        alphabets = list(range(len(new_var_map)))
-        for v, (idx, alphabet) in new_var_map.items():
-            alphabets[idx] = alphabet
-        new_alphabet = set(' '.join(syms) for syms in it.product(*alphabets))
-
-        new_transitions = {}
-        for (src, sym), dsts in self.aut['transitions'].items():
-            # Check if we should keep this transition, meaning that all positions
-            # that were unified have the same letter for this transition
-            new_sym = list(range(len(new_var_map)))
-            keep = True
-
-            syms = sym.split(' ')
-            for v, (idx, alphabet) in self.var_map.items():
-                # If a symbol isn't in the new map, just drop it
-                if v in unified:
-                    keep &= syms[idx] == syms[unified[v]]
-                else:
-                    # Copy over the symbol, using the new name of the variable
-                    new_name = arg_map[v]
-                    new_sym[new_var_map[new_name][0]] = syms[idx]
-
-            if keep:
-                new_transitions[(src, ' '.join(new_sym))] = dsts
-
-        aut = {
-            'alphabet': new_alphabet,
-            'states': self.aut['states'],
-            'initial_states': self.aut['initial_states'],
-            'accepting_states': self.aut['accepting_states'],
-            'transitions': new_transitions
-        }
+        renamed = {formal: actual for formal, actual in arg_map.items() if formal in self.var_map and formal != actual}
+        if len(renamed) == 0:
+            return self.derive(self._aut, new_var_map)
+
+        # Rename the bits of each formal argument to those of its actual argument. Formal and actual arguments may overlap
+        # (e.g., when swapping two variables), so go through temporary bits first; formal arguments with the same actual
+        # argument end up constrained to be equal.
+        to_temp = buddy.bddtrue
+        from_temp = buddy.bddtrue
+        formal_cube = buddy.bddtrue
+        temp_cube = buddy.bddtrue
+
+        temp_idx = 0
+        for formal, actual in renamed.items():
+            _, alphabet = self.var_map[formal]
+            for formal_bit, actual_bit in zip(var_bits(formal, alphabet), var_bits(actual, new_var_map[actual][1])):
+                temp_bit = bit_var('__fintmp{}'.format(temp_idx))
+                temp_idx += 1
+
+                to_temp &= bdd_iff(buddy.bdd_ithvar(formal_bit), buddy.bdd_ithvar(temp_bit))
+                from_temp &= bdd_iff(buddy.bdd_ithvar(temp_bit), buddy.bdd_ithvar(actual_bit))
+                formal_cube &= buddy.bdd_ithvar(formal_bit)
+                temp_cube &= buddy.bdd_ithvar(temp_bit)
 
-        return FiniteAutomaton(aut, new_var_map)
+        def rename(guard):
+            guard = buddy.bdd_exist(guard & to_temp, formal_cube)
+            return buddy.bdd_exist(guard & from_temp, temp_cube)
+
+        return self.derive(self.aut.map_guards(rename), new_var_map)
 
     def project(self, var_refs, env_var_map):
         from pecan.lang.ir.prog import VarRef
 
-        # print('Projecting', self.var_map, var_refs)
-        # print(self.relabel_states().to_str())
+        if self.special_attr is not None:
+            return self
 
         new_var_map = dict(self.var_map)
+        proj_cube = buddy.bddtrue
         for v in var_refs:
             # It may not be there (e.g., it's perfectly valid to do "exists x. y = y", even if it's pointless)
             if isinstance(v, VarRef) and v.var_name in new_var_map:
-                popped_idx, _ = new_var_map.pop(v.var_name)
+                popped_idx, alphabet = new_var_map.pop(v.var_name)
+                proj_cube &= var_cube(v.var_name, alphabet)
 
                 # Shift down all indices of the new var map
                 for new_v, (old_idx, alphabet) in new_var_map.items():
@@ -240,14 +474,31 @@ class FiniteAutomaton(Automaton):
         # If we've become empty, return one of the special false or true automata
         if len(new_var_map) == 0:
             if self.is_empty():
-                return FiniteAutomaton.false_aut()
+                return self.constant('false')
             else:
-                return FiniteAutomaton.true_aut()
+                return self.constant('true')
+        elif len(new_var_map) == len(self.var_map):
+            return self
         else:
-            new_aut = self.with_var_map(new_var_map)
-            res = FiniteAutomaton(new_aut, new_var_map)
-            # print(res.relabel_states().to_str())
-            return res
+            nfa = self.aut.exist(proj_cube)
+
+            # Over the naturals, the witness for the projected variables may be longer than the other variables, which
+            # then get padded with zeros: so we accept if we can get to an accepting state by reading zeros
+            if self.nat_words:
+                nfa.saturate(zero_guard(new_var_map))
+
+            return self.derive(SubsetConstruction(nfa, domain_of(new_var_map)), new_var_map)
+
+    def simplify_states(self):
+        if self.special_attr is not None:
+            return self
+
+        # Finishing a pending subset construction already minimizes it
+        if isinstance(self._aut, SubsetConstruction):
+            self.aut
+            return self
+
+        return self.derive(self.aut.minimize(), self.var_map)
 
     def is_empty(self):
         if self.special_attr == 'true':
@@ -255,95 +506,138 @@ class FiniteAutomaton(Automaton):
         elif self.special_attr == 'false':
             return True
         else:
-            return not NFA.nfa_nonemptiness_check(self.aut)
+            # If we're still a pending subset construction, this stops at the first accepting subset
+            return self._aut.is_empty()
+
+    def is_universal(self):
+        if self.special_attr == 'true':
+            return True
+        elif self.special_attr == 'false':
+            return False
+        else:
+            # If we're still a pending subset construction, this stops at the first rejecting subset
+            return self._aut.is_universal()
 
     def truth_value(self):
         if self.is_empty(): # If we accept nothing, we are false
             return 'false'
-        elif self.complement().is_empty(): # If our complement accepts nothing, we accept everything, so we are true
+        elif self.is_universal(): # If we accept everything, we are true
             return 'true'
         else: # Otherwise, we are neither true nor false: i.e., not all variables have been eliminated
             return 'sometimes'
 
     def relabel_states(self):
-        state_map = {}
-        for i, s in enumerate(self.aut['states']):
-            state_map[s] = str(i)
-
-        new_initial_states = { state_map[s] for s in self.aut['initial_states'] }
-        new_accepting_states = { state_map[s] for s in self.aut['accepting_states'] }
-        new_transitions = { (state_map[src], sym): {state_map[dst] for dst in dsts} for (src, sym), dsts in self.aut['transitions'].items() }
-
-        new_aut = {
-            'alphabet': self.aut['alphabet'],
-            'states': set(state_map.values()),
-            'initial_states': new_initial_states,
-            'accepting_states': new_accepting_states,
-            'transitions': new_transitions
-        }
+        return self
 
-        return FiniteAutomaton(new_aut, self.var_map)
+    def var_order(self):
+        var_order = [None] * len(self.var_map)
+        for v, (idx, alphabet) in self.var_map.items():
+            var_order[idx] = v
+        return var_order
+
+    # Some symbol (as a list of letters, in the order of the var map) matching `guard`
+    def pick_letters(self, guard):
+        letters = []
+        for v in self.var_order():
+            _, alphabet = self.var_map[v]
+            for i, letter in enumerate(alphabet):
+                restricted = guard & letter_guard(v, alphabet, i)
+                if restricted != buddy.bddfalse:
+                    guard = restricted
+                    letters.append(letter)
+                    break
+        return letters
 
     def accepting_word(self):
-        # mostly copied from PySimpleAutomata's emptiness checking code
-
-        # BFS
-        symbol_history = {}
-
-        queue = list()
-        visited = set()
-        for state in self.aut['initial_states']:
-            visited.add(state)
-            queue.append(state)
-
-        final_state = None
-        while queue:
-            state = queue.pop(0)
-            visited.add(state)
-            for a in self.aut['alphabet']:
-                if (state, a) in self.aut['transitions']:
-                    for next_state in self.aut['transitions'][state, a]:
-                        # keep track of where we've been
-                        if next_state in self.aut['accepting_states']:
-                            symbol_history[next_state] = (state, a)
-                            final_state = next_state
-                            break
-                        if next_state not in visited:
-                            symbol_history[next_state] = (state, a)
-                            queue.append(next_state)
-
-        if final_state is not None:
-            from pecan.lib.praline.builtins import as_praline
-            res = []
-            while not final_state in self.aut['initial_states']:
-                final_state, next_sym = symbol_history[final_state]
-                # print(final_state, ':', next_sym)
-                res.append(next_sym)
-
-            var_order = list(range(len(self.var_map)))
-            for v, (idx, alphabet) in self.var_map.items():
-                var_order[idx] = v
-            return { ' '.join(var_order): res[::-1] }
-
-        return None
+        if self.nat_words:
+            return self.to_buchi().accepting_word()
+
+        if self.special_attr is not None:
+            return None
+
+        path = self._aut.shortest_path()
+        if path is None:
+            return None
+
+        return { ' '.join(self.var_order()): [' '.join(self.pick_letters(guard)) for guard in path] }
+
+    # A pending subset construction doesn't have a size yet, and we don't want to finish it just to report one (e.g.,
+    # IRNode.evaluate asks after every node), so it reports -1, which the evaluator and simplifier skip
+    def is_pending(self):
+        return isinstance(self._aut, SubsetConstruction) and self._aut.dfa is None
 
     def num_states(self):
-        return len(self.aut['states'])
+        if self.special_attr is not None:
+            return 1
+        if self.is_pending():
+            return -1
+        return self.aut.num_states()
 
     def num_edges(self):
-        return len(self.aut['transitions'])
+        if self.special_attr is not None:
+            return 0
+        if self.is_pending():
+            return -1
+        return self.aut.num_edges()
+
+    def accepting_values(self, decoders):
+        if self.nat_words:
+            return self.to_buchi().accepting_values(decoders)
+        return super().accepting_values(decoders)
 
     # Should return a string of SVG data
     def show(self):
-        return str(self.aut)
+        if self.nat_words:
+            return self.to_buchi().show()
+        return str(self.to_dict())
 
     def get_aut(self):
         return self.aut
 
+    # The PySimpleAutomata-style dictionary format used by .fsa files, which lists every symbol explicitly
+    def to_dict(self):
+        if self.special_attr is not None:
+            return {'states': set(), 'initial_states': set(), 'accepting_states': set(), 'transitions': {}}
+
+        symbols = [(' '.join(letters), symbol_guard(self.var_map, letters)) for letters in it.product(*alphabets_of(self.var_map))]
+        dead = self.aut.dead_states()
+
+        transitions = {}
+        for q in range(self.aut.num_states()):
+            if q in dead:
+                continue
+
+            for sym_str, guard in symbols:
+                dst = self.aut.succ(q, guard)
+                if dst is not None and dst not in dead:
+                    transitions[(str(q), sym_str)] = [str(dst)]
+
+        return {
+            'alphabet': set(sym_str for sym_str, _ in symbols),
+            'states': set(str(q) for q in range(self.aut.num_states()) if q not in dead),
+            'initial_states': {str(self.aut.init)} if self.aut.init not in dead else set(),
+            'accepting_states': set(str(q) for q in range(self.aut.num_states()) if self.aut.accepting[q]),
+            'transitions': transitions
+        }
+
     def to_str(self):
-        return '{}'.format({'var_map': self.var_map, 'special_attr': self.special_attr, 'aut': self.aut})
+        return '{}'.format({'var_map': self.var_map, 'special_attr': self.special_attr, 'aut': self.to_dict()})
 
     def save(self, filename):
+        if self.nat_words:
+            self.to_buchi().save(filename)
+            return
+
         with open(filename, 'w') as f:
             f.write(self.to_str())
 
+# Used in finite words mode (see IRNode.convert_for_mode)
+def to_finite_words(aut):
+    if aut is not None and aut.get_aut_type() == 'buchi':
+        return FiniteAutomaton.from_buchi(aut)
+    return aut
+
+def from_finite_words(aut):
+    if aut is not None and aut.get_aut_type() == 'finite' and aut.nat_words:
+        return aut.to_buchi()
+    return aut
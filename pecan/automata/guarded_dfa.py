@@ -0,0 +1,360 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# Finite automata over a symbolic alphabet: like the Buchi backend, edges are labeled with BDDs (guards) over bits, rather
+# than with individual symbols. Each variable's letter is encoded in binary (least significant bit first) over its own
+# bits (see FiniteAutomaton), so adding a variable doesn't change any guard, and projecting one away is just bdd_exist.
+#
+# A GuardedDFA is deterministic and complete over its `domain` (the encodings of valid letters): the guards leaving each
+# state are disjoint, and together cover the domain.
+
+from array import array
+from collections import deque
+
+import buddy
+import spot
+
+from pecan.automata.dfa import DFA
+
+_anchor = None
+_bit_vars = {}
+
+# The BDD variable for the bit called `name`. Bits are registered in spot's BDD dictionary, like the Buchi automata's aps.
+def bit_var(name):
+    global _anchor
+
+    if name not in _bit_vars:
+        # Keeps the registration alive for the rest of the run
+        if _anchor is None:
+            _anchor = spot.make_twa_graph()
+        _bit_vars[name] = _anchor.register_ap(name)
+
+    return _bit_vars[name]
+
+def bdd_iff(a, b):
+    return (a & b) | (buddy.bdd_not(a) & buddy.bdd_not(b))
+
+class GuardedNFA:
+    def __init__(self, initial_states=None):
+        # For each state, a list of (guard, successor) pairs, whose guards may overlap
+        self.edges = []
+        self.accepting = []
+
+        self.initial_states = set(initial_states or [])
+
+    def num_states(self):
+        return len(self.edges)
+
+    def add_state(self, accepting=False):
+        self.edges.append([])
+        self.accepting.append(accepting)
+        return len(self.edges) - 1
+
+    def add_edge(self, src, guard, dst):
+        if guard != buddy.bddfalse:
+            self.edges[src].append((guard, dst))
+
+    # Makes every state accepting if it can reach an accepting state by reading only letters matching `guard`
+    def saturate(self, guard):
+        preds = [[] for _ in range(self.num_states())]
+        for q, out in enumerate(self.edges):
+            for edge_guard, dst in out:
+                if edge_guard & guard != buddy.bddfalse:
+                    preds[dst].append(q)
+
+        todo = [q for q in range(self.num_states()) if self.accepting[q]]
+        while todo:
+            q = todo.pop()
+            for p in preds[q]:
+                if not self.accepting[p]:
+                    self.accepting[p] = True
+                    todo.append(p)
+
+        return self
+
+    def determinize(self, domain):
+        return SubsetConstruction(self, domain).result()
+
+# The subset construction of a GuardedNFA, built on the fly: subsets are only expanded (in BFS order) when a query needs
+# them, so is_empty, is_universal and shortest_path can stop at the first subset that decides them, without building the
+# whole DFA. The alphabet leaving each subset is split into the regions that lead to the same subset of successors.
+class SubsetConstruction:
+    def __init__(self, nfa, domain):
+        self.nfa = nfa
+        self.domain = domain
+
+        start = frozenset(nfa.initial_states)
+        self.subset_ids = {start: 0}
+        self.subsets = [start]
+        self.accepting = bytearray([any(nfa.accepting[q] for q in start)])
+
+        # For each subset, the (subset, guard) it was first reached from, for recovering shortest paths
+        self.parents = [None]
+
+        # The outgoing edges of the subsets expanded so far
+        self.edges = []
+
+        self.dfa = None
+
+    def add_subset(self, subset, parent, guard):
+        if subset not in self.subset_ids:
+            self.subset_ids[subset] = len(self.subsets)
+            self.subsets.append(subset)
+            self.accepting.append(any(self.nfa.accepting[q] for q in subset))
+            self.parents.append((parent, guard))
+        return self.subset_ids[subset]
+
+    def expand_next(self):
+        i = len(self.edges)
+
+        regions = {frozenset(): self.domain}
+        for q in self.subsets[i]:
+            for guard, dst in self.nfa.edges[q]:
+                not_guard = buddy.bdd_not(guard)
+
+                new_regions = {}
+                for dsts, region in regions.items():
+                    for key, part in [(dsts | {dst}, region & guard), (dsts, region & not_guard)]:
+                        if part != buddy.bddfalse:
+                            new_regions[key] = new_regions[key] | part if key in new_regions else part
+                regions = new_regions
+
+        self.edges.append([(region, self.add_subset(dsts, i, region)) for dsts, region in regions.items()])
+
+    # Expands subsets until finding one satisfying `pred` (checking each as soon as it's discovered), returning its
+    # index, or None if no reachable subset satisfies it
+    def find(self, pred):
+        checked = 0
+        while True:
+            while checked < len(self.subsets):
+                if pred(checked):
+                    return checked
+                checked += 1
+
+            if len(self.edges) == len(self.subsets):
+                return None
+            self.expand_next()
+
+    def is_empty(self):
+        return self.find(lambda i: self.accepting[i]) is None
+
+    def is_universal(self):
+        return self.find(lambda i: not self.accepting[i]) is None
+
+    # The guards along a shortest path to an accepting subset, or None if there isn't one.
+    # Subsets are discovered in BFS order, so the first accepting one is as close as possible to the initial subset.
+    def shortest_path(self):
+        i = self.find(lambda i: self.accepting[i])
+        if i is None:
+            return None
+
+        path = []
+        while self.parents[i] is not None:
+            i, guard = self.parents[i]
+            path.append(guard)
+        return path[::-1]
+
+    def result(self):
+        if self.dfa is None:
+            while len(self.edges) < len(self.subsets):
+                self.expand_next()
+            self.dfa = GuardedDFA(self.edges, self.accepting, 0, self.domain)
+        return self.dfa
+
+class GuardedDFA:
+    def __init__(self, edges, accepting, init, domain):
+        self.edges = edges
+        self.accepting = accepting
+        self.init = init
+        self.domain = domain
+
+    @staticmethod
+    def constant(domain, accept):
+        return GuardedDFA([[(domain, 0)]], bytearray([accept]), 0, domain)
+
+    def num_states(self):
+        return len(self.edges)
+
+    def succ(self, q, cube):
+        for guard, dst in self.edges[q]:
+            if guard & cube != buddy.bddfalse:
+                return dst
+        return None
+
+    def reachable_states(self):
+        seen = set([self.init])
+        order = [self.init]
+
+        i = 0
+        while i < len(order):
+            for _, dst in self.edges[order[i]]:
+                if dst not in seen:
+                    seen.add(dst)
+                    order.append(dst)
+            i += 1
+
+        return order
+
+    # The (non-accepting) states from which no word is accepted
+    def dead_states(self):
+        preds = [[] for _ in range(self.num_states())]
+        for q, out in enumerate(self.edges):
+            for _, dst in out:
+                preds[dst].append(q)
+
+        alive = bytearray(self.accepting)
+        todo = [q for q in range(self.num_states()) if alive[q]]
+        while todo:
+            q = todo.pop()
+            for p in preds[q]:
+                if not alive[p]:
+                    alive[p] = 1
+                    todo.append(p)
+
+        return set(q for q in range(self.num_states()) if not alive[q])
+
+    def num_edges(self):
+        dead = self.dead_states()
+        return sum(1 for out in self.edges for _, dst in out if dst not in dead)
+
+    def is_empty(self):
+        return not any(self.accepting[q] for q in self.reachable_states())
+
+    def is_universal(self):
+        return all(self.accepting[q] for q in self.reachable_states())
+
+    def complement(self):
+        return GuardedDFA(self.edges, bytearray(1 - a for a in self.accepting), self.init, self.domain)
+
+    # The synchronous product with `other`, accepting according to `combine`.
+    # The operands may constrain different variables; the result is complete over the conjunction of their domains.
+    def product(self, other, combine):
+        pair_ids = {(self.init, other.init): 0}
+        pairs = [(self.init, other.init)]
+
+        res_edges = []
+        accepting = bytearray()
+
+        i = 0
+        while i < len(pairs):
+            p, q = pairs[i]
+            accepting.append(bool(combine(self.accepting[p], other.accepting[q])))
+
+            out = {}
+            for guard_p, dst_p in self.edges[p]:
+                for guard_q, dst_q in other.edges[q]:
+                    guard = guard_p & guard_q
+                    if guard == buddy.bddfalse:
+                        continue
+
+                    if (dst_p, dst_q) not in pair_ids:
+                        pair_ids[(dst_p, dst_q)] = len(pairs)
+                        pairs.append((dst_p, dst_q))
+
+                    dst = pair_ids[(dst_p, dst_q)]
+                    out[dst] = out[dst] | guard if dst in out else guard
+            res_edges.append([(guard, dst) for dst, guard in out.items()])
+
+            i += 1
+
+        return GuardedDFA(res_edges, accepting, 0, self.domain & other.domain)
+
+    # Applies `f` to every guard (and the domain). `f` must come from a substitution of letters, so that the result stays
+    # deterministic and complete.
+    def map_guards(self, f):
+        memo = {}
+        def apply(guard):
+            if guard.id() not in memo:
+                memo[guard.id()] = (guard, f(guard))
+            return memo[guard.id()][1]
+
+        edges = [[(apply(guard), dst) for guard, dst in out] for out in self.edges]
+        edges = [[(guard, dst) for guard, dst in out if guard != buddy.bddfalse] for out in edges]
+        return GuardedDFA(edges, self.accepting, self.init, apply(self.domain))
+
+    # The NFA with the bits in `cube` existentially quantified away
+    def exist(self, cube):
+        nfa = GuardedNFA([self.init])
+        for q in range(self.num_states()):
+            nfa.add_state(self.accepting[q])
+
+        memo = {}
+        for q, out in enumerate(self.edges):
+            for guard, dst in out:
+                if guard.id() not in memo:
+                    memo[guard.id()] = (guard, buddy.bdd_exist(guard, cube))
+                nfa.add_edge(q, memo[guard.id()][1], dst)
+
+        return nfa
+
+    # Splits the domain into the coarsest regions ("minterms") that no guard distinguishes between
+    def minterms(self, states):
+        atoms = [self.domain]
+        seen = set()
+
+        for q in states:
+            for guard, _ in self.edges[q]:
+                if guard.id() in seen or guard == self.domain:
+                    continue
+                seen.add(guard.id())
+
+                not_guard = buddy.bdd_not(guard)
+                new_atoms = []
+                for atom in atoms:
+                    for part in [atom & guard, atom & not_guard]:
+                        if part != buddy.bddfalse:
+                            new_atoms.append(part)
+                atoms = new_atoms
+
+        return atoms
+
+    # Minimizes over the alphabet of minterms with Hopcroft's algorithm (see DFA.minimize); the result only has reachable states
+    def minimize(self):
+        states = self.reachable_states()
+        if self.domain == buddy.bddfalse:
+            return GuardedDFA([[]], bytearray([self.accepting[self.init]]), 0, self.domain)
+
+        atoms = self.minterms(states)
+        m = len(atoms)
+        index = {q: i for i, q in enumerate(states)}
+
+        delta = []
+        for q in states:
+            for atom in atoms:
+                for guard, dst in self.edges[q]:
+                    if atom & guard != buddy.bddfalse:
+                        delta.append(index[dst])
+                        break
+
+        explicit = DFA(m, array('i', delta), bytearray(self.accepting[q] for q in states), 0).minimize()
+
+        edges = []
+        for q in range(explicit.num_states()):
+            out = {}
+            for sym, atom in enumerate(atoms):
+                dst = explicit.succ(q, sym)
+                out[dst] = out[dst] | atom if dst in out else atom
+            edges.append([(guard, dst) for dst, guard in sorted(out.items())])
+
+        return GuardedDFA(edges, explicit.accepting, explicit.init, self.domain)
+
+    # The guards along a shortest path to an accepting state, or None if there isn't one
+    def shortest_path(self):
+        parent = {self.init: None}
+        queue = deque([self.init])
+
+        while queue:
+            q = queue.popleft()
+            if self.accepting[q]:
+                path = []
+                while parent[q] is not None:
+                    q, guard = parent[q]
+                    path.append(guard)
+                return path[::-1]
+
+            for guard, dst in self.edges[q]:
+                if dst not in parent:
+                    parent[dst] = (q, guard)
+                    queue.append(dst)
+
+        return None
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+import hashlib
+from collections import OrderedDict
+
+from pecan.lang.ir import *
+from pecan.lang.ir_fingerprint import IRFingerprint
+from pecan.settings import settings
+
+# Fingerprints IR nodes up to a consistent renaming of their variables. Each node's fingerprint is computed from those of
+# its children, and cached on the node (as `memo_fingerprint`), so that looking up every node of a definition in the memo
+# doesn't walk each subtree again.
+#
+# A fingerprint is (digest, variable names in order of first occurrence, names of called predicates, number of IR nodes
+# in the subtree). Inside a node,
+# variables are numbered by their first occurrence, and each child is written as its digest plus where each of its
+# variables falls in that numbering, so two nodes get the same digest iff they're the same up to renaming.
+class NodeFingerprint:
+    def compute(self, node):
+        cached = getattr(node, 'memo_fingerprint', None)
+        if cached is not None:
+            return cached
+
+        self.var_names = []
+        self.var_indices = {}
+        self.calls = set()
+        self.size = 1
+
+        structure = self.structure(node, top=True)
+
+        digest = hashlib.sha256(repr(structure).encode('utf-8')).hexdigest()
+        node.memo_fingerprint = (digest, self.var_names, frozenset(self.calls), self.size)
+        return node.memo_fingerprint
+
+    def var_index(self, var_name):
+        if var_name not in self.var_indices:
+            self.var_indices[var_name] = len(self.var_names)
+            self.var_names.append(var_name)
+        return self.var_indices[var_name]
+
+    # Like IRFingerprint.structure, except that nested IR nodes are replaced by their (cached) fingerprints
+    def structure(self, val, top=False):
+        if val is None or type(val) in [bool, int, float]:
+            return val
+        elif isinstance(val, str):
+            return str(val)
+        elif isinstance(val, VarRef):
+            return ('VarRef', self.var_index(val.var_name), self.structure(val.get_type()))
+        elif isinstance(val, AutLiteral):
+            return ('AutLiteral', val.content_key())
+        elif isinstance(val, IRNode) and not top:
+            digest, var_names, calls, size = NodeFingerprint().compute(val)
+            self.calls |= calls
+            self.size += size
+            return ('IRNode', digest, tuple(self.var_index(v) for v in var_names))
+        elif isinstance(val, (list, tuple)):
+            return (type(val).__name__, tuple(self.structure(v) for v in val))
+        elif isinstance(val, (set, frozenset)):
+            return ('set', tuple(sorted((self.structure(v) for v in val), key=repr)))
+        elif isinstance(val, dict):
+            return ('dict', tuple(sorted(((self.structure(k), self.structure(v)) for k, v in val.items()), key=repr)))
+        elif hasattr(val, '__dict__'):
+            if isinstance(val, Call):
+                self.calls.add(val.name)
+
+            fields = sorted((k, v) for k, v in vars(val).items() if k not in IRFingerprint.ignored_fields)
+            return (val.__class__.__name__, tuple((k, self.structure(v)) for k, v in fields))
+        else:
+            return repr(val)
+
+# Remembers the automata of previously evaluated predicate nodes, so that structurally identical nodes (up to a consistent
+# renaming of their variables) are only ever built once per program. For example, `x + y = z` and `a + b = c` share an entry.
+# Keys and copies aren't free, so by default only subformulas of at least settings.get_eval_memo_min_nodes() nodes are
+# memoized; small ones are quicker to just build again.
+class EvalMemo:
+    def __init__(self, max_size=None):
+        # Maps keys to (automaton, variable names in canonical order, cost), in least to most recently used order
+        self.entries = OrderedDict()
+
+        # The "size" of an entry is the number of states plus the number of edges of its automaton
+        self.max_size = max_size
+        self.total_size = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        # The part of the key that depends on the whole program (its context and types), which only changes between
+        # definitions (see start_definition)
+        self.env_key = None
+
+    def get_max_size(self):
+        if self.max_size is None:
+            return settings.get_eval_memo_size()
+        else:
+            return self.max_size
+
+    def enabled(self):
+        return self.get_max_size() > 0
+
+    def should_memoize(self, node):
+        if not self.enabled():
+            return False
+
+        _, _, _, size = NodeFingerprint().compute(node)
+        return size >= settings.get_eval_memo_min_nodes()
+
+    # Should be called before running each definition, which may change the context or types
+    def start_definition(self):
+        self.env_key = None
+
+    def key_for(self, prog, node):
+        node_digest, var_names, calls, _ = NodeFingerprint().compute(node)
+
+        canonical_names = {v: 'v{}'.format(i) for i, v in enumerate(var_names)}
+        def rename(var_name):
+            if var_name not in canonical_names:
+                canonical_names[var_name] = 'v{}'.format(len(canonical_names))
+            return canonical_names[var_name]
+
+        fingerprint = IRFingerprint(rename)
+
+        # Evaluating a node depends on the restrictions that are in scope for its variables.
+        # Looking up the restrictions may introduce new variables, so we keep going until we've seen all of them.
+        restrictions = []
+        i = 0
+        while i < len(canonical_names):
+            var_name = list(canonical_names)[i]
+            restrictions.append(fingerprint.structure(prog.get_restrictions(var_name)))
+            i += 1
+
+        # What we call depends on which predicates those names refer to right now, as well as the context and types
+        called_preds = tuple(sorted((name, id(prog.preds.get(name))) for name in calls | fingerprint.calls))
+        if self.env_key is None:
+            self.env_key = IRFingerprint().compute((prog.context, prog.types))
+
+        key = (node_digest, tuple(restrictions), called_preds, self.env_key, settings.get_simplication_level())
+
+        return repr(key), list(canonical_names)
+
+    def clear(self):
+        self.entries.clear()
+        self.total_size = 0
+
+    def lookup(self, prog, node):
+        key, var_names = self.key_for(prog, node)
+
+        if key not in self.entries:
+            self.misses += 1
+            return key, var_names, None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        aut, cached_var_names, _ = self.entries[key]
+
+        # Rename the variables of the cached automaton to the variables that this node uses
+        renaming = dict(zip(cached_var_names, var_names))
+        arg_map = {v: renaming.get(v, v) for v, _ in aut.get_var_map().items()}
+
+        result = aut.clone()
+        if arg_map:
+            result = result.substitute(arg_map, prog.get_var_map())
+
+        return key, var_names, result
+
+    def store(self, key, var_names, aut):
+        size = max(aut.num_states(), 0) + max(aut.num_edges(), 0)
+
+        # Don't let one huge automaton evict everything else
+        if size > self.get_max_size():
+            return
+
+        if key in self.entries:
+            self.total_size -= self.entries.pop(key)[2]
+
+        # Our caller keeps using (and possibly mutating) the automaton, so we keep our own copy
+        self.entries[key] = (aut.clone(), var_names, size)
+        self.total_size += size
+
+        while self.total_size > self.get_max_size() and self.entries:
+            _, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.total_size -= evicted_size
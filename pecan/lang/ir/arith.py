@@ -32,7 +32,7 @@ class Add(BinaryIRExpression):
 
         aut_add = prog.call('adder', [val_a, val_b, self.label_var()])
 
-        result = self.project_intermediates(prog, val_a, val_b, aut_a & aut_b & aut_add)
+        result = self.project_intermediates(prog, val_a, val_b, aut_a & aut_b, aut_add)
 
         return (result, self.label_var())
 
@@ -59,7 +59,7 @@ class Sub(BinaryIRExpression):
 
         aut_sub = prog.call('adder', [self.label_var(), val_b, val_a])
 
-        result = self.project_intermediates(prog, val_a, val_b, aut_a & aut_b & aut_sub)
+        result = self.project_intermediates(prog, val_a, val_b, aut_a & aut_b, aut_sub)
         return (result, self.label_var())
 
     def transform(self, transformer):
@@ -169,6 +169,15 @@ class IntConst(IRExpression):
         else:
             assert self.val >= 2, "constant here should be greater than or equal to 2, while it is {}".format(self.val)
 
+            from pecan.tools.aut_cache import get_cache
+            cache = get_cache()
+            cache_key = prog.get_cache_keys().node_key(self) if cache is not None else None
+            cached = cache.load(cache_key) if cache is not None else None
+
+            if cached is not None:
+                constants_map[(self.val, self.get_type())] = (cached.relabel(), self.label_var())
+                return constants_map[(self.val, self.get_type())]
+
             if self.val & (self.val - 1) == 0:
                 half = IntConst(self.val // 2)
                 result = Add(half, half).with_type(self.get_type())
@@ -189,6 +198,9 @@ class IntConst(IRExpression):
             if is_power_of_two(self.val):
                 result_aut.postprocess()
 
+            if cache is not None:
+                cache.store(cache_key, result_aut)
+
             constants_map[(self.val, self.get_type())] = (result_aut, val)
 
         return constants_map[(self.val, self.get_type())]
@@ -221,7 +233,7 @@ class Equals(BinaryIRPredicate):
 
         eq_aut = prog.call('equal', [val_a, val_b])
 
-        return self.project_intermediates(prog, val_a, val_b, eq_aut & aut_a & aut_b)
+        return self.project_intermediates(prog, val_a, val_b, eq_aut & aut_a, aut_b)
 
     def transform(self, transformer):
         return transformer.transform_Equals(self)
@@ -242,7 +254,7 @@ class Less(BinaryIRPredicate):
 
         aut_less = prog.call('less', [val_a, val_b])
 
-        return self.project_intermediates(prog, val_a, val_b, aut_a & aut_b & aut_less)
+        return self.project_intermediates(prog, val_a, val_b, aut_a & aut_b, aut_less)
 
     def transform(self, transformer):
         return transformer.transform_Less(self)
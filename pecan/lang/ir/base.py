@@ -4,6 +4,8 @@
 import time
 
 from pecan.settings import settings
+from pecan.tools.profiler import get_profiler
+from pecan.tools.mem_stats import check_memory_budget
 
 class IRNode:
     id = 0
@@ -43,36 +45,60 @@ class IRNode:
         return '{}{}'.format(' ' * prog.eval_level, s)
 
     def simplify(self, prog, aut):
-        self.show_aut_stats(prog, aut, desc='before simplify')
+        return prog.simplifier.simplify(self, prog, aut)
 
-        aut.simplify_edges()
-        self.show_aut_stats(prog, aut, desc='after simplify_edges')
+    def get_display_node(self, prog):
+        return self
 
-        aut.simplify_states()
-        self.show_aut_stats(prog, aut, desc='after simplify_states')
+    def should_memoize(self, prog):
+        return False
 
-        return aut
+    # In finite words mode (see Program.use_finite_words), every automaton is turned into a DFA as soon as it's built,
+    # and turned back into a Buchi automaton once we leave it
+    def convert_for_mode(self, prog, result):
+        if type(result) is tuple:
+            return (self.convert_for_mode(prog, result[0]),) + result[1:]
 
-    def get_display_node(self, prog):
-        return self
+        from pecan.automata.finite import to_finite_words, from_finite_words
+        if prog.use_finite_words():
+            return to_finite_words(result)
+        else:
+            return from_finite_words(result)
 
     def evaluate(self, prog):
         prog.eval_level += 1
 
         start_time = time.time()
 
-        result = self.evaluate_node(prog)
+        profiler = get_profiler()
+        if profiler is not None:
+            span = profiler.enter(str(self.get_display_node(prog)), self.__class__.__name__)
 
-        if type(result) is tuple:
-            sn, en = result[0].num_states(), result[0].num_edges()
+        result = None
+        memoize = self.should_memoize(prog)
+        if memoize:
+            memo_key, memo_var_names, result = prog.eval_memo.lookup(prog, self)
+            if result is not None:
+                settings.log(1, lambda: self.indented(prog, 'Reusing memoized automaton for {}'.format(self.get_display_node(prog))))
+
+        if result is not None:
+            result = self.convert_for_mode(prog, result)
         else:
-            sn, en = result.num_states(), result.num_edges()
+            result = self.convert_for_mode(prog, self.evaluate_node(prog))
 
-        if sn >= 0 and en >= 0:
             if type(result) is tuple:
-                result = (self.simplify(prog, result[0]), result[1])
+                sn, en = result[0].num_states(), result[0].num_edges()
             else:
-                result = self.simplify(prog, result)
+                sn, en = result.num_states(), result.num_edges()
+
+            if sn >= 0 and en >= 0:
+                if type(result) is tuple:
+                    result = (self.simplify(prog, result[0]), result[1])
+                else:
+                    result = self.simplify(prog, result)
+
+            if memoize:
+                prog.eval_memo.store(memo_key, memo_var_names, result)
 
         prog.eval_level -= 1
 
@@ -83,9 +109,14 @@ class IRNode:
 
         end_time = time.time()
 
+        if profiler is not None:
+            profiler.exit(span, result[0] if type(result) is tuple else result)
+
         if settings.should_write_statistics():
             prog.update_max_aut(sn, en, end_time - start_time)
 
+        check_memory_budget()
+
         if settings.get_debug_level() > 0 and sn >= 0 and en >= 0:
             settings.log(0, lambda: self.indented(prog, '{} has {} states and {} edges ({:.2f} seconds)'.format(self.get_display_node(prog), sn, en, end_time - start_time)))
 
@@ -142,7 +173,8 @@ class BinaryIRExpression(IRExpression):
         self.b = self.b.with_type(new_type)
         return super().with_type(new_type)
 
-    def project_intermediates(self, prog, val_a, val_b, aut):
+    # Projects the intermediate values out of `aut`, or out of `aut & other` if `other` is given (which is done without building the full product)
+    def project_intermediates(self, prog, val_a, val_b, aut, other=None):
         from pecan.lang.ir.prog import VarRef
 
         proj_vars = set()
@@ -153,7 +185,10 @@ class BinaryIRExpression(IRExpression):
         if not isinstance(self.b, VarRef):
             proj_vars.add(val_b)
 
-        return aut.project(proj_vars, prog.get_var_map())
+        if other is None:
+            return aut.project(proj_vars, prog.get_var_map())
+        else:
+            return aut.conjunction_project(other, proj_vars, prog.get_var_map())
 
     def __eq__(self, other):
         return other is not None and type(other) is self.__class__ and self.a == other.a and self.b == other.b and self.get_type() == other.get_type()
@@ -165,6 +200,9 @@ class IRPredicate(IRNode):
     def __init__(self):
         super().__init__()
 
+    def should_memoize(self, prog):
+        return prog.eval_memo.should_memoize(self)
+
     def evaluate_node(self, prog):
         raise NotImplementedError
 
@@ -174,7 +212,8 @@ class BinaryIRPredicate(IRPredicate):
         self.a = a
         self.b = b
 
-    def project_intermediates(self, prog, val_a, val_b, aut):
+    # Projects the intermediate values out of `aut`, or out of `aut & other` if `other` is given (which is done without building the full product)
+    def project_intermediates(self, prog, val_a, val_b, aut, other=None):
         from pecan.lang.ir.prog import VarRef
 
         proj_vars = set()
@@ -185,7 +224,10 @@ class BinaryIRPredicate(IRPredicate):
         if not isinstance(self.b, VarRef):
             proj_vars.add(val_b)
 
-        return aut.project(proj_vars, prog.get_var_map())
+        if other is None:
+            return aut.project(proj_vars, prog.get_var_map())
+        else:
+            return aut.conjunction_project(other, proj_vars, prog.get_var_map())
 
     def __eq__(self, other):
         return other is not None and type(other) is self.__class__ and self.a == other.a and self.b == other.b
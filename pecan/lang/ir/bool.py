@@ -4,20 +4,25 @@
 from pecan.lang.ir import *
 
 from pecan.automata.automaton import TrueAutomaton, FalseAutomaton
+from pecan.settings import settings
+from pecan.tools.mem_stats import check_memory_budget
 
 class Conjunction(BinaryIRPredicate):
     def __init__(self, a, b):
         super().__init__(a, b)
 
     def evaluate_node(self, prog):
-        a_aut = self.a.evaluate(prog)
-
-        if a_aut.is_empty():
-            return a_aut
-
-        b_aut = self.b.evaluate(prog)
-
-        return a_aut & b_aut
+        return ConjunctionPlanner(prog, self).evaluate()
+
+    # Flattens nested conjunctions, so (a ∧ (b ∧ c)) gives [a, b, c]
+    def conjuncts(self):
+        result = []
+        for node in [self.a, self.b]:
+            if type(node) is Conjunction:
+                result.extend(node.conjuncts())
+            else:
+                result.append(node)
+        return result
 
     def transform(self, transformer):
         return transformer.transform_Conjunction(self)
@@ -25,6 +30,126 @@ class Conjunction(BinaryIRPredicate):
     def __repr__(self):
         return '({} ∧ {})'.format(self.a, self.b)
 
+def aut_vars(aut):
+    return set(v for v, _ in aut.get_var_map().items())
+
+def aut_size(aut):
+    return max(aut.num_states(), 0)
+
+# Evaluates an n-ary conjunction, choosing the order of the products (like join ordering in a database) so that the
+# intermediate automata stay small. If `proj_vars` is given, those variables are projected away (existentially quantified)
+# as soon as no remaining conjunct mentions them, rather than only after building the whole product.
+class ConjunctionPlanner:
+    def __init__(self, prog, node, proj_vars=None):
+        self.prog = prog
+        self.node = node
+        self.proj_vars = {v.var_name: v for v in proj_vars or []}
+
+    def estimate(self, conjunct):
+        # The size of things we've already built is known, so do those first; otherwise, keep the source order
+        if type(conjunct) is BoolConst:
+            return 0
+        elif type(conjunct) is Call and conjunct.name in self.prog.preds:
+            pred = self.prog.preds[conjunct.name]
+            if pred.body_evaluated is not None:
+                return aut_size(pred.body_evaluated)
+
+        return float('inf')
+
+    # Returns the automata of the conjuncts, each with its index in `conjuncts`, in the order they were evaluated
+    def evaluate_conjuncts(self, conjuncts):
+        auts = []
+
+        # Stable sort, so conjuncts we know nothing about are evaluated in source order
+        for i in sorted(range(len(conjuncts)), key=lambda i: self.estimate(conjuncts[i])):
+            aut = conjuncts[i].evaluate(self.prog)
+
+            # If anything is empty, so is the whole conjunction, so there is no need to evaluate the rest
+            if aut.is_empty():
+                settings.log(1, lambda: self.node.indented(self.prog, 'Conjunct {} is empty, skipping the rest'.format(conjuncts[i])))
+                return [(i, aut)]
+
+            auts.append((i, aut))
+
+        return auts
+
+    # Returns (and forgets about) the variables in var_names that we need to project, but no remaining automaton uses
+    def unused_vars(self, var_names, remaining):
+        still_used = set()
+        for other in remaining:
+            still_used |= aut_vars(other)
+
+        to_project = [self.proj_vars.pop(v) for v in sorted(var_names) if v in self.proj_vars and v not in still_used]
+
+        if to_project:
+            settings.log(1, lambda: self.node.indented(self.prog, 'Projecting {} early'.format(to_project)))
+
+        return to_project
+
+    def project_unused(self, aut, remaining):
+        to_project = self.unused_vars(aut_vars(aut), remaining)
+
+        if not to_project:
+            return aut
+
+        return aut.project(to_project, self.prog.get_var_map())
+
+    def pick_next(self, acc, remaining):
+        acc_vars = aut_vars(acc)
+
+        def cost(i):
+            aut = remaining[i]
+            # Prefer automata that share variables with what we've built so far, as those constrain the product
+            shares_vars = len(aut_vars(aut) & acc_vars) > 0
+            return (not shares_vars, aut_size(aut))
+
+        return min(range(len(remaining)), key=cost)
+
+    def evaluate(self):
+        indexed_auts = self.evaluate_conjuncts(self.node.conjuncts())
+
+        # Mixing types of automata means the result type depends on the order, so go back to the source order then
+        aut_types = set(aut.get_aut_type() for _, aut in indexed_auts) - {'true', 'false'}
+        reorder = len(aut_types) <= 1
+
+        if not reorder:
+            indexed_auts.sort(key=lambda p: p[0])
+
+        auts = [aut for _, aut in indexed_auts]
+
+        # Variables only mentioned by one conjunct can be projected before doing any products
+        auts = [self.project_unused(aut, auts[:i] + auts[i + 1:]) for i, aut in enumerate(auts)]
+
+        if reorder:
+            start = min(range(len(auts)), key=lambda i: aut_size(auts[i]))
+        else:
+            start = 0
+
+        acc = auts.pop(start)
+
+        while auts:
+            if acc.is_empty():
+                return acc
+
+            i = self.pick_next(acc, auts) if reorder else 0
+            next_aut = auts.pop(i)
+
+            settings.log(1, lambda: self.node.indented(self.prog, 'Conjoining automata with {} and {} states'.format(aut_size(acc), aut_size(next_aut))))
+
+            to_project = self.unused_vars(aut_vars(acc) | aut_vars(next_aut), auts)
+            if to_project:
+                acc = acc.conjunction_project(next_aut, to_project, self.prog.get_var_map())
+            else:
+                acc = acc & next_aut
+
+            # Intermediate products don't go through IRNode.evaluate, so simplify them here
+            if acc.num_states() >= 0 and acc.num_edges() >= 0:
+                acc = self.node.simplify(self.prog, acc)
+
+            check_memory_budget()
+
+        return acc
+
 class Disjunction(BinaryIRPredicate):
     def __init__(self, a, b):
         super().__init__(a, b)
@@ -62,6 +187,9 @@ class BoolConst(IRPredicate):
         super().__init__()
         self.bool_val = bool_val
 
+    def should_memoize(self, prog):
+        return False
+
     def evaluate_node(self, prog):
         if self.bool_val:
             return TrueAutomaton()
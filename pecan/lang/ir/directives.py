@@ -9,6 +9,8 @@ from pecan.tools.hoa_loader import load_hoa
 from pecan.tools.labeled_aut_converter import convert_labeled_aut
 from pecan.tools.hoa_loader import load_hoa
 from pecan.tools.finite_loader import load_finite
+from pecan.tools.pecan_bin import load_pecan_bin
+from pecan.tools.aut_cache import file_digest
 from pecan.automata.buchi import BuchiAutomaton
 from pecan.lang.ir import *
 
@@ -120,10 +122,21 @@ class DirectiveAssertProp(IRNode):
         return Call(self.pred_name, []).evaluate(prog).truth_value()
 
     def evaluate(self, prog):
+        # Assertions don't change the program, so they can run alongside everything after them
+        if prog.parallel is not None:
+            return prog.parallel.submit(self)
+
         settings.log(lambda: f'[INFO] Checking if {self.pred_name} is {self.display_truth_val()}.')
 
+        stats_name = f'#assert_prop({self.truth_val}, {self.pred_name})'
+        if settings.should_write_statistics():
+            prog.start_max_aut(stats_name)
+
         pred_truth_value = self.pred_truth_value(prog)
 
+        if settings.should_write_statistics():
+            prog.report_max_aut(stats_name)
+
         if pred_truth_value == self.truth_val:
             result = Result(f'{self.pred_name} is {self.display_truth_val()}.', True)
         else:
@@ -151,6 +164,30 @@ class DirectiveAssertProp(IRNode):
     def __hash__(self):
         return hash((self.truth_val, self.pred_name))
 
+AUT_LOADERS = {
+    # TODO: Rename the APs of the loaded automaton to be the same as the args specified
+    'hoa': lambda realpath, arg_names: load_hoa(realpath),
+    'pecan-bin': lambda realpath, arg_names: load_pecan_bin(realpath),
+    'walnut': convert_aut,
+    'pecan': convert_labeled_aut,
+    'fsa-dict': load_finite,
+}
+
+def load_aut_file(realpath, aut_format, arg_names, pred):
+    start_time = time.time()
+    settings.log(lambda: f'[INFO] Loading {pred} from {realpath} in "{aut_format}" format.')
+
+    aut = AUT_LOADERS[aut_format](realpath, arg_names)
+
+    end_time = time.time()
+
+    settings.log(0, lambda: '[INFO] Loaded {} in {:.2f} seconds ({} states, {} edges).'.format(pred, end_time - start_time, aut.num_states(), aut.num_edges()))
+
+    return aut
+
+def load_source_key(realpath, aut_format, arg_names):
+    return '{}:{}:{}'.format(aut_format, arg_names, file_digest(realpath))
+
 class DirectiveLoadAut(IRNode):
     def __init__(self, filename, aut_format, pred):
         super().__init__()
@@ -160,27 +197,26 @@ class DirectiveLoadAut(IRNode):
 
     def evaluate(self, prog):
         # TODO: Support argument restrictions on loaded automata
-        start_time = time.time()
         realpath = prog.locate_file(self.filename)
-        settings.log(lambda: f'[INFO] Loading {self.pred} from {realpath} in "{self.aut_format}" format.')
-
-        if self.aut_format == 'hoa':
-            # TODO: Rename the APs of the loaded automaton to be the same as the args specified
-            aut = load_hoa(realpath)
-        elif self.aut_format == 'walnut':
-            aut = convert_aut(realpath, [v.var_name for v in self.pred.args])
-        elif self.aut_format == 'pecan':
-            aut = convert_labeled_aut(realpath, [v.var_name for v in self.pred.args])
-        elif self.aut_format == 'fsa-dict':
-            aut = load_finite(realpath, [v.var_name for v in self.pred.args])
-        else:
+        arg_names = [v.var_name for v in self.pred.args]
+
+        if self.aut_format not in AUT_LOADERS:
             raise Exception('Unknown format: {}'.format(self.aut_format))
 
-        end_time = time.time()
+        if settings.is_eager_load():
+            aut = load_aut_file(realpath, self.aut_format, arg_names, self.pred)
 
-        settings.log(0, lambda: '[INFO] Loaded {} in {:.2f} seconds ({} states, {} edges).'.format(self.pred, end_time - start_time, aut.num_states(), aut.num_edges()))
+            # Identify the literal by the contents of the file it came from (rather than by hashing the automaton itself)
+            source_key = None
+            if settings.get_cache_dir() is not None:
+                source_key = load_source_key(realpath, self.aut_format, arg_names)
 
-        prog.preds[self.pred.name] = NamedPred(self.pred.name, self.pred.args, {}, AutLiteral(aut))
+            body = AutLiteral(aut, source_key=source_key)
+        else:
+            # Only read the file once the predicate is actually used
+            body = LazyAutLiteral(realpath, self.aut_format, arg_names, self.pred)
+
+        prog.preds[self.pred.name] = NamedPred(self.pred.name, self.pred.args, {}, body)
 
         return None
 
@@ -205,9 +241,16 @@ class DirectiveImport(IRNode):
     def evaluate(self, prog):
         realpath = prog.locate_file(self.filename)
         from pecan.program import load
-        new_prog = load(realpath).copy_defaults(prog)
-        new_prog.evaluate()
-        prog.include(new_prog)
+        from pecan.tools.lib_snapshot import load_library
+        from pecan.tools.module_registry import module_registry
+
+        def evaluate_import():
+            new_prog = load(realpath).copy_defaults(prog)
+            new_prog.evaluate()
+            return new_prog
+
+        # Each module is only evaluated once per process (and, with snapshots, often not even that)
+        prog.include(module_registry.get(realpath, prog.context, lambda: load_library(realpath, prog.context, evaluate_import)))
         return None
 
     def transform(self, transformer):
@@ -6,7 +6,7 @@ from colorama import Fore, Style
 import os
 from functools import reduce
 import time
-from typing import Tuple
+from typing import Optional, Tuple
 
 from lark import Lark, Transformer, v_args
 import spot
@@ -44,15 +44,25 @@ class VarRef(IRExpression):
         return hash(self.var_name)
 
 class AutLiteral(IRPredicate):
-    def __init__(self, aut, display_node=None):
+    def __init__(self, aut, display_node=None, source_key=None):
         super().__init__()
         self.aut = aut
         self.is_int = False
         self.display_node = display_node
 
+        # Identifies the contents of the automaton (e.g., a hash of the file it was loaded from) for caching purposes
+        self.source_key = source_key
+
     def evaluate(self, prog):
         return self.aut
 
+    def content_key(self):
+        if self.source_key is None:
+            import hashlib
+            self.source_key = hashlib.sha256(self.aut.to_str().encode('utf-8')).hexdigest()
+
+        return self.source_key
+
     def transform(self, transformer):
         return transformer.transform_AutLiteral(self)
 
@@ -71,6 +81,49 @@ class AutLiteral(IRPredicate):
     def __hash__(self):
         return hash((self.aut))
 
+# The automaton from a #load directive, which is only read from the file the first time it's needed
+class LazyAutLiteral(AutLiteral):
+    def __init__(self, realpath, aut_format, arg_names, pred):
+        IRPredicate.__init__(self)
+        self.realpath = realpath
+        self.aut_format = aut_format
+        self.arg_names = arg_names
+        self.pred = pred
+        self.is_int = False
+        self.display_node = None
+        self.source_key = None
+
+        self.loaded_aut = None
+
+    @property
+    def aut(self):
+        if self.loaded_aut is None:
+            from pecan.lang.ir.directives import load_aut_file
+            self.loaded_aut = load_aut_file(self.realpath, self.aut_format, self.arg_names, self.pred)
+
+        return self.loaded_aut
+
+    def is_loaded(self):
+        return self.loaded_aut is not None
+
+    def content_key(self):
+        # We can identify the automaton by the file it comes from without having to load it
+        if self.source_key is None:
+            from pecan.lang.ir.directives import load_source_key
+            self.source_key = load_source_key(self.realpath, self.aut_format, self.arg_names)
+
+        return self.source_key
+
+    def __repr__(self):
+        return 'AutLiteral(#load({}, {}, {}))'.format(self.realpath, self.aut_format, repr(self.pred))
+
+    def __eq__(self, other):
+        return other is not None and type(other) is self.__class__ and \
+               self.realpath == other.realpath and self.aut_format == other.aut_format and self.arg_names == other.arg_names
+
+    def __hash__(self):
+        return hash((self.realpath, self.aut_format, tuple(self.arg_names)))
+
 class SpotFormula(IRPredicate):
     def __init__(self, formula_str):
         super().__init__()
@@ -182,6 +235,10 @@ class Call(IRPredicate):
     def evaluate_node(self, prog):
         return prog.call(self.name, self.args)
 
+    # Calls are already cheap (the callee's body is only evaluated once), so memoizing them would only add copying
+    def should_memoize(self, prog):
+        return False
+
     def transform(self, transformer):
         return transformer.transform_Call(self)
 
@@ -242,19 +299,39 @@ class NamedPred(IRNode):
 
         try:
             if self.body_evaluated is None:
-                # TODO: START AND FINISH HERE!!!!
-                if settings.should_write_statistics():
-                    prog.start_max_aut(self.name)
+                from pecan.tools.aut_cache import get_cache
+                from pecan.tools.aut_trace import enter_pred, exit_pred
+                from pecan.tools.profiler import get_profiler
+                cache = get_cache()
+                cache_key = prog.get_cache_keys().pred_key(self) if cache is not None else None
+                cached = cache.load(cache_key) if cache is not None else None
+
+                if cached is not None:
+                    settings.log(0, lambda: '[DEBUG] Loaded {} from the cache ({})'.format(self.name, cache_key))
+                    self.body_evaluated = cached.canonicalize()
+                else:
+                    # TODO: START AND FINISH HERE!!!!
+                    if settings.should_write_statistics():
+                        prog.start_max_aut(self.name)
 
-                self.body_evaluated = self.body.evaluate(prog).relabel()
+                    profiler = get_profiler()
+                    if profiler is not None:
+                        span = profiler.enter(self.name, 'NamedPred')
 
-                if settings.should_write_statistics():
-                    sn, en, runtime = prog.finish_max_aut(self.name)
-                    sn = max(self.body_evaluated.num_states(), sn)
-                    en = max(self.body_evaluated.num_edges(), en)
-                    print('[INFO] Max states for {} is {}'.format(self.name, sn))
-                    print('[INFO] Max edges for {} is {}'.format(self.name, en))
-                    print('[INFO] Runtime for {} is {}'.format(self.name, runtime))
+                    enter_pred(self.name)
+                    try:
+                        self.body_evaluated = self.body.evaluate(prog).canonicalize()
+                    finally:
+                        exit_pred()
+
+                    if profiler is not None:
+                        profiler.exit(span, self.body_evaluated)
+
+                    if settings.should_write_statistics():
+                        prog.report_max_aut(self.name, self.body_evaluated)
+
+                    if cache is not None:
+                        cache.store(cache_key, self.body_evaluated)
 
             if not arg_names:
                 return self.body_evaluated
@@ -296,6 +373,9 @@ class Program(IRNode):
         self.praline_defs = kwargs.get('praline_defs', {})
         self.praline_aliases = kwargs.get('praline_aliases', {})
 
+        # Every file that went into this program (see pecan.tools.lib_snapshot)
+        self.source_files = kwargs.get('source_files', set())
+
         # The current to-process index in self.defs
         # This is used for emitting new definitions via Praline (see Program.emit_definition and pecan.lib.praline.builtins.Emit)
         self.idx = None
@@ -305,16 +385,57 @@ class Program(IRNode):
 
         self.var_map = []
 
+        self.cache_keys = None
+
+        # Set while evaluating with --jobs (see pecan.tools.parallel_eval)
+        self.parallel = None
+
+        from pecan.lang.eval_memo import EvalMemo
+        self.eval_memo = EvalMemo()
+
+        from pecan.lang.simplifier import Simplifier
+        self.simplifier = Simplifier()
+
         from pecan.lang.type_inference import TypeInferer
         self.type_inferer = TypeInferer(self)
 
     def start_max_aut(self, name : str):
-        self.aut_stats[name] = { 'states': 0, 'edges': 0, 'runtime': 0 }
+        from pecan.tools.mem_stats import peak_rss
+
+        # Attribute the heap's peak so far to the names we were already tracking, so the new one starts afresh
+        heap = self.sample_heap()
+
+        self.aut_stats[name] = { 'states': 0, 'edges': 0, 'runtime': 0, 'rss_start': peak_rss(), 'heap_start': heap, 'heap_peak': heap }
         return self
 
-    def finish_max_aut(self, name : str) -> Tuple[int, int, float]:
+    # Returns the largest automaton's states and edges, the longest runtime of a single node, how much the process's peak
+    # RSS grew, and how far the Python heap peaked above where it started (None if unknown)
+    def finish_max_aut(self, name : str) -> Tuple[int, int, float, Optional[int], Optional[int]]:
+        from pecan.tools.mem_stats import peak_rss
+
+        self.sample_heap()
         stats = self.aut_stats.pop(name)
-        return stats['states'], stats['edges'], stats['runtime']
+
+        rss_end = peak_rss()
+        rss_delta = rss_end - stats['rss_start'] if rss_end is not None and stats['rss_start'] is not None else None
+        heap_delta = stats['heap_peak'] - stats['heap_start'] if stats['heap_start'] is not None else None
+
+        return stats['states'], stats['edges'], stats['runtime'], rss_delta, heap_delta
+
+    def report_max_aut(self, name : str, aut=None):
+        from pecan.tools.mem_stats import format_bytes
+
+        sn, en, runtime, rss_delta, heap_delta = self.finish_max_aut(name)
+        if aut is not None:
+            sn = max(aut.num_states(), sn)
+            en = max(aut.num_edges(), en)
+
+        print('[INFO] Max states for {} is {}'.format(name, sn))
+        print('[INFO] Max edges for {} is {}'.format(name, en))
+        print('[INFO] Runtime for {} is {}'.format(name, runtime))
+        print('[INFO] Peak RSS growth for {} is {}'.format(name, format_bytes(rss_delta)))
+        if heap_delta is not None:
+            print('[INFO] Peak Python heap growth for {} is {}'.format(name, format_bytes(heap_delta)))
 
     def update_max_aut(self, sn : int, en : int, runtime : float):
         for name in self.aut_stats:
@@ -324,9 +445,36 @@ class Program(IRNode):
 
             self.aut_stats[name]['runtime'] = max(self.aut_stats[name]['runtime'], runtime)
 
+        self.sample_heap()
+
+    # Updates the Python heap peak of everything we're tracking, returning the current heap size (None if not tracing)
+    def sample_heap(self):
+        from pecan.tools.mem_stats import sample_heap
+
+        sample = sample_heap()
+        if sample is None:
+            return None
+
+        current, peak = sample
+        for stats in self.aut_stats.values():
+            if stats['heap_start'] is not None:
+                stats['heap_peak'] = max(stats['heap_peak'], peak)
+
+        return current
+
     def get_var_map(self):
         return self.var_map[-1]
 
+    def use_finite_words(self):
+        return settings.use_finite_words() or self.context.get('finite_words') == 'true'
+
+    def get_cache_keys(self):
+        if self.cache_keys is None:
+            from pecan.tools.aut_cache import CacheKeys
+            self.cache_keys = CacheKeys(self)
+
+        return self.cache_keys
+
     def enter_praline_env(self, new_env=None):
         if new_env is None:
             self.praline_envs.append({})
@@ -390,6 +538,8 @@ class Program(IRNode):
         self.praline_defs.update(other_prog.praline_defs)
         self.praline_aliases.update(other_prog.praline_aliases)
 
+        self.source_files.update(other_prog.source_files)
+
     def include_with_restrictions(self, other_prog):
         self.include(other_prog)
 
@@ -407,6 +557,40 @@ class Program(IRNode):
         self.run_definition(self.idx + self.emit_offset, d)
 
     def run_definition(self, i, d):
+        from pecan.tools.profiler import get_profiler
+        from pecan.tools.mem_stats import MemoryBudgetExceeded, abort_message, release_memory
+
+        name = d.name if isinstance(d, NamedPred) else repr(d)
+
+        profiler = get_profiler()
+        if profiler is not None:
+            span = profiler.enter(name, 'definition')
+
+        eval_level = self.eval_level
+        tracked_names = set(self.aut_stats)
+
+        self.eval_memo.start_definition()
+
+        try:
+            return self.run_definition_body(i, d)
+        except (MemoryBudgetExceeded, MemoryError) as e:
+            # Give up on this definition, but keep going with the rest of the program
+            self.eval_level = eval_level
+            for stats_name in set(self.aut_stats) - tracked_names:
+                self.aut_stats.pop(stats_name)
+
+            # The memo holds on to the intermediate automata of the aborted definition
+            self.eval_memo.clear()
+            release_memory()
+
+            result = Result(abort_message(name, e), False)
+            settings.log(lambda: result.result_str())
+            return result
+        finally:
+            if profiler is not None:
+                profiler.exit(span)
+
+    def run_definition_body(self, i, d):
         from pecan.lang.typed_ir_lowering import TypedIRLowering
         from pecan.lang.optimizer.optimizer import UntypedOptimizer, Optimizer
 
@@ -429,15 +613,7 @@ class Program(IRNode):
         else:
             return d.evaluate(self)
 
-    def evaluate(self, old_env=None):
-        from pecan.lib.praline.builtins import builtins
-
-        for builtin in builtins:
-            builtin.evaluate(self)
-
-        if old_env is not None:
-            self.include(old_env)
-
+    def evaluate_defs(self):
         succeeded = True
         msgs = []
         self.idx = 0
@@ -450,16 +626,46 @@ class Program(IRNode):
             d = self.defs[self.idx]
 
             settings.log(0, lambda: '[DEBUG] Processing: {}'.format(d))
-            result = self.run_definition(self.idx, d)
-            if result is not None and type(result) is Result:
-                if result.failed():
-                    succeeded = False
-                    msgs.append(result.message())
+            if self.parallel is not None:
+                # Results are recorded by the evaluator, in source order
+                self.parallel.run_definition(self.idx, d)
+            else:
+                result = self.run_definition(self.idx, d)
+                if result is not None and type(result) is Result:
+                    if result.failed():
+                        succeeded = False
+                        msgs.append(result.message())
 
             self.idx += 1 + self.emit_offset
 
             self.exit_var_map_scope()
 
+        return succeeded, msgs
+
+    def evaluate(self, old_env=None, jobs=1):
+        from pecan.lib.praline.builtins import builtins
+
+        for builtin in builtins:
+            builtin.evaluate(self)
+
+        if old_env is not None:
+            self.include(old_env)
+
+        start_time = time.time()
+
+        from pecan.tools.parallel_eval import ParallelEvaluator
+        if jobs > 1 and ParallelEvaluator.supported():
+            with ParallelEvaluator(self, jobs) as parallel:
+                self.parallel = parallel
+                try:
+                    self.evaluate_defs()
+                finally:
+                    self.parallel = None
+
+            succeeded, msgs = parallel.succeeded, parallel.msgs
+        else:
+            succeeded, msgs = self.evaluate_defs()
+
         # Clear all restrictions. All relevant restrictions will be held inside the restriction_env of the relevant predicates.
         # Having them also in our restrictions list just leads to double restricting, which is a waste of computation time
         self.restrictions.clear()
@@ -467,6 +673,12 @@ class Program(IRNode):
 
         self.result = Result('\n'.join(msgs), succeeded)
 
+        if settings.should_write_statistics() and self.eval_memo.hits + self.eval_memo.misses > 0:
+            print('[INFO] Evaluation memo: {} hits, {} misses ({} entries)'.format(self.eval_memo.hits, self.eval_memo.misses, len(self.eval_memo.entries)))
+
+        if settings.should_write_statistics():
+            self.simplifier.report(time.time() - start_time)
+
         return self
 
     def transform(self, transformer):
@@ -626,6 +838,7 @@ class Program(IRNode):
         for path in self.search_paths:
             try_path = os.path.join(path, filename)
             if os.path.exists(try_path):
+                self.source_files.add(os.path.realpath(try_path))
                 return try_path
 
         raise FileNotFoundError(filename)
@@ -18,8 +18,16 @@ class Exists(IRPredicate):
                 prog.restrict(v.var_name, cond)
 
         all_constraints = self.get_prog_constraints(prog)
-        aut = self.with_cond(all_constraints + self.conds, self.pred).evaluate(prog)
-        res = aut.project(self.var_refs, prog.get_var_map())
+        body = self.with_cond(all_constraints + self.conds, self.pred)
+
+        if type(body) is Conjunction:
+            # Lets us project each variable as soon as we're done with it, rather than after building the whole product
+            planner = ConjunctionPlanner(prog, body, self.var_refs)
+            aut = planner.evaluate()
+            res = aut.project(list(planner.proj_vars.values()), prog.get_var_map())
+        else:
+            aut = body.evaluate(prog)
+            res = aut.project(self.var_refs, prog.get_var_map())
 
         for v, cond in zip(self.var_refs, self.conds):
             if cond is not None:
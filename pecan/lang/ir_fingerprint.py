@@ -0,0 +1,53 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+import hashlib
+
+from pecan.lang.ir import *
+
+# Computes a stable, content-based hash of an IR node (e.g., to use as a cache key).
+# Unlike __repr__, this includes everything that affects evaluation, such as the types of variables.
+class IRFingerprint:
+    # Fields that are caches or purely for display, and so don't change the meaning of a node
+    ignored_fields = {'body_evaluated', 'evaluated_value', 'display_node', 'memo_fingerprint'}
+
+    def __init__(self, rename=None):
+        # If provided, `rename` maps variable names to the name to use in the fingerprint.
+        # This lets us hash nodes "modulo renaming" of their variables.
+        self.rename = rename
+
+        # The names of all predicates called by the node(s) we have fingerprinted
+        self.calls = set()
+
+    def compute(self, node):
+        return hashlib.sha256(repr(self.structure(node)).encode('utf-8')).hexdigest()
+
+    def var_name(self, var_name):
+        if self.rename is None:
+            return var_name
+        else:
+            return self.rename(var_name)
+
+    def structure(self, val):
+        if val is None or type(val) in [bool, int, float]:
+            return val
+        elif isinstance(val, str):
+            return str(val)
+        elif isinstance(val, VarRef):
+            return ('VarRef', self.var_name(val.var_name), self.structure(val.get_type()))
+        elif isinstance(val, AutLiteral):
+            return ('AutLiteral', val.content_key())
+        elif isinstance(val, (list, tuple)):
+            return (type(val).__name__, tuple(self.structure(v) for v in val))
+        elif isinstance(val, (set, frozenset)):
+            return ('set', tuple(sorted((self.structure(v) for v in val), key=repr)))
+        elif isinstance(val, dict):
+            return ('dict', tuple(sorted(((self.structure(k), self.structure(v)) for k, v in val.items()), key=repr)))
+        elif hasattr(val, '__dict__'):
+            if isinstance(val, Call):
+                self.calls.add(val.name)
+
+            fields = sorted((k, v) for k, v in vars(val).items() if k not in self.ignored_fields)
+            return (val.__class__.__name__, tuple((k, self.structure(v)) for k, v in fields))
+        else:
+            return repr(val)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+import time
+
+from pecan.settings import settings
+from pecan.tools.profiler import profile_op
+
+# Decides which simplification passes to run on the automata built while evaluating (see IRNode.simplify).
+# - Automata that are already simplified, and haven't changed since (see Automaton.mark_changed), are skipped (e.g., the
+#   automata of predicates called without arguments).
+# - Automata with fewer than settings.get_simplify_min_states() states are skipped: they're about to be fed into a product,
+#   and simplifying them can't save much.
+# - Expensive passes (see Automaton.simplification_passes) are measured, and only keep running while they remove at least
+#   settings.get_simplify_min_gain() of the states on average. Skipped passes still run every so often, in case the
+#   automata we're building have changed character.
+class PassStats:
+    def __init__(self):
+        self.runs = 0
+        self.skipped = 0
+        self.skipped_since_run = 0
+        self.time = 0.0
+        self.states_before = 0
+        self.states_after = 0
+
+    def gain(self):
+        if self.states_before == 0:
+            return 0.0
+        return (self.states_before - self.states_after) / self.states_before
+
+class Simplifier:
+    # How many times we run an expensive pass before trusting its measurements, and how often we re-measure it
+    warmup_runs = 5
+    resample_every = 20
+
+    def __init__(self):
+        self.pass_stats = {}
+
+        self.time = 0.0
+        self.runs = 0
+        self.skipped_simplified = 0
+        self.skipped_small = 0
+
+    def stats_for(self, name):
+        if name not in self.pass_stats:
+            self.pass_stats[name] = PassStats()
+        return self.pass_stats[name]
+
+    def should_run(self, name):
+        stats = self.stats_for(name)
+
+        if stats.runs < Simplifier.warmup_runs or stats.skipped_since_run >= Simplifier.resample_every:
+            return True
+
+        return stats.gain() >= settings.get_simplify_min_gain()
+
+    def simplify(self, node, prog, aut):
+        sn, en = aut.num_states(), aut.num_edges()
+        if sn < 0 or en < 0 or settings.get_simplication_level() <= 0:
+            return aut
+
+        if aut.simplified:
+            self.skipped_simplified += 1
+            return aut
+
+        if sn < settings.get_simplify_min_states():
+            self.skipped_small += 1
+            return aut
+
+        start_time = time.time()
+        self.runs += 1
+
+        node.show_aut_stats(prog, aut, desc='before simplify')
+
+        for name, run_pass, expensive in aut.simplification_passes():
+            stats = self.stats_for(name)
+
+            if expensive and not self.should_run(name):
+                stats.skipped += 1
+                stats.skipped_since_run += 1
+                settings.log(3, lambda: node.indented(prog, 'Skipping {} (removed {:.1%} of states so far)'.format(name, stats.gain())))
+                continue
+
+            pass_start = time.time()
+            before = aut.num_states()
+
+            aut = run_pass(aut)
+            profile_op(name, aut, pass_start)
+
+            stats.runs += 1
+            stats.skipped_since_run = 0
+            stats.time += time.time() - pass_start
+            stats.states_before += before
+            stats.states_after += aut.num_states()
+
+            node.show_aut_stats(prog, aut, desc='after {}'.format(name))
+
+        aut.simplified = True
+
+        self.time += time.time() - start_time
+
+        return aut
+
+    def report(self, total_time):
+        print('[INFO] Simplification: {:.2f} seconds ({} runs, {} skipped as already simplified, {} skipped as too small); core operations: {:.2f} seconds'.format(
+            self.time, self.runs, self.skipped_simplified, self.skipped_small, max(0.0, total_time - self.time)))
+
+        for name, stats in self.pass_stats.items():
+            print('[INFO]     {}: {} runs, {} skipped, {:.2f} seconds, removed {:.1%} of states'.format(name, stats.runs, stats.skipped, stats.time, stats.gain()))
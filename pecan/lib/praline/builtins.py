@@ -129,11 +129,38 @@ class AcceptingWord(Builtin):
             acc_word = res.accepting_word()
 
         result = PralineList(None, None)
+        if acc_word is None:
+            return result
+
         for var_name, vs in acc_word.items():
             result = PralineList(PralineTuple([PralineString(var_name), as_praline(vs)]), result)
 
         return result
 
+class AcceptingValues(Builtin):
+    def __init__(self):
+        super().__init__(PralineVar('acceptingValues'), [PralineVar('pecanTerm')])
+
+    def evaluate(self, prog):
+        res = prog.praline_lookup('pecanTerm').evaluate(prog).get_term().evaluate(prog)
+
+        from pecan.tools.numeration import decoder_for
+
+        aut = res[0] if isinstance(res, tuple) else res
+        decoders = {var: decoder_for(prog, var) for var, _ in aut.get_var_map().items()}
+        acc_vals = aut.accepting_values(decoders)
+
+        # Only includes the variables whose type we know how to decode, and which have a finite value
+        result = PralineList(None, None)
+        if acc_vals is None:
+            return result
+
+        for var_name, val in acc_vals.items():
+            if val is not None:
+                result = PralineList(PralineTuple([PralineString(var_name), PralineInt(val)]), result)
+
+        return result
+
 class Compare(Builtin):
     def __init__(self):
         super().__init__(PralineVar('compare'), [PralineVar('a'), PralineVar('b')])
@@ -268,6 +295,7 @@ builtins = [
     Emit().definition(),
     FreshVar().definition(),
     AcceptingWord().definition(),
+    AcceptingValues().definition(),
     ToChars().definition(),
     Cons().definition(),
     Compare().definition(),
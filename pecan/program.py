@@ -33,12 +33,46 @@ def load(pecan_file, *args, **kwargs):
         return from_source(f.read(), *args, **kwargs)
 
 def from_source(source_code, *args, **kwargs):
+    filename = kwargs.get('filename', None)
+
+    # Only files are cached: the REPL's programs are small, and unlikely to be repeated
+    ir_cache = None
+    if filename is not None:
+        from pecan.tools.ir_cache import get_ir_cache, source_key
+        ir_cache = get_ir_cache()
+
+    prog = None
+    if ir_cache is not None:
+        key = source_key(source_code)
+        prog = ir_cache.load(key)
+        if prog is not None:
+            settings.log(0, lambda: '[DEBUG] Using cached IR for {}'.format(filename))
+
+    if prog is None:
+        prog = compile_source(source_code)
+
+        if ir_cache is not None:
+            ir_cache.store(key, prog)
+
+    prog.search_paths = make_search_paths(filename=filename)
+
+    if filename is not None:
+        prog.source_files.add(os.path.realpath(filename))
+
+    settings.log(0, lambda: 'Search path: {}'.format(prog.search_paths))
+
+    # Load the standard library
+    prog = settings.include_stdlib(prog, load, args, kwargs)
+
+    return prog
+
+# Parses the source code and runs the passes that only depend on the source code itself (and not, e.g., on the standard library)
+def compile_source(source_code):
     prog = pecan_parser.parse(source_code)
 
     settings.log(4, lambda: 'Parsed program:')
     settings.log(4, lambda: prog)
 
-    prog.search_paths = make_search_paths(filename=kwargs.get('filename', None))
     prog.loader = load
 
     if settings.get_extract_implications():
@@ -46,11 +80,6 @@ def from_source(source_code, *args, **kwargs):
 
     prog = ASTToIR().transform(prog)
 
-    settings.log(0, lambda: 'Search path: {}'.format(prog.search_paths))
-
-    # Load the standard library
-    prog = settings.include_stdlib(prog, load, args, kwargs)
-
     if settings.opt_enabled():
         prog = UntypedOptimizer(prog).optimize()
 
@@ -58,4 +87,3 @@ def from_source(source_code, *args, **kwargs):
         settings.log(1, lambda: prog)
 
     return prog
-
@@ -22,6 +22,20 @@ class Settings:
         self.extract_implications = False
         self.write_statistics = False
         self.output_hoa = None
+        self.trace_min_states = 0
+        self.trace_preds = None
+        self.trace_sample_rate = 1.0
+        self.cache_dir = None
+        self.cache_max_size = 1 << 30
+        self.eval_memo_size = 500000
+        self.eval_memo_min_nodes = 8
+        self.eager_load = False
+        self.snapshots = True
+        self.finite_words = False
+        self.simplify_min_states = 8
+        self.simplify_min_gain = 0.02
+        self.profile = None
+        self.memory_budget = None
 
         self.stdlib_prog = None
 
@@ -112,6 +126,120 @@ class Settings:
     def get_output_hoa(self):
         return self.output_hoa
 
+    # Filters for what gets written to the output HOA file (see pecan.tools.aut_trace)
+    def set_trace_min_states(self, min_states):
+        self.trace_min_states = min_states
+        return self
+
+    def get_trace_min_states(self):
+        return self.trace_min_states
+
+    # None means all predicates
+    def set_trace_preds(self, preds):
+        self.trace_preds = preds
+        return self
+
+    def get_trace_preds(self):
+        return self.trace_preds
+
+    def set_trace_sample_rate(self, rate):
+        self.trace_sample_rate = rate
+        return self
+
+    def get_trace_sample_rate(self):
+        return self.trace_sample_rate
+
+    def set_eager_load(self, val):
+        self.eager_load = val
+        return self
+
+    def is_eager_load(self):
+        return self.eager_load
+
+    # Whether to snapshot evaluated libraries in the cache directory (see pecan.tools.lib_snapshot)
+    def set_use_snapshots(self, val):
+        self.snapshots = val
+        return self
+
+    def use_snapshots(self):
+        return self.snapshots
+
+    # Whether to evaluate everything over finite words (i.e., as if every variable were a natural number), see
+    # FiniteAutomaton.from_buchi. This can also be turned on for part of a file with #context("finite_words", "true")
+    def set_finite_words(self, val):
+        self.finite_words = val
+        return self
+
+    def use_finite_words(self):
+        return self.finite_words
+
+    # Automata with fewer states than this aren't simplified after each operation (see pecan.lang.simplifier)
+    def set_simplify_min_states(self, min_states):
+        self.simplify_min_states = min_states
+        return self
+
+    def get_simplify_min_states(self):
+        return self.simplify_min_states
+
+    # Expensive simplification passes stop running once they remove less than this fraction of states on average
+    def set_simplify_min_gain(self, min_gain):
+        self.simplify_min_gain = min_gain
+        return self
+
+    def get_simplify_min_gain(self):
+        return self.simplify_min_gain
+
+    # Where to write the evaluation profile (see pecan.tools.profiler), or None to not profile
+    def set_profile(self, prefix):
+        self.profile = prefix
+        return self
+
+    def get_profile(self):
+        return self.profile
+
+    # The most memory (RSS, in bytes) we may use before aborting the current definition, or None for no limit
+    def set_memory_budget(self, budget):
+        self.memory_budget = budget
+        return self
+
+    def get_memory_budget(self):
+        return self.memory_budget
+
+    def get_default_cache_dir(self):
+        cache_home = os.getenv('XDG_CACHE_HOME') or (Path.home() / '.cache')
+        return os.path.join(str(cache_home), 'pecan')
+
+    # If the cache directory is None, then caching is disabled
+    def set_cache_dir(self, cache_dir):
+        self.cache_dir = cache_dir
+        return self
+
+    def get_cache_dir(self):
+        return self.cache_dir
+
+    def set_cache_max_size(self, max_size):
+        self.cache_max_size = max_size
+        return self
+
+    def get_cache_max_size(self):
+        return self.cache_max_size
+
+    # The maximum total size (states + edges) of automata kept in each program's evaluation memo; 0 disables it
+    def set_eval_memo_size(self, size):
+        self.eval_memo_size = size
+        return self
+
+    def get_eval_memo_size(self):
+        return self.eval_memo_size
+
+    # Only subformulas with at least this many IR nodes are memoized; 1 memoizes every node
+    def set_eval_memo_min_nodes(self, min_nodes):
+        self.eval_memo_min_nodes = min_nodes
+        return self
+
+    def get_eval_memo_min_nodes(self):
+        return self.eval_memo_min_nodes
+
     def log(self, level, msg=None):
         if msg is None:
             msg = level
@@ -132,8 +260,15 @@ class Settings:
                 self.set_debug_level(orig_debug_level - 1)
 
                 if self.stdlib_prog is None:
-                    self.stdlib_prog = loader(prog.locate_file('std.pn'), *args, **kwargs)
-                    self.stdlib_prog.evaluate()
+                    from pecan.tools.lib_snapshot import load_library
+
+                    def evaluate_stdlib():
+                        stdlib_prog = loader(stdlib_path, *args, **kwargs)
+                        stdlib_prog.evaluate()
+                        return stdlib_prog
+
+                    stdlib_path = prog.locate_file('std.pn')
+                    self.stdlib_prog = load_library(stdlib_path, {}, evaluate_stdlib)
 
                 prog.include(self.stdlib_prog)
             finally:
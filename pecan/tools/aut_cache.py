@@ -0,0 +1,229 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# A persistent, content-addressed cache of evaluated predicate automata.
+# Entries are keyed by a hash of everything that goes into evaluating a predicate: its (lowered and optimized) IR,
+# the keys of every predicate it may call, the contents of loaded automata files, and the relevant settings.
+#
+# The size limit (--cache-size) covers the whole cache directory, including the parsed files of pecan.tools.ir_cache and
+# the library snapshots of pecan.tools.lib_snapshot, which are evicted along with the automata, least recently used first.
+
+import hashlib
+import os
+import tempfile
+
+from pecan.settings import settings
+
+# Every kind of file kept in the cache directory, and so counted towards its size limit
+CACHE_SUFFIXES = ('.aut', '.pir', '.snap')
+
+# Marks a cache file as recently used, for the purposes of eviction
+def touch(path):
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+_code_fingerprint = None
+def code_fingerprint():
+    # Changes to Pecan itself may change how things get evaluated, so they must invalidate the cache
+    global _code_fingerprint
+
+    if _code_fingerprint is None:
+        h = hashlib.sha256()
+        pecan_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+        for root, dirs, files in os.walk(pecan_dir):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.endswith('.py') or filename.endswith('.lark'):
+                    path = os.path.join(root, filename)
+                    st = os.stat(path)
+                    h.update('{}:{}:{}\n'.format(os.path.relpath(path, pecan_dir), st.st_size, st.st_mtime_ns).encode('utf-8'))
+
+        _code_fingerprint = h.hexdigest()
+
+    return _code_fingerprint
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def settings_key():
+    return repr((settings.get_opt_level(), settings.min_opt(), settings.use_heuristics(), settings.get_simplication_level()))
+
+class CacheKeys:
+    def __init__(self, prog):
+        self.prog = prog
+
+        # Keys are memoized by the identity of the predicate, because the same name may be redefined (e.g., in the REPL)
+        self.pred_keys = {}
+        self.in_progress = set()
+
+    def implicit_deps(self):
+        # Arithmetic and dynamic dispatch may end up calling anything in the current context or any Structure,
+        # so these are dependencies of every key
+        deps = set(v for v in self.prog.context.values() if isinstance(v, str))
+
+        for val_dict in self.prog.types.values():
+            for call in val_dict.values():
+                if hasattr(call, 'name'):
+                    deps.add(call.name)
+
+        return deps
+
+    def combine(self, node_key, deps):
+        from pecan.lang.ir_fingerprint import IRFingerprint
+
+        env_fingerprint = IRFingerprint()
+        env_key = env_fingerprint.compute((self.prog.context, self.prog.global_restrictions))
+        deps = deps | env_fingerprint.calls
+
+        dep_keys = []
+        for dep in sorted(deps):
+            if dep in self.prog.preds:
+                dep_key = self.pred_key(self.prog.preds[dep])
+                if dep_key is None:
+                    return None
+                dep_keys.append((dep, dep_key))
+            else:
+                dep_keys.append((dep, None))
+
+        h = hashlib.sha256()
+        for part in [code_fingerprint(), settings_key(), node_key, env_key, repr(dep_keys)]:
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def pred_key(self, pred):
+        from pecan.lang.ir_fingerprint import IRFingerprint
+
+        if id(pred) in self.pred_keys:
+            return self.pred_keys[id(pred)][1]
+
+        # Recursive definitions can't be keyed (and shouldn't evaluate anyway)
+        if id(pred) in self.in_progress:
+            return None
+
+        self.in_progress.add(id(pred))
+        try:
+            fingerprint = IRFingerprint()
+            node_key = fingerprint.compute((pred.name, pred.args, pred.arg_restrictions, pred.restriction_env, pred.body))
+            key = self.combine(node_key, fingerprint.calls | self.implicit_deps())
+        finally:
+            self.in_progress.remove(id(pred))
+
+        # Keep a reference to the predicate so its id can't be reused while we hold the key
+        self.pred_keys[id(pred)] = (pred, key)
+        return key
+
+    def node_key(self, node):
+        from pecan.lang.ir_fingerprint import IRFingerprint
+
+        fingerprint = IRFingerprint()
+        node_key = fingerprint.compute(node)
+        return self.combine(node_key, fingerprint.calls | self.implicit_deps())
+
+class AutomatonCache:
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        # Computed lazily, the first time we store something
+        self.total_size = None
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.aut')
+
+    def entries(self):
+        result = []
+        for root, _, files in os.walk(self.cache_dir):
+            for filename in files:
+                if filename.endswith(CACHE_SUFFIXES):
+                    path = os.path.join(root, filename)
+                    try:
+                        st = os.stat(path)
+                        result.append((st.st_mtime, st.st_size, path))
+                    except OSError:
+                        pass
+        return result
+
+    def load(self, key):
+        if key is None:
+            return None
+
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+
+        from pecan.tools.hoa_loader import load_hoa
+        try:
+            aut = load_hoa(path)
+        except Exception as e:
+            settings.log(0, lambda: '[DEBUG] Ignoring unreadable cache entry {}: {}'.format(path, e))
+            return None
+
+        touch(path)
+
+        return aut
+
+    def store(self, key, aut):
+        if key is None or aut.get_aut_type() != 'buchi':
+            return
+
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so concurrent Pecan processes never see a partially written entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(aut.to_str())
+            os.replace(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        self.added(path)
+
+    # Accounts for a file just written to the cache directory (by us, or another kind of cache in the same directory)
+    def added(self, path):
+        if self.total_size is None:
+            self.total_size = sum(size for _, size, _ in self.entries())
+        else:
+            self.total_size += os.path.getsize(path)
+
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        entries = sorted(self.entries())
+        self.total_size = sum(size for _, size, _ in entries)
+
+        # Remove least recently used entries until we're comfortably under the limit
+        target = self.max_size * 3 // 4
+        for _, size, path in entries:
+            if self.total_size <= target:
+                break
+
+            try:
+                os.unlink(path)
+                self.total_size -= size
+                settings.log(1, lambda: '[DEBUG] Evicted cache entry {}'.format(path))
+            except OSError:
+                pass
+
+_caches = {}
+def get_cache():
+    cache_dir = settings.get_cache_dir()
+    if cache_dir is None:
+        return None
+
+    if cache_dir not in _caches:
+        _caches[cache_dir] = AutomatonCache(cache_dir, settings.get_cache_max_size())
+
+    return _caches[cache_dir]
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# Records the automata produced by operations (conjunction, complement, etc.) into a single HOA file (see --output-hoa).
+# The file is kept open and buffered for the whole run, and is compressed if its name ends in .gz or .xz.
+# Each automaton is preceded by a comment with the operation, the predicate being evaluated, its size, and how long it took:
+#   /* op=conjunction pred=foo states=12 edges=40 time=0.0012 */
+# Filters (a minimum size, a set of predicate names, and a sampling rate) keep the trace small enough to leave on.
+
+import atexit
+import gzip
+import lzma
+import time
+
+from pecan.settings import settings
+from pecan.tools.profiler import profile_op
+
+class AutTrace:
+    def __init__(self, path, min_states=0, preds=None, sample_rate=1.0):
+        self.path = path
+        self.min_states = min_states
+        self.preds = preds
+        self.sample_rate = sample_rate
+
+        # Opened on first use, so we don't create empty files
+        self.stream = None
+
+        # For sampling: we record an operation whenever this reaches 1, so exactly a `sample_rate` fraction gets recorded
+        self.sample_credit = 0.0
+
+        # The names of the predicates currently being evaluated, innermost last
+        self.pred_stack = []
+
+        self.recorded = 0
+        self.skipped = 0
+
+    def open(self):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, 'at')
+        elif self.path.endswith('.xz') or self.path.endswith('.lzma'):
+            return lzma.open(self.path, 'at')
+        else:
+            return open(self.path, 'a', buffering=1 << 20)
+
+    def current_pred(self):
+        if self.pred_stack:
+            return self.pred_stack[-1]
+        else:
+            return None
+
+    def should_record(self, aut):
+        if aut.num_states() < self.min_states:
+            return False
+
+        if self.preds is not None and self.current_pred() not in self.preds:
+            return False
+
+        self.sample_credit += self.sample_rate
+        if self.sample_credit < 1:
+            return False
+
+        self.sample_credit -= 1
+        return True
+
+    def record(self, op, aut, runtime):
+        if not self.should_record(aut):
+            self.skipped += 1
+            return
+
+        if self.stream is None:
+            self.stream = self.open()
+
+        self.stream.write('/* op={} pred={} states={} edges={} time={:.4f} */\n'.format(op, self.current_pred(), aut.num_states(), aut.num_edges(), runtime))
+        self.stream.write(aut.get_aut().to_str('hoa'))
+        self.stream.write('\n\n')
+
+        self.recorded += 1
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+            settings.log(0, lambda: '[DEBUG] Traced {} automata to {} ({} filtered out)'.format(self.recorded, self.path, self.skipped))
+
+_trace = None
+_disabled = False
+
+def get_trace():
+    global _trace
+
+    path = settings.get_output_hoa()
+    if path is None or _disabled:
+        return None
+
+    if _trace is None or _trace.path != path:
+        if _trace is not None:
+            _trace.close()
+
+        _trace = AutTrace(path, settings.get_trace_min_states(), settings.get_trace_preds(), settings.get_trace_sample_rate())
+
+    return _trace
+
+# Should be called right after forking: the child must never write to (or close) the parent's stream
+def disable_trace():
+    global _disabled
+    _disabled = True
+
+def trace_aut(op, aut, start_time):
+    trace = get_trace()
+    if trace is not None:
+        trace.record(op, aut, time.time() - start_time)
+
+    profile_op(op, aut, start_time)
+
+def enter_pred(name):
+    trace = get_trace()
+    if trace is not None:
+        trace.pred_stack.append(name)
+
+def exit_pred():
+    trace = get_trace()
+    if trace is not None and trace.pred_stack:
+        trace.pred_stack.pop()
+
+@atexit.register
+def close_trace():
+    if _trace is not None and not _disabled:
+        _trace.close()
@@ -2,7 +2,6 @@
 # -*- coding=utf-8 -*-
 
 import ast
-import itertools as it
 
 from pecan.automata.finite import FiniteAutomaton
 
@@ -16,12 +15,7 @@ def load_finite(filename, args):
         if aut_args[arg][0] != i:
             raise Exception('{} is the {}-th argument of {}, not the {}-th'.format(arg, aut_args[arg][0], filename, i))
 
-    # Build the alphabet from the inputs if one wasn't provided.
-    alphabets = [alphabet for _, (_, alphabet) in aut_args.items()]
-    if not 'alphabet' in aut['aut']:
-        aut['aut']['alphabet'] = set(' '.join(syms) for syms in it.product(*alphabets))
-
-    res = FiniteAutomaton(aut['aut'], aut['var_map'])
+    res = FiniteAutomaton.from_dict(aut['aut'], aut['var_map'])
     res.special_attr = aut.get('special_attr', None)
 
     return res
@@ -6,6 +6,7 @@ import ast
 import spot
 
 from pecan.automata.buchi import BuchiAutomaton
+from pecan.tools.pecan_bin import is_pecan_bin, load_pecan_bin
 from pecan.utility import VarMap
 
 def from_spot_aut(base_aut):
@@ -18,6 +19,10 @@ def from_spot_aut(base_aut):
     return BuchiAutomaton(base_aut, var_map)
 
 def load_hoa(path):
+    # Automata saved in the binary format (see pecan_bin.py) can be loaded anywhere HOA files can
+    if is_pecan_bin(path):
+        return load_pecan_bin(path)
+
     with open(path, 'r') as f:
         lines = f.readlines()
 
@@ -31,7 +36,7 @@ def load_hoa(path):
                 for v in vs:
                     BuchiAutomaton.update_counter(v)
 
-            return BuchiAutomaton(spot.automaton('\n'.join(lines[1:])), var_map)
+            return BuchiAutomaton(spot.automaton('\n'.join(lines[1:])), VarMap(var_map))
     except ValueError:
         pass
 
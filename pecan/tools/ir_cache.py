@@ -0,0 +1,100 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# A cache of parsed Pecan files, so that unchanged files (e.g., large generated files, or libraries that get #import-ed)
+# skip the parser, ASTToIR and the UntypedOptimizer entirely.
+# Entries are the pickled IR of the file as it comes out of the UntypedOptimizer (i.e., before the standard library is
+# included), keyed by the contents of the file, the version of Pecan, and the settings that affect those passes.
+# They live in the "ir" folder of the cache directory, and count towards its size limit (see aut_cache.AutomatonCache).
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+from pecan.settings import settings
+
+def source_key(source_code):
+    from pecan.tools.aut_cache import code_fingerprint
+
+    h = hashlib.sha256()
+    for part in [code_fingerprint(), repr((settings.opt_enabled(), settings.min_opt(), settings.get_extract_implications())), source_code]:
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+class IRCache:
+    def __init__(self, cache_dir, size_limit):
+        self.cache_dir = cache_dir
+
+        # The AutomatonCache of the enclosing cache directory, which keeps the whole directory under its size limit
+        self.size_limit = size_limit
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.pir')
+
+    def load(self, key):
+        from pecan.lang.ir.base import IRNode
+        from pecan.lang.ir.prog import Program
+        from pecan.tools.aut_cache import touch
+
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+
+        old_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(old_limit, 10000))
+        try:
+            with open(path, 'rb') as f:
+                defs, restrictions, types, context, var_counter = pickle.load(f)
+        except Exception as e:
+            settings.log(0, lambda: '[DEBUG] Ignoring unreadable IR cache entry {}: {}'.format(path, e))
+            return None
+        finally:
+            sys.setrecursionlimit(old_limit)
+
+        touch(path)
+
+        # The cached IR may contain fresh variable names, which we must not hand out again
+        IRNode.id = max(IRNode.id, var_counter)
+
+        return Program(defs, restrictions=restrictions, types=types, context=context)
+
+    def store(self, key, prog):
+        from pecan.lang.ir.base import IRNode
+
+        old_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(old_limit, 10000))
+        try:
+            data = pickle.dumps((prog.defs, prog.restrictions, prog.types, prog.context, IRNode.id), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            settings.log(0, lambda: '[DEBUG] Could not cache the IR: {}'.format(e))
+            return
+        finally:
+            sys.setrecursionlimit(old_limit)
+
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so concurrent Pecan processes never see a partially written entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        self.size_limit.added(path)
+
+def get_ir_cache():
+    from pecan.tools.aut_cache import get_cache
+
+    cache_dir = settings.get_cache_dir()
+    if cache_dir is None:
+        return None
+
+    return IRCache(os.path.join(cache_dir, 'ir'), get_cache())
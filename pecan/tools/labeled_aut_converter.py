@@ -1,7 +1,7 @@
 #!/usr/bin/env python3.6
 # -*- coding=utf-8 -*-
 
-from pecan.tools.walnut_converter import convert_walnut_lines
+from pecan.tools.walnut_converter import WalnutBuilder, parse_bases
 
 class Transition:
     def __init__(self, input_size, input_line):
@@ -12,11 +12,8 @@ class Transition:
         if len(self.inputs) != input_size:
             raise Exception('Expected {} input symbols for transition, only got {} in "{}"'.format(input_size, len(self.inputs), input_line))
 
-    def to_str(self, state_map):
-        return '{} -> {}'.format(self.input_str(), state_map[self.dest_label])
-
-    def input_str(self):
-        return ' '.join(self.inputs)
+    def input_tuple(self):
+        return tuple(int(inp) for inp in self.inputs)
 
     def __repr__(self):
         return 'Transition({}, {})'.format(self.inputs, self.dest_label)
@@ -34,52 +31,63 @@ class State:
     def add_transition(self, transition):
         self.transitions.append(transition)
 
-    def to_str(self, state_map):
-        lines = []
-        lines.append('{} {}'.format(self.idx, 1 if self.acc else 0))
-        for transition in self.transitions:
-            lines.append(transition.to_str(state_map))
-        return lines
-
     def __repr__(self):
         return 'State({}, {}, {})'.format(self.label, self.acc, self.transitions)
 
 # TODO: It would be nice if we used a real parser for all this stuff
 def convert_labeled_aut(filename, input_names):
     state_idx = 0
-    cur_state = None
+    has_state = False
 
     state_map = {}
-    states = []
 
-    alphabet_line = None
+    builder = None
+
+    # Unlike Walnut files, states are named by labels, so we number them in the order they're declared (or first used)
+    def state_num(label):
+        nonlocal state_idx
+        if label not in state_map:
+            state_map[label] = state_idx
+            state_idx += 1
+        return state_map[label]
 
     with open(filename, 'r') as f:
-        for lineno, line in enumerate(f.readlines()):
+        for lineno, line in enumerate(f):
             line = line.strip()
 
             if line.startswith('//') or len(line) <= 0:
                 pass
             elif line[0] == '{':
                 # It's the alphabet line,
-                alphabet_line = line
+                builder = alphabet_builder(line, input_names)
             elif '->' in line:
-                if cur_state is None:
+                if not has_state:
                     raise Exception('Transition "{}" not inside any state! (line: {})'.format(line, lineno))
-                cur_state.add_transition(Transition(len(input_names), line))
+                transition = Transition(len(input_names), line)
+                builder.add_transition(transition.input_tuple(), state_num(transition.dest_label))
             elif len(line) > 1:
-                cur_state = State(state_idx, line)
-                state_map[cur_state.label] = state_idx
-                states.append(cur_state)
-                state_idx += 1
+                if builder is None:
+                    raise Exception('Must declare the alphabet BEFORE declaring any states!')
+                state = State(state_num(line.split(':')[0].strip()), line)
+                builder.add_state(state.idx, state.acc)
+                has_state = True
+
+    return builder.to_buchi()
 
-    return build_aut(alphabet_line, states, state_map, input_names)
+def alphabet_builder(alphabet_line, input_names):
+    bases = parse_bases(alphabet_line)
+
+    if len(bases) != len(input_names):
+        raise Exception('Got {} input alphabets but {} formal arguments!'.format(len(bases), len(input_names)))
+
+    return WalnutBuilder(bases, input_names)
 
 def build_aut(alphabet_line, states, state_map, input_names):
-    lines = [alphabet_line]
+    builder = alphabet_builder(alphabet_line, input_names)
 
     for state in states:
-        lines.extend(state.to_str(state_map))
-
-    return convert_walnut_lines(lines, input_names)
+        builder.add_state(state.idx, state.acc)
+        for transition in state.transitions:
+            builder.add_transition(transition.input_tuple(), state_map[transition.dest_label])
 
+    return builder.to_buchi()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# Snapshots of fully evaluated libraries (std.pn, and anything loaded via #import), so that they don't have to be parsed,
+# lowered, optimized and evaluated (e.g., running #shuffle directives) again in every process.
+#
+# A snapshot holds everything Program.include takes from a library: its predicates (including any automata already
+# evaluated), context, types, global restrictions, and Praline definitions and aliases. Only what the library itself adds
+# is kept, not what it got from the standard library: the importer already has those, and must keep its own objects
+# (e.g., the memo and the predicate tables for --jobs rely on their identity, and they may already be evaluated).
+# Snapshots live in the "snapshots" folder of the cache directory, count towards its size limit (stale ones are eventually
+# evicted, see aut_cache.AutomatonCache), and are keyed by the library's path, the version of Pecan,
+# the relevant settings, and the context the library is evaluated in. Each one also records every file that went into it
+# (the library, anything it imported, and any automata it loaded); if any of them changed, the snapshot is rebuilt.
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+from pecan.settings import settings
+
+class LibrarySnapshot:
+    def __init__(self, prog):
+        from pecan.automata.buchi import BuchiAutomaton
+        from pecan.lang.ir.base import IRNode
+
+        # None while we're snapshotting the standard library itself
+        stdlib = settings.stdlib_prog
+
+        def own(entries, stdlib_entries):
+            return {k: v for k, v in entries.items() if stdlib_entries.get(k) is not v}
+
+        if stdlib is None:
+            self.preds = prog.preds
+            self.context = prog.context
+            self.types = prog.types
+            self.praline_defs = prog.praline_defs
+            self.praline_aliases = prog.praline_aliases
+        else:
+            self.preds = own(prog.preds, stdlib.preds)
+            self.context = own(prog.context, stdlib.context)
+            self.types = own(prog.types, stdlib.types)
+            self.praline_defs = own(prog.praline_defs, stdlib.praline_defs)
+            self.praline_aliases = own(prog.praline_aliases, stdlib.praline_aliases)
+
+        self.global_restrictions = prog.global_restrictions
+        self.source_files = prog.source_files
+
+        # Any names created in this process after restoring the snapshot must not clash with those in the snapshot
+        self.ap_counter = BuchiAutomaton.id
+        self.var_counter = IRNode.id
+        self.canonical_aps = dict(BuchiAutomaton.canonical_aps)
+
+    def restore(self):
+        from pecan.automata.buchi import BuchiAutomaton
+        from pecan.lang.ir.base import IRNode
+        from pecan.lang.ir.prog import Program
+
+        BuchiAutomaton.id = max(BuchiAutomaton.id, self.ap_counter)
+        IRNode.id = max(IRNode.id, self.var_counter)
+
+        # Reuse the snapshot's canonical aps where possible, so its automata won't need to be relabeled when they're called
+        used_aps = set(BuchiAutomaton.canonical_aps.values())
+        for key, ap in self.canonical_aps.items():
+            if key not in BuchiAutomaton.canonical_aps and ap not in used_aps:
+                BuchiAutomaton.canonical_aps[key] = ap
+                used_aps.add(ap)
+
+        return Program([], preds=self.preds, context=self.context, types=self.types,
+                       global_restrictions=self.global_restrictions, praline_defs=self.praline_defs,
+                       praline_aliases=self.praline_aliases, source_files=self.source_files)
+
+def file_stamp(path):
+    from pecan.tools.aut_cache import file_digest
+
+    st = os.stat(path)
+    return (os.path.realpath(path), st.st_size, st.st_mtime_ns, file_digest(path))
+
+def is_current(stamp):
+    from pecan.tools.aut_cache import file_digest
+
+    path, size, mtime_ns, digest = stamp
+    try:
+        st = os.stat(path)
+        if st.st_size == size and st.st_mtime_ns == mtime_ns:
+            return True
+
+        # The file may have just been touched (e.g., by a checkout), so check the contents before giving up on the snapshot
+        return st.st_size == size and file_digest(path) == digest
+    except OSError:
+        return False
+
+class SnapshotStore:
+    def __init__(self, snapshot_dir, size_limit):
+        self.snapshot_dir = snapshot_dir
+
+        # The AutomatonCache of the enclosing cache directory, which keeps the whole directory under its size limit
+        self.size_limit = size_limit
+
+    def key_for(self, realpath, context):
+        from pecan.lang.ir_fingerprint import IRFingerprint
+        from pecan.tools.aut_cache import code_fingerprint, settings_key
+
+        h = hashlib.sha256()
+        for part in [code_fingerprint(), settings_key(), os.path.realpath(realpath), IRFingerprint().compute(context)]:
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.snapshot_dir, key + '.snap')
+
+    def load(self, realpath, context):
+        from pecan.tools.aut_cache import touch
+
+        path = self.path_for(self.key_for(realpath, context))
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                # The stamps are stored first, so we don't have to unpickle the whole library if it's out of date
+                stamps = pickle.load(f)
+                if not all(is_current(stamp) for stamp in stamps):
+                    settings.log(0, lambda: '[DEBUG] Snapshot for {} is out of date'.format(realpath))
+                    return None
+
+                snapshot = pickle.load(f)
+        except Exception as e:
+            settings.log(0, lambda: '[DEBUG] Ignoring unreadable snapshot {}: {}'.format(path, e))
+            return None
+
+        touch(path)
+
+        settings.log(0, lambda: '[DEBUG] Loaded snapshot of {} from {}'.format(realpath, path))
+        return snapshot.restore()
+
+    def store(self, realpath, context, prog):
+        path = self.path_for(self.key_for(realpath, context))
+
+        try:
+            stamps = [file_stamp(source_file) for source_file in sorted(prog.source_files)]
+            data = pickle.dumps(LibrarySnapshot(prog), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            # Some libraries may hold things we can't pickle; they'll just be evaluated every time
+            settings.log(0, lambda: '[DEBUG] Could not snapshot {}: {}'.format(realpath, e))
+            return
+
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+        # Write to a temporary file first so concurrent Pecan processes never see a partially written snapshot
+        fd, temp_path = tempfile.mkstemp(dir=self.snapshot_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(stamps, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(data)
+            os.replace(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        self.size_limit.added(path)
+
+def get_snapshot_store():
+    from pecan.tools.aut_cache import get_cache
+
+    cache_dir = settings.get_cache_dir()
+    if cache_dir is None or not settings.use_snapshots():
+        return None
+
+    return SnapshotStore(os.path.join(cache_dir, 'snapshots'), get_cache())
+
+# Loads the library at `realpath` as evaluated in `context` (which the library may modify), from a snapshot if possible.
+# `evaluate_library` should load and evaluate the library from source.
+def load_library(realpath, context, evaluate_library):
+    store = get_snapshot_store()
+    if store is None:
+        return evaluate_library()
+
+    context_before = dict(context)
+
+    prog = store.load(realpath, context_before)
+    if prog is not None:
+        return prog
+
+    prog = evaluate_library()
+
+    # Pickling may recurse deeply on large predicates
+    old_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(old_limit, 10000))
+    try:
+        store.store(realpath, context_before, prog)
+    finally:
+        sys.setrecursionlimit(old_limit)
+
+    return prog
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# Memory accounting for --stats and --memory-budget.
+# - RSS is the memory of the whole process, including spot's automata, which is usually where the memory goes.
+# - The Python heap is only measured if tracemalloc is tracing (--stats starts it, as does PYTHONTRACEMALLOC).
+
+import gc
+import os
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # e.g., on Windows
+    resource = None
+
+from pecan.settings import settings
+
+# The largest RSS the process has had so far, in bytes
+def peak_rss():
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, but macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        # Not on Linux, so the best we can do is the peak
+        return peak_rss()
+
+def start_heap_tracing():
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+# Returns the current size of the Python heap, and its peak since the last call (or None if we aren't tracing)
+def sample_heap():
+    if not tracemalloc.is_tracing():
+        return None
+
+    current, peak = tracemalloc.get_traced_memory()
+
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        # Before Python 3.9 the peak can't be reset, so it may come from before the last call
+        peak = current
+
+    return current, peak
+
+def format_bytes(n):
+    if n is None:
+        return 'unknown'
+    return '{:.1f} MB'.format(n / (1024 * 1024))
+
+class MemoryBudgetExceeded(Exception):
+    def __init__(self, budget, used):
+        super().__init__('memory budget of {} exceeded ({} in use)'.format(format_bytes(budget), format_bytes(used)))
+        self.budget = budget
+        self.used = used
+
+# Raises MemoryBudgetExceeded if we are over the budget given by --memory-budget. This is only checked between operations,
+# so a single large operation (e.g., a product) can still go over it, but it won't be able to build on the result.
+def check_memory_budget():
+    budget = settings.get_memory_budget()
+    if budget is None:
+        return
+
+    used = current_rss()
+    if used is not None and used > budget:
+        raise MemoryBudgetExceeded(budget, used)
+
+# The message of the failed Result for a definition we gave up on because of `e` (a MemoryBudgetExceeded or MemoryError)
+def abort_message(name, e):
+    reason = str(e) if isinstance(e, MemoryBudgetExceeded) else 'out of memory'
+    return '{} aborted: {}.'.format(name, reason)
+
+# Frees what we can after giving up on a definition, and gives it back to the OS if possible: the budget is checked against
+# RSS, which otherwise usually stays where the aborted definition left it, and every later definition would go over too.
+def release_memory():
+    gc.collect()
+
+    try:
+        import ctypes
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        # Not glibc
+        pass
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# Keeps every #import-ed file that has been evaluated in this process, so that a library imported by several files
+# (or through a diamond of imports) is only loaded and evaluated once. Importers share the same predicates, so anything
+# one of them evaluates can be reused by the others.
+#
+# Modules are keyed by their resolved path, the context they were imported in (which the library may depend on) and the
+# settings that affect evaluation (see aut_cache.settings_key), and are reloaded if any file that went into them has
+# changed on disk since. Use `reload` (:reload in the REPL) to force it.
+
+import os
+
+from pecan.settings import settings
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime_ns)
+    except OSError:
+        return None
+
+class Module:
+    def __init__(self, prog):
+        from pecan.lang.ir.prog import Program
+
+        # Copy the context: the importer that evaluated the module keeps modifying its own context afterwards
+        self.prog = Program([], preds=prog.preds, context=dict(prog.context), types=prog.types,
+                            global_restrictions=prog.global_restrictions, praline_defs=prog.praline_defs,
+                            praline_aliases=prog.praline_aliases, source_files=set(prog.source_files))
+
+        self.stamps = {path: file_stamp(path) for path in self.prog.source_files}
+
+    def is_current(self):
+        return all(file_stamp(path) == stamp for path, stamp in self.stamps.items())
+
+class ModuleRegistry:
+    def __init__(self):
+        self.modules = {}
+
+    def key_for(self, realpath, context):
+        from pecan.lang.ir_fingerprint import IRFingerprint
+        from pecan.tools.aut_cache import settings_key
+        return (os.path.realpath(realpath), IRFingerprint().compute(context), settings_key())
+
+    # Returns the module at `realpath` as evaluated in `context`. `evaluate_module` should load and evaluate it.
+    def get(self, realpath, context, evaluate_module):
+        key = self.key_for(realpath, context)
+
+        module = self.modules.get(key)
+        if module is not None:
+            if module.is_current():
+                settings.log(0, lambda: '[DEBUG] Reusing already imported module {}'.format(realpath))
+                return module.prog
+
+            settings.log(0, lambda: '[DEBUG] {} changed since it was imported, reloading it'.format(realpath))
+            del self.modules[key]
+
+        module = Module(evaluate_module())
+        self.modules[key] = module
+        return module.prog
+
+    # Forgets the modules loaded from `path` (or all modules, if `path` is None), so that they get loaded again next time
+    def reload(self, path=None):
+        if path is None:
+            count = len(self.modules)
+            self.modules.clear()
+        else:
+            realpath = os.path.realpath(path)
+            keys = [key for key in self.modules if key[0] == realpath]
+            for key in keys:
+                del self.modules[key]
+            count = len(keys)
+
+        return count
+
+module_registry = ModuleRegistry()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# Decoders for the numeration systems of the standard library, used by accepting_values to turn the bits of a variable
+# into an integer. Each takes the finite part of the variable's word (a list of bits, least significant digit first), for
+# a variable represented by a single ap whose word ends in 0^ω. Mirrors natFormat (std.pn) and intFormat (integers.pn).
+
+def decode_binary(bits):
+    return sum(1 << i for i, bit in enumerate(bits) if bit)
+
+# The first digit is the sign (1 for negative), followed by the absolute value in binary
+def decode_int(bits):
+    if not bits:
+        return 0
+
+    value = decode_binary(bits[1:])
+    return -value if bits[0] else value
+
+# By the name of the type (i.e., the predicate in `x is T`)
+DECODERS = {
+    'nat': decode_binary,
+    'binary': decode_binary,
+    'int': decode_int,
+}
+
+# The decoder for `var_name`, given its restrictions in `prog`, or None if we don't know how to decode any of its types
+# (e.g., Fibonacci or Ostrowski numeration systems, whose structures are defined by the user)
+def decoder_for(prog, var_name):
+    for restriction in prog.get_restrictions(var_name):
+        decoder = DECODERS.get(getattr(restriction, 'name', None))
+        if decoder is not None:
+            return decoder
+
+    return None
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# Evaluates #assert_prop directives (including those emitted by Theorem) in worker processes, while the rest of the
+# program keeps running in the main process.
+#
+# An assertion only reads the program: it doesn't define anything that later definitions could depend on. So each one is
+# handed to a forked worker, which sees exactly the state of the program at the point the assertion appears, and the main
+# process moves on without waiting. Workers send back their Result, everything they printed, and the automata of any
+# predicates they had to evaluate (as HOA plus a VarMap, see BuchiAutomaton.__getstate__) so the main process can reuse them.
+#
+# Output is merged back in source order: while any worker is still running, whatever the main process prints is buffered
+# behind it.
+
+import io
+import multiprocessing
+import pickle
+import sys
+from collections import deque
+from multiprocessing.connection import wait
+
+from pecan.lang.ir.prog import Result
+from pecan.settings import settings
+from pecan.tools.mem_stats import MemoryBudgetExceeded, abort_message
+
+class PendingResult:
+    def __init__(self, task):
+        self.task = task
+
+class Task:
+    def __init__(self, directive, process, conn, pred_ids):
+        self.directive = directive
+        self.process = process
+        self.conn = conn
+
+        # Which predicate objects the worker saw, so we only install evaluated automata into the same predicates
+        self.pred_ids = pred_ids
+
+        self.done = False
+        self.output = ''
+        self.result = None
+
+        # Only results of top-level definitions count towards the program's result (see Program.evaluate)
+        self.record_result = False
+
+class OrderedOutput:
+    def __init__(self, evaluator, stream):
+        self.evaluator = evaluator
+        self.stream = stream
+
+    def write(self, s):
+        if self.evaluator.segments:
+            self.evaluator.buffer.write(s)
+        else:
+            self.stream.write(s)
+        return len(s)
+
+    def flush(self):
+        self.stream.flush()
+
+def run_worker(prog, directive, conn):
+    output = io.StringIO()
+    sys.stdout = output
+
+    unevaluated = set(name for name, pred in prog.preds.items() if pred.body_evaluated is None)
+
+    try:
+        result = directive.evaluate(prog)
+        evaluated = {name: pred.body_evaluated for name, pred in prog.preds.items()
+                     if name in unevaluated and pred.body_evaluated is not None and pred.body_evaluated.get_aut_type() == 'buchi'}
+
+        try:
+            message = pickle.dumps(('ok', output.getvalue(), result.message(), result.succeeded(), evaluated))
+        except Exception:
+            # We can always do without sharing the automata
+            message = pickle.dumps(('ok', output.getvalue(), result.message(), result.succeeded(), {}))
+    except (MemoryBudgetExceeded, MemoryError) as e:
+        # Running it again in the main process would just go over again, so report it like run_definition does
+        result = Result(abort_message(repr(directive), e), False)
+        settings.log(lambda: result.result_str())
+        message = pickle.dumps(('ok', output.getvalue(), result.message(), result.succeeded(), {}))
+    except Exception as e:
+        # Let the main process run it instead, so that errors are reported exactly as they would be otherwise
+        message = pickle.dumps(('error', repr(e)))
+
+    conn.send_bytes(message)
+    conn.close()
+
+class ParallelEvaluator:
+    @staticmethod
+    def supported():
+        return 'fork' in multiprocessing.get_all_start_methods()
+
+    def __init__(self, prog, jobs):
+        self.prog = prog
+        self.jobs = jobs
+        self.context = multiprocessing.get_context('fork')
+
+        # Output in source order: each segment is either a str (already finished) or a Task
+        self.segments = deque()
+        self.buffer = io.StringIO()
+        self.running = {}
+
+        self.succeeded = True
+        self.msgs = []
+
+        self.stdout = None
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = OrderedOutput(self, self.stdout)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.finish()
+        finally:
+            for task in self.running.values():
+                task.process.terminate()
+                task.process.join()
+            self.running.clear()
+
+            sys.stdout = self.stdout
+
+            # If something went wrong, still show everything that the main process printed
+            self.flush_buffer()
+            for segment in self.segments:
+                if type(segment) is str:
+                    sys.stdout.write(segment)
+            self.segments.clear()
+
+    def record(self, result):
+        if result.failed():
+            self.succeeded = False
+            self.msgs.append(result.message())
+
+    def run_definition(self, i, d):
+        result = self.prog.run_definition(i, d)
+
+        if type(result) is PendingResult:
+            result.task.record_result = True
+        elif result is not None and type(result) is Result:
+            if self.segments:
+                # Record it in order, after the results of the workers that are still running
+                self.flush_buffer()
+                self.segments.append(result)
+            else:
+                self.record(result)
+
+        self.collect(block=False)
+
+    def submit(self, directive):
+        while len(self.running) >= self.jobs:
+            self.collect(block=True)
+
+        self.stdout.flush()
+
+        parent_conn, child_conn = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=self.worker_main, args=(directive, child_conn))
+        process.start()
+        child_conn.close()
+
+        task = Task(directive, process, parent_conn, {name: id(pred) for name, pred in self.prog.preds.items()})
+        self.running[parent_conn] = task
+
+        self.flush_buffer()
+        self.segments.append(task)
+
+        settings.log(1, lambda: '[DEBUG] Started worker {} for {}'.format(process.pid, directive))
+
+        return PendingResult(task)
+
+    def worker_main(self, directive, conn):
+        from pecan.tools.aut_trace import disable_trace
+        from pecan.tools.profiler import disable_profiler
+        disable_trace()
+        disable_profiler()
+
+        self.prog.parallel = None
+        run_worker(self.prog, directive, conn)
+
+    def flush_buffer(self):
+        text = self.buffer.getvalue()
+        if text:
+            self.segments.append(text)
+            self.buffer = io.StringIO()
+
+    def collect(self, block):
+        if self.running:
+            ready = wait(list(self.running), timeout=None if block else 0)
+
+            for conn in ready:
+                task = self.running.pop(conn)
+                self.complete(task)
+
+        self.emit_ready()
+
+    def complete(self, task):
+        try:
+            message = pickle.loads(task.conn.recv_bytes())
+        except (EOFError, OSError, pickle.UnpicklingError):
+            message = ('error', 'worker exited unexpectedly')
+
+        task.conn.close()
+        task.process.join()
+
+        if message[0] == 'ok':
+            _, task.output, msg, succeeded, evaluated = message
+            task.result = Result(msg, succeeded)
+            self.install(task, evaluated)
+        else:
+            settings.log(0, lambda: '[DEBUG] Worker failed ({}), evaluating {} sequentially'.format(message[1], task.directive))
+            task.output, task.result = self.run_captured(task.directive)
+
+        task.done = True
+
+    def run_captured(self, directive):
+        stdout = sys.stdout
+        output = io.StringIO()
+        sys.stdout = output
+        parallel = self.prog.parallel
+        self.prog.parallel = None
+        try:
+            result = directive.evaluate(self.prog)
+        finally:
+            self.prog.parallel = parallel
+            sys.stdout = stdout
+
+        return output.getvalue(), result
+
+    def install(self, task, evaluated):
+        for name, aut in evaluated.items():
+            pred = self.prog.preds.get(name)
+
+            # Only if it's the same predicate the worker evaluated, and we haven't evaluated it ourselves in the meantime
+            if pred is not None and task.pred_ids.get(name) == id(pred) and pred.body_evaluated is None:
+                settings.log(1, lambda: '[DEBUG] Using automaton for {} from worker {}'.format(name, task.process.pid))
+                pred.body_evaluated = aut.canonicalize()
+
+    def emit_ready(self):
+        while self.segments:
+            segment = self.segments[0]
+
+            if type(segment) is Task:
+                if not segment.done:
+                    break
+
+                self.stdout.write(segment.output)
+                if segment.record_result:
+                    self.record(segment.result)
+            elif type(segment) is str:
+                self.stdout.write(segment)
+            else:
+                self.record(segment)
+
+            self.segments.popleft()
+
+        # Nothing is pending anymore, so anything buffered can go out now
+        if not self.segments:
+            text = self.buffer.getvalue()
+            if text:
+                self.stdout.write(text)
+                self.buffer = io.StringIO()
+
+    def finish(self):
+        while self.running:
+            self.collect(block=True)
+        self.flush_buffer()
+        self.emit_ready()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# A compact binary format for Buchi automata ("pecan-bin", usually saved with the extension .pbin), which is much faster to
+# save and load than HOA for large automata. The layout is:
+#   - the magic bytes MAGIC
+#   - a little-endian uint32 length, followed by that many bytes of a JSON header:
+#       var map, aps, acceptance condition, number of acceptance sets, states, edges, BDD nodes, and conditions
+#   - the BDD nodes shared by all edge conditions, as (ap index, low node, high node) triples.
+#     Node 0 is false and node 1 is true; every other node only refers to nodes before it.
+#   - the table of distinct edge conditions, as node indices
+#   - for each edge: source state, destination state, acceptance marks (as a bitmask), and condition index
+# All arrays are little-endian uint32s, read and written in bulk.
+
+import json
+import struct
+import sys
+from array import array
+
+import buddy
+import spot
+
+from pecan.automata.buchi import BuchiAutomaton
+from pecan.utility import VarMap
+
+MAGIC = b'PECANBIN\x01'
+
+def is_pecan_bin(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def write_array(f, vals):
+    arr = array('I', vals)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    arr.tofile(f)
+
+def read_array(f, n):
+    arr = array('I')
+    arr.frombytes(f.read(4 * n))
+    if len(arr) != n:
+        raise Exception('Truncated pecan-bin file (expected {} values, got {})'.format(n, len(arr)))
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+class BddWriter:
+    def __init__(self, ap_idx):
+        # Maps BDD variable numbers to the index of their ap in the header
+        self.ap_idx = ap_idx
+
+        self.nodes = []
+        self.node_ids = {}
+
+    def node_for(self, b):
+        if b == buddy.bddfalse:
+            return 0
+        elif b == buddy.bddtrue:
+            return 1
+
+        if b.id() in self.node_ids:
+            return self.node_ids[b.id()]
+
+        low = self.node_for(buddy.bdd_low(b))
+        high = self.node_for(buddy.bdd_high(b))
+
+        self.nodes.extend([self.ap_idx[buddy.bdd_var(b)], low, high])
+        node_id = len(self.nodes) // 3 + 1
+        self.node_ids[b.id()] = node_id
+        return node_id
+
+def save_pecan_bin(aut, path):
+    twa = aut.get_aut()
+
+    aps = [ap.ap_name() for ap in twa.ap()]
+    ap_idx = {twa.register_ap(ap): i for i, ap in enumerate(aps)}
+
+    num_sets = twa.num_sets()
+    if num_sets > 32:
+        raise Exception('The pecan-bin format supports at most 32 acceptance sets, but the automaton has {}'.format(num_sets))
+
+    bdd_writer = BddWriter(ap_idx)
+    cond_ids = {}
+    conds = []
+
+    edges = array('I')
+    for e in twa.edges():
+        if e.cond.id() not in cond_ids:
+            cond_ids[e.cond.id()] = len(conds)
+            conds.append(bdd_writer.node_for(e.cond))
+
+        acc = 0
+        for s in e.acc.sets():
+            acc |= 1 << s
+
+        edges.extend([e.src, e.dst, acc, cond_ids[e.cond.id()]])
+
+    header = {
+        'var_map': aut.get_var_map().var_reps,
+        'aps': aps,
+        'acceptance': str(twa.get_acceptance()),
+        'num_sets': num_sets,
+        'num_states': twa.num_states(),
+        'init': twa.get_init_state_number(),
+        'num_edges': len(edges) // 4,
+        'num_nodes': len(bdd_writer.nodes) // 3,
+        'num_conds': len(conds),
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        write_array(f, bdd_writer.nodes)
+        write_array(f, conds)
+        write_array(f, edges)
+
+def load_pecan_bin(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise Exception('{} is not a pecan-bin file'.format(path))
+
+        header_len, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+
+        nodes = read_array(f, 3 * header['num_nodes'])
+        cond_nodes = read_array(f, header['num_conds'])
+        edges = read_array(f, 4 * header['num_edges'])
+
+    twa = spot.make_twa_graph()
+
+    ap_bdds = []
+    for ap in header['aps']:
+        BuchiAutomaton.update_counter(ap)
+        ap_bdds.append(buddy.bdd_ithvar(twa.register_ap(ap)))
+
+    # Nodes only refer to earlier nodes, so we can rebuild them in order
+    node_bdds = [buddy.bddfalse, buddy.bddtrue]
+    for i in range(0, len(nodes), 3):
+        ap, low, high = nodes[i], nodes[i + 1], nodes[i + 2]
+        node_bdds.append(buddy.bdd_ite(ap_bdds[ap], node_bdds[high], node_bdds[low]))
+
+    conds = [node_bdds[n] for n in cond_nodes]
+
+    twa.set_acceptance(header['num_sets'], spot.acc_code(header['acceptance']))
+
+    if header['num_states'] > 0:
+        twa.new_states(header['num_states'])
+        twa.set_init_state(header['init'])
+
+    marks = {}
+    for i in range(0, len(edges), 4):
+        src, dst, acc, cond = edges[i], edges[i + 1], edges[i + 2], edges[i + 3]
+
+        if acc not in marks:
+            marks[acc] = [s for s in range(header['num_sets']) if acc & (1 << s)]
+
+        twa.new_edge(src, dst, conds[cond], marks[acc])
+
+    return BuchiAutomaton(twa, VarMap(header['var_map']))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+# Records the evaluation tree of a run (see --profile): one span for each top-level definition, predicate body and IR node
+# evaluated, with its wall time, self time (wall time minus that of its child spans), the number of states and edges of the
+# automata going in (i.e., produced by its children) and coming out, and the automaton operations (product, complement,
+# project, ...) done directly inside it. Each span's kind is the kind of operation it spent the most time on.
+#
+# At exit, writes the tree as JSON to <prefix>.json, and the same spans in Chrome's trace event format to
+# <prefix>.trace.json, which can be loaded into chrome://tracing, Perfetto or speedscope to get a flame graph.
+
+import atexit
+import json
+import time
+
+from pecan.settings import settings
+
+OP_KINDS = {
+    'conjunction': 'product',
+    'disjunction': 'product',
+    'conjunction_project': 'product',
+    'complement': 'complement',
+    'project': 'project',
+    'substitute': 'substitute',
+    'postprocess': 'postprocess',
+    'simplify_edges': 'simplify',
+    'simplify_states': 'simplify',
+    'merge_edges': 'simplify',
+    'purge_states': 'simplify',
+    'merge_states': 'simplify',
+}
+
+class Span:
+    def __init__(self, name, kind, start):
+        self.name = name
+        self.kind = kind
+        self.start = start
+        self.end = None
+
+        self.children = []
+        self.ops = []
+
+        self.states = -1
+        self.edges = -1
+
+    def wall(self):
+        return self.end - self.start
+
+    def self_time(self):
+        return self.wall() - sum(child.wall() for child in self.children)
+
+    def input_size(self):
+        states = sum(child.states for child in self.children if child.states >= 0)
+        edges = sum(child.edges for child in self.children if child.edges >= 0)
+        return states, edges
+
+    def op_kind(self):
+        op_times = {}
+        for op in self.ops:
+            op_times[op['kind']] = op_times.get(op['kind'], 0) + op['time']
+
+        if len(op_times) == 0:
+            return self.kind
+
+        return max(op_times, key=op_times.get)
+
+    def to_json(self, origin):
+        in_states, in_edges = self.input_size()
+        return {
+            'name': self.name,
+            'node': self.kind,
+            'kind': self.op_kind(),
+            'start': self.start - origin,
+            'wall': self.wall(),
+            'self': self.self_time(),
+            'input_states': in_states,
+            'input_edges': in_edges,
+            'output_states': self.states,
+            'output_edges': self.edges,
+            'ops': [dict(op, start=op['start'] - origin) for op in self.ops],
+            'children': [child.to_json(origin) for child in self.children],
+        }
+
+    def trace_events(self, origin):
+        in_states, in_edges = self.input_size()
+        yield {
+            'name': self.name,
+            'cat': self.op_kind(),
+            'ph': 'X',
+            'ts': (self.start - origin) * 1e6,
+            'dur': self.wall() * 1e6,
+            'pid': 1,
+            'tid': 1,
+            'args': {
+                'node': self.kind,
+                'self': self.self_time(),
+                'input_states': in_states,
+                'input_edges': in_edges,
+                'output_states': self.states,
+                'output_edges': self.edges,
+            }
+        }
+
+        for op in self.ops:
+            yield {
+                'name': op['op'],
+                'cat': op['kind'],
+                'ph': 'X',
+                'ts': (op['start'] - origin) * 1e6,
+                'dur': op['time'] * 1e6,
+                'pid': 1,
+                'tid': 1,
+                'args': { 'output_states': op['states'], 'output_edges': op['edges'] }
+            }
+
+        for child in self.children:
+            yield from child.trace_events(origin)
+
+class Profiler:
+    def __init__(self, prefix):
+        self.prefix = prefix[:-len('.json')] if prefix.endswith('.json') else prefix
+
+        self.origin = time.time()
+        self.roots = []
+        self.stack = []
+
+    def enter(self, name, kind):
+        # Some nodes print as entire formulas
+        if len(name) > 200:
+            name = name[:197] + '...'
+
+        span = Span(name, kind, time.time())
+
+        if self.stack:
+            self.stack[-1].children.append(span)
+        else:
+            self.roots.append(span)
+
+        self.stack.append(span)
+        return span
+
+    def exit(self, span, aut=None):
+        span.end = time.time()
+
+        if aut is not None:
+            span.states, span.edges = aut.num_states(), aut.num_edges()
+
+        # Normally `span` is on top, but an exception may have skipped exiting some spans inside it
+        while self.stack:
+            if self.stack.pop() is span:
+                break
+
+    def record_op(self, op, aut, start_time):
+        if not self.stack:
+            return
+
+        end_time = time.time()
+        self.stack[-1].ops.append({
+            'op': op,
+            'kind': OP_KINDS.get(op, op),
+            'start': start_time,
+            'time': end_time - start_time,
+            'states': aut.num_states(),
+            'edges': aut.num_edges(),
+        })
+
+    def write(self):
+        now = time.time()
+        for span in self.stack:
+            span.end = now
+
+        with open(self.prefix + '.json', 'w') as f:
+            json.dump({ 'total_time': now - self.origin, 'roots': [root.to_json(self.origin) for root in self.roots] }, f, indent=1)
+
+        with open(self.prefix + '.trace.json', 'w') as f:
+            events = [event for root in self.roots for event in root.trace_events(self.origin)]
+            json.dump({ 'traceEvents': events, 'displayTimeUnit': 'ms' }, f)
+
+        settings.log(0, lambda: '[DEBUG] Wrote profile to {0}.json and {0}.trace.json'.format(self.prefix))
+
+_profiler = None
+_disabled = False
+
+def get_profiler():
+    global _profiler
+
+    prefix = settings.get_profile()
+    if prefix is None or _disabled:
+        return None
+
+    if _profiler is None:
+        _profiler = Profiler(prefix)
+
+    return _profiler
+
+# Should be called right after forking, like disable_trace
+def disable_profiler():
+    global _disabled
+    _disabled = True
+
+def profile_op(op, aut, start_time):
+    profiler = get_profiler()
+    if profiler is not None:
+        profiler.record_op(op, aut, start_time)
+
+@atexit.register
+def write_profile():
+    if _profiler is not None and not _disabled:
+        _profiler.write()
@@ -18,7 +18,11 @@ class ShuffleAutomata:
 
         self.state_encoding = {}
 
-    def shuffle(self, disjunction=False):
+    # Above this many states, postprocessing the result usually costs far more than it saves
+    postprocess_limit = 5000
+
+    # If postprocess is None, we only postprocess the result if it's at most postprocess_limit states
+    def shuffle(self, disjunction=False, postprocess=None):
         new_aut = spot.make_twa_graph()
 
         # We want to make sure that it visits infinitely often BOTH automata's accepting states
@@ -27,41 +31,55 @@ class ShuffleAutomata:
         else:
             new_aut.set_acceptance(2, 'Inf(0) & Inf(1)')
 
-        new_aut.new_states(2 * self.aut_a.num_states() * self.aut_b.num_states())
-
-        idx = 0
-        for i in ['a', 'b']:
-            for qa in range(self.aut_a.num_states()):
-                for qb in range(self.aut_b.num_states()):
-                    self.state_encoding[(i, qa, qb)] = idx
-                    idx += 1
-
         for ap in self.aut_a.ap():
             buddy.bdd_ithvar(new_aut.register_ap(ap.ap_name()))
         for ap in self.aut_b.ap():
             buddy.bdd_ithvar(new_aut.register_ap(ap.ap_name()))
 
-        a_init = self.aut_a.get_init_state_number()
-        b_init = self.aut_b.get_init_state_number()
-        new_aut.set_init_state(self.state_encoding[('a', a_init, b_init)])
+        out_a = self.out_edges(self.aut_a, 0)
+        out_b = self.out_edges(self.aut_b, 1)
+
+        # A state is a triple (phase, qa, qb), where phase says which automaton reads the next letter.
+        # We encode it as a single integer, and only create the states that are reachable from the initial state.
+        num_a = self.aut_a.num_states()
+        num_b = self.aut_b.num_states()
+        def encode(phase, qa, qb):
+            return (phase * num_a + qa) * num_b + qb
+
+        todo = []
+        def get_state(phase, qa, qb):
+            key = encode(phase, qa, qb)
+            if key not in self.state_encoding:
+                self.state_encoding[key] = new_aut.new_state()
+                todo.append((phase, qa, qb))
+            return self.state_encoding[key]
 
-        for e in self.aut_a.edges():
-            for qb in range(self.aut_b.num_states()):
-                src = self.state_encoding[('a', e.src, qb)]
-                dst = self.state_encoding[('b', e.dst, qb)]
-                acc = self.transform_acc(e.acc, 0)
-                # print('Adding edge: {} -> {} with cond {} and acc {}'.format(src, dst, spot.bdd_to_formula(e.cond), acc))
-                new_aut.new_edge(src, dst, e.cond, acc)
+        new_aut.set_init_state(get_state(0, self.aut_a.get_init_state_number(), self.aut_b.get_init_state_number()))
 
-        for e in self.aut_b.edges():
-            for qa in range(self.aut_a.num_states()):
-                src = self.state_encoding[('b', qa, e.src)]
-                dst = self.state_encoding[('a', qa, e.dst)]
-                acc = self.transform_acc(e.acc, 1)
-                # print('Adding edge: {} -> {} with cond {} and acc {}'.format(src, dst, spot.bdd_to_formula(e.cond), acc))
-                new_aut.new_edge(src, dst, e.cond, acc)
+        while todo:
+            phase, qa, qb = todo.pop()
+            src = self.state_encoding[encode(phase, qa, qb)]
+
+            if phase == 0:
+                for dst_a, cond, acc in out_a[qa]:
+                    new_aut.new_edge(src, get_state(1, dst_a, qb), cond, acc)
+            else:
+                for dst_b, cond, acc in out_b[qb]:
+                    new_aut.new_edge(src, get_state(0, qa, dst_b), cond, acc)
+
+        if postprocess is None:
+            postprocess = new_aut.num_states() <= self.postprocess_limit
+
+        if postprocess:
+            return new_aut.postprocess('BA')
+        else:
+            return new_aut
 
-        return new_aut.postprocess('BA')
+    def out_edges(self, aut, new_acc_num):
+        result = [[] for _ in range(aut.num_states())]
+        for e in aut.edges():
+            result[e.src].append((e.dst, e.cond, self.transform_acc(e.acc, new_acc_num)))
+        return result
 
     def transform_acc(self, acc, new_acc_num):
         if acc == spot.mark_t([0]):
@@ -69,5 +87,5 @@ class ShuffleAutomata:
         elif acc == spot.mark_t([]):
             return spot.mark_t([])
         else:
-            raise Exception('Unexpected acceptance condition on edge: {}'.format(e.acc))
+            raise Exception('Unexpected acceptance condition on edge: {}'.format(acc))
 
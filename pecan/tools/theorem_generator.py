@@ -1,19 +1,11 @@
 import itertools
 import string
 
-import spot
-
 from pecan.lang.ast import *
 from pecan import program
 
 def truth_val(prog, pred):
-    evaluated = pred.evaluate(prog)
-    if evaluated.is_empty(): # If we accept nothing, we are false
-        return 'false'
-    elif spot.complement(evaluated).is_empty(): # If our complement accepts nothing, we accept everything, so we are true
-        return 'true'
-    else: # Otherwise, we are neither true nor false: i.e., not all variables have been eliminated
-        return 'sometimes'
+    return pred.evaluate(prog).truth_value()
 
 def gen_vars(c):
     i = 0
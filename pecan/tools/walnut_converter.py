@@ -7,58 +7,15 @@ import spot
 
 from pecan.automata.buchi import BuchiAutomaton
 from pecan.utility import VarMap
-
-class Transition:
-    def __init__(self, input_line):
-        split = input_line.split('->')
-        # Something like [1,2,3], representing a transition from (1,2,3) -> dest_state_name
-        self.inputs = [int(inp) for inp in split[0].split()]
-        self.dest_state_name = int(split[1])
-
-    # Suppose we have the following transition
-    def encode(self, aut, hoa_aut, state):
-        cond = buddy.bddtrue
-
-        for encoded_input, aps in aut.encode(self.inputs):
-
-            for c, ap in zip(encoded_input, aps):
-                if c == '0':
-                    cond &= -ap
-                else:
-                    cond &= ap
-
-            acc_sets = aut.acc_for(self.dest_state_name)
-
-        if acc_sets:
-            hoa_aut.new_edge(state.state_num, aut.num_of(self.dest_state_name), cond, acc_sets)
-        else:
-            hoa_aut.new_edge(state.state_num, aut.num_of(self.dest_state_name), cond)
-
-        return hoa_aut
-
-class State:
-    def __init__(self, state_num, acc):
-        self.state_num = state_num
-        self.acc = acc
-
-        self.transitions = []
-
-    def add_transition(self, transition):
-        self.transitions.append(transition)
-
-    def encode_transitions(self, aut, hoa_aut):
-        for transition in self.transitions:
-            hoa_aut = transition.encode(aut, hoa_aut, self)
-
-        return hoa_aut
-
-    def get_acc(self):
-        return [0] if self.acc else []
+from pecan.settings import settings
 
 def base_len(base):
     return math.ceil(math.log(base, 2))
 
-class BinaryAutomaton:
+# Builds a Buchi automaton from a Walnut-style automaton, one state or transition at a time, so that files never need to be
+# held in memory. Each distinct input tuple is only ever encoded into a BDD once, and all the transitions between the same
+# pair of states are combined into a single edge.
+class WalnutBuilder:
     def __init__(self, input_alphabets, formal_arg_names):
         self.input_alphabets = input_alphabets
         self.formal_arg_names = formal_arg_names
@@ -66,60 +23,99 @@ class BinaryAutomaton:
         if len(self.input_alphabets) != len(self.formal_arg_names):
             raise Exception('Number of inputs must match number of formal arguments ({} vs {})'.format(self.input_alphabets, self.formal_arg_names))
 
-        self.states = []
-        self.state_num_map = {}
-        self.state_name_map = {}
-
-        self.state_num = 0
-
         self.hoa_aut = spot.make_twa_graph()
 
         self.var_map = VarMap()
-        self.bdds = {}
+        self.bdds = []
         for formal, base in zip(self.formal_arg_names, self.input_alphabets):
             self.var_map[formal] = [ BuchiAutomaton.fresh_ap() for _ in range(base_len(base)) ]
-            self.bdds[formal] = [ buddy.bdd_ithvar(self.hoa_aut.register_ap(ap)) for ap in self.var_map[formal] ]
+            self.bdds.append([ buddy.bdd_ithvar(self.hoa_aut.register_ap(ap)) for ap in self.var_map[formal] ])
 
         self.hoa_aut.set_buchi()
 
-    def add_state(self, line):
-        split = line.split()
-        state_name = int(split[0])
-        acc = int(split[1]) == 1
+        # The BDDs for each symbol of each input, and for each tuple of symbols
+        self.symbol_bdds = [{} for _ in self.input_alphabets]
+        self.input_bdds = {}
 
-        state_num = self.hoa_aut.new_state()
+        # States are created the first time they are mentioned, which may be as the destination of a transition
+        self.state_nums = {}
+        self.declared = set()
 
-        # If it's the first state, it's going to be our initial state
-        if not self.states:
-            self.hoa_aut.set_init_state(state_num)
+        self.cur_state = None
+        self.cur_acc = False
+        self.cur_edges = {}
+
+    def state_num(self, state_name):
+        if state_name not in self.state_nums:
+            self.state_nums[state_name] = self.hoa_aut.new_state()
+        return self.state_nums[state_name]
+
+    def symbol_bdd(self, i, sym):
+        if sym not in self.symbol_bdds[i]:
+            cond = buddy.bddtrue
+            bits = bin(sym)[2:].rjust(base_len(self.input_alphabets[i]), '0')
+            for c, ap in zip(bits, self.bdds[i]):
+                if c == '0':
+                    cond &= -ap
+                else:
+                    cond &= ap
+            self.symbol_bdds[i][sym] = cond
+
+        return self.symbol_bdds[i][sym]
 
-        new_state = State(state_num, acc)
-        self.states.append(new_state)
+    def input_bdd(self, inputs):
+        if inputs not in self.input_bdds:
+            cond = buddy.bddtrue
+            for i, sym in enumerate(inputs):
+                cond &= self.symbol_bdd(i, sym)
+            self.input_bdds[inputs] = cond
 
-        self.state_num_map[state_num] = new_state
-        self.state_name_map[state_name] = state_num
+        return self.input_bdds[inputs]
 
-        return new_state
+    def add_state(self, state_name, acc):
+        self.flush_state()
 
-    def encode(self, inp):
-        for base, formal, sym in zip(self.input_alphabets, self.formal_arg_names, inp):
-            yield bin(sym)[2:].rjust(base_len(base), '0'), self.bdds[formal]
+        state_num = self.state_num(state_name)
+
+        # The first state declared is the initial state
+        if not self.declared:
+            self.hoa_aut.set_init_state(state_num)
 
-    def acc_for(self, state_name):
-        return self.state_num_map[self.num_of(state_name)].get_acc()
+        self.declared.add(state_name)
+        self.cur_state = state_num
+        self.cur_acc = acc
 
-    def num_of(self, state_name):
-        return self.state_name_map[state_name]
+    def add_transition(self, inputs, dest_state_name):
+        cond = self.input_bdd(inputs)
+        dst = self.state_num(dest_state_name)
+
+        if dst in self.cur_edges:
+            self.cur_edges[dst] |= cond
+        else:
+            self.cur_edges[dst] = cond
+
+    def flush_state(self):
+        # We put the acceptance marks on the edges leaving accepting states, making this a state-based Buchi automaton
+        for dst, cond in self.cur_edges.items():
+            if self.cur_acc:
+                self.hoa_aut.new_edge(self.cur_state, dst, cond, [0])
+            else:
+                self.hoa_aut.new_edge(self.cur_state, dst, cond)
+
+        self.cur_edges = {}
 
     def to_buchi(self):
-        for state in self.states:
-            self.hoa_aut = state.encode_transitions(self, self.hoa_aut)
+        self.flush_state()
+
+        undeclared = [name for name in self.state_nums if name not in self.declared]
+        if undeclared:
+            settings.log(lambda: '[WARN] States used in transitions but never declared (they will have no transitions): {}'.format(undeclared))
 
         return BuchiAutomaton(self.hoa_aut, self.var_map)
 
 def convert_walnut(filename, inp_names):
     with open(filename, 'r') as f:
-        return convert_walnut_lines(f.readlines(), inp_names)
+        return convert_walnut_lines(f, inp_names)
 
 def parse_bases(line):
     # TODO: Keep track of encoding along with variables and throw errors if variables are used wrong.
@@ -140,15 +136,14 @@ def parse_bases(line):
 
 def convert_aut(txt, inp_names=None):
     with open(txt, 'r') as f:
-        return convert_walnut_lines(f.readlines(), inp_names)
+        return convert_walnut_lines(f, inp_names)
 
 # TODO: It would be nice if we used a real parser for all this stuff
+# `lines` can be any iterable of lines (e.g., an open file), and is only read once
 def convert_walnut_lines(lines, inp_names):
-    cur_state = None
+    has_state = False
     aut = None
 
-    bases = []
-
     for lineno, line in enumerate(lines):
         line = line.strip()
 
@@ -164,16 +159,20 @@ def convert_walnut_lines(lines, inp_names):
             if len(bases) != len(inp_names):
                 raise Exception('Got {} input alphabets but {} formal arguments!'.format(len(bases), len(inp_names)))
 
-            aut = BinaryAutomaton(bases, inp_names)
+            aut = WalnutBuilder(bases, inp_names)
         elif '->' in line:
-            if cur_state is None:
+            if not has_state:
                 raise Exception('Transition "{}" not inside any state! (line: {})'.format(line, lineno))
-            cur_state.add_transition(Transition(line))
+
+            # Something like "1 2 3 -> 4", representing a transition on (1,2,3) to state 4
+            inputs, dest = line.split('->')
+            aut.add_transition(tuple(int(inp) for inp in inputs.split()), int(dest))
         elif len(line) > 1:
             if aut is None:
                 raise Exception('Must declare the alphabet BEFORE declaring any states!')
 
-            cur_state = aut.add_state(line)
+            split = line.split()
+            aut.add_state(int(split[0]), int(split[1]) == 1)
+            has_state = True
 
     return aut.to_buchi()
-
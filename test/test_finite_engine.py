@@ -0,0 +1,107 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+import random
+from array import array
+
+from pecan.automata.dfa import DFA
+from pecan.automata.finite import symbol_guard, var_cube, domain_of
+from pecan.tools.finite_loader import load_finite
+
+def accepts(dfa, word):
+    q = dfa.init
+    for sym in word:
+        q = dfa.succ(q, sym)
+    return bool(dfa.accepting[q])
+
+def moore_size(dfa):
+    # Naive partition refinement, to check Hopcroft's algorithm against
+    states = dfa.reachable_states()
+    classes = {q: dfa.accepting[q] for q in states}
+    while True:
+        sigs = {q: (classes[q],) + tuple(classes[dfa.succ(q, sym)] for sym in range(dfa.num_symbols)) for q in states}
+        ids = {}
+        new_classes = {q: ids.setdefault(sigs[q], len(ids)) for q in states}
+        if len(ids) == len(set(classes.values())):
+            return len(ids)
+        classes = new_classes
+
+def test_minimize_random():
+    rng = random.Random(0)
+    for _ in range(500):
+        n, m = rng.randrange(1, 12), rng.randrange(1, 4)
+        dfa = DFA(m, array('i', [rng.randrange(n) for _ in range(n * m)]), bytearray(rng.randrange(2) for _ in range(n)), 0)
+
+        minimized = dfa.minimize()
+        assert minimized.num_states() == moore_size(dfa)
+        assert minimized.minimize() == minimized
+
+        for _ in range(20):
+            word = [rng.randrange(m) for _ in range(rng.randrange(8))]
+            assert accepts(minimized, word) == accepts(dfa, word)
+
+def test_fsa_adder():
+    add = load_finite('library/automata/bin_add.fsa', ['x', 'y', 'z'])
+    double = add.substitute({'x': 'a', 'y': 'a', 'z': 'b'}, None).simplify_states()
+
+    def run(aut, **vals):
+        # Numbers are written in binary, least significant digit first
+        order = sorted(vals, key=lambda v: aut.get_var_map()[v][0])
+        q = aut.get_aut().init
+        for i in range(6):
+            q = aut.get_aut().succ(q, symbol_guard(aut.get_var_map(), [str((vals[v] >> i) & 1) for v in order]))
+        return bool(aut.get_aut().accepting[q])
+
+    for x in range(16):
+        for z in range(32):
+            assert run(double, a=x, b=z) == (2 * x == z)
+
+    # Addition is commutative
+    swapped = add.substitute({'x': 'y', 'y': 'x', 'z': 'z'}, None)
+    assert (add & swapped.complement()).is_empty()
+
+def test_lazy_projection():
+    from pecan.lang.ir.prog import VarRef
+
+    add = load_finite('library/automata/bin_add.fsa', ['x', 'y', 'z'])
+
+    # Every pair of numbers has a sum, but not every number is a sum of the same length (e.g., 1 + 1)
+    sums = add.project([VarRef('z')], None)
+    assert not sums.is_empty()
+    assert not sums.is_universal()
+    assert sums.accepting_word() is not None
+
+    # Answering those didn't need the whole construction, so the size isn't known yet
+    assert sums.num_states() == -1
+
+    # Forcing the subset construction minimizes it, without changing the answers
+    minimized = add.get_aut().exist(var_cube('z', add.get_var_map()['z'][1])).determinize(domain_of(sums.get_var_map())).minimize()
+    assert sums.simplify_states().num_states() == minimized.num_states()
+    assert not sums.is_universal() and not sums.is_empty()
+
+    # Every number has a summand (e.g., 0) that gives it
+    assert add.project([VarRef('x')], None).project([VarRef('y')], None).is_universal()
+
+def test_lazy_projection_in_proofs():
+    from pecan import program
+    from pecan.settings import settings
+
+    orig_quiet, orig_stdlib = settings.is_quiet(), settings.should_load_stdlib()
+    settings.set_quiet(True)
+    settings.set_load_stdlib(False)
+
+    try:
+        prog = program.from_source('''
+#load("bin_add.fsa", "fsa-dict", fsa_bin_add(x,y,z))
+pairs(x, y) := exists z. fsa_bin_add(x,y,z)
+#assert_prop(sometimes, pairs)
+''')
+        assert prog.evaluate().result.succeeded()
+    finally:
+        settings.set_quiet(orig_quiet)
+        settings.set_load_stdlib(orig_stdlib)
+
+    # Evaluating the body (which checks sizes, and may simplify) and then deciding it didn't finish the subset construction
+    construction = prog.preds['pairs'].body_evaluated._aut
+    assert prog.preds['pairs'].body_evaluated.num_states() == -1
+    assert len(construction.edges) < len(construction.subsets)
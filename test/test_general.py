@@ -19,9 +19,71 @@ def test_praline_define_aut():
 def test_load_pred():
     run_file('examples/test_load_aut.pn')
 
+def test_load_pred_eager():
+    orig_eager = settings.is_eager_load()
+    settings.set_eager_load(True)
+
+    try:
+        run_file('examples/test_load_aut.pn')
+    finally:
+        settings.set_eager_load(orig_eager)
+
 def test_arith_basic():
     run_file('examples/test_arith.pn')
 
+def test_memory_budget():
+    orig_quiet = settings.is_quiet()
+    settings.set_quiet(True)
+
+    prog = program.load('examples/test_even.pn')
+
+    # Every definition that builds an automaton goes over this, but we still run all of them
+    settings.set_memory_budget(1)
+    try:
+        result = prog.evaluate().result
+    finally:
+        settings.set_memory_budget(None)
+        settings.set_quiet(orig_quiet)
+
+    assert result.failed()
+    assert result.message().count('memory budget') == 2
+
+def test_memory_budget_only_aborts_over_budget(monkeypatch):
+    from pecan.lang.ir.prog import NamedPred
+    import pecan.tools.mem_stats as mem_stats
+
+    # Pretend that only big uses a lot of memory, which we can't count on for real
+    evaluating = []
+    orig_call = NamedPred.call
+    def call(self, prog, arg_names=None):
+        evaluating.append(self.name)
+        try:
+            return orig_call(self, prog, arg_names)
+        finally:
+            evaluating.pop()
+    monkeypatch.setattr(NamedPred, 'call', call)
+    monkeypatch.setattr(mem_stats, 'current_rss', lambda: 2 if 'big' in evaluating else 0)
+
+    orig_quiet = settings.is_quiet()
+    settings.set_quiet(True)
+
+    prog = program.load('examples/test_memory_budget.pn')
+
+    settings.set_memory_budget(1)
+    try:
+        result = prog.evaluate().result
+    finally:
+        settings.set_memory_budget(None)
+        settings.set_quiet(orig_quiet)
+
+    assert result.failed()
+    assert result.message().count('memory budget') == 1
+    assert '#assert_prop(true, big) aborted' in result.message()
+    assert prog.preds['small_again'].body_evaluated is not None
+
+def test_finite_words():
+    run_file('examples/test_finite_words.pn')
+
 def test_sturmian_basic():
     run_file('examples/test_sturmian.pn')
 
@@ -34,6 +96,29 @@ def test_stdlib_imported():
 def test_import_works():
     run_file('examples/test_import.pn')
 
+def test_import_twice():
+    from pecan.tools.module_registry import module_registry
+
+    module_registry.reload()
+    run_file('examples/test_import_twice.pn')
+    assert len(module_registry.modules) == 2
+
+def test_import_after_settings_change():
+    from pecan.tools.module_registry import module_registry
+
+    module_registry.reload()
+    run_file('examples/test_import.pn')
+
+    # Modules evaluated under other settings aren't reused
+    orig_heuristics = settings.use_heuristics()
+    settings.set_use_heuristics(not orig_heuristics)
+    try:
+        run_file('examples/test_import.pn')
+    finally:
+        settings.set_use_heuristics(orig_heuristics)
+
+    assert len(module_registry.modules) == 2
+
 def test_quant_restricted():
     run_file('examples/test_quant_restricted.pn')
 
@@ -124,3 +209,154 @@ def test_website():
 def test_praline_constant_mul():
     run_file('examples/praline_constant_mul.pn')
 
+
+def test_pred_cache(tmp_path):
+    orig_cache_dir = settings.get_cache_dir()
+    settings.set_cache_dir(str(tmp_path))
+
+    try:
+        run_file('examples/test_arith.pn')
+        assert any(tmp_path.rglob('*.aut'))
+
+        # The second time around, the predicates should be loaded from the cache
+        run_file('examples/test_arith.pn')
+    finally:
+        settings.set_cache_dir(orig_cache_dir)
+
+def test_ir_cache(tmp_path):
+    orig_cache_dir = settings.get_cache_dir()
+    settings.set_cache_dir(str(tmp_path))
+
+    try:
+        run_file('examples/test_arith.pn')
+        assert any((tmp_path / 'ir').rglob('*.pir'))
+
+        # The second time around, the file should not be parsed again
+        run_file('examples/test_arith.pn')
+    finally:
+        settings.set_cache_dir(orig_cache_dir)
+
+def test_cache_size_covers_everything(tmp_path):
+    import os
+    from pecan.tools.aut_cache import AutomatonCache
+
+    cache = AutomatonCache(str(tmp_path), 1000)
+
+    # Parsed files and snapshots count towards the size of the cache, and are evicted least recently used first, like automata
+    paths = []
+    for i, name in enumerate(['a.aut', 'snapshots/b.snap', 'ir/c.pir', 'd.aut', 'ir/e.pir', 'snapshots/f.snap']):
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b'x' * 400)
+        os.utime(str(path), (i, i))
+        paths.append(path)
+        cache.added(str(path))
+
+    assert [path.exists() for path in paths] == [False, False, False, False, True, True]
+
+def test_library_snapshot(tmp_path, monkeypatch):
+    from pecan.tools.lib_snapshot import SnapshotStore
+    from pecan.tools.module_registry import module_registry
+
+    restored = []
+    orig_load = SnapshotStore.load
+    def load(self, realpath, context):
+        prog = orig_load(self, realpath, context)
+        if prog is not None:
+            restored.append((realpath, prog))
+        return prog
+    monkeypatch.setattr(SnapshotStore, 'load', load)
+
+    orig_cache_dir = settings.get_cache_dir()
+    settings.set_cache_dir(str(tmp_path))
+
+    try:
+        module_registry.reload()
+        run_file('examples/test_import.pn')
+        assert any((tmp_path / 'snapshots').glob('*.snap'))
+
+        # The second time around, the imported library should be restored from its snapshot, without the standard library
+        module_registry.reload()
+        run_file('examples/test_import.pn')
+
+        imported = [prog for realpath, prog in restored if realpath.endswith('test_imported.pn')]
+        assert len(imported) == 1
+        assert 'has_zeros' in imported[0].preds
+        assert not any(name in settings.stdlib_prog.preds for name in imported[0].preds)
+    finally:
+        settings.set_cache_dir(orig_cache_dir)
+
+def test_eval_memo():
+    orig_quiet = settings.is_quiet()
+    settings.set_quiet(True)
+
+    prog = program.load('examples/test_eval_memo.pn')
+    try:
+        assert prog.evaluate().result.succeeded()
+    finally:
+        settings.set_quiet(orig_quiet)
+
+    assert prog.eval_memo.hits > 0
+
+    # Each pair is the same predicate up to renaming its variables, so they share one entry
+    for a, b in [('comm1', 'comm2'), ('assoc1', 'assoc2'), ('less1', 'less2')]:
+        key_a, _ = prog.eval_memo.key_for(prog, prog.preds[a].body)
+        key_b, _ = prog.eval_memo.key_for(prog, prog.preds[b].body)
+        assert key_a == key_b
+
+def test_parallel_jobs():
+    orig_quiet = settings.is_quiet()
+    settings.set_quiet(True)
+
+    try:
+        prog = program.load('examples/test_arith.pn')
+        assert prog.evaluate(jobs=2).result.succeeded()
+    finally:
+        settings.set_quiet(orig_quiet)
+
+def test_canonical_aps():
+    from pecan.automata.buchi import BuchiAutomaton
+    from pecan.lang.ir.prog import VarRef
+
+    orig_quiet = settings.is_quiet()
+    settings.set_quiet(True)
+
+    try:
+        prog = program.from_source('''
+Restrict a, b, x, y are nat.
+p(x, y) := x < y
+q(a, b) := a < b
+''')
+        assert prog.evaluate().result.succeeded()
+
+        prog.enter_var_map_scope()
+        try:
+            p = prog.preds['p'].call(prog)
+
+            # The same predicate with renamed variables ends up with exactly the same aps once called with the same arguments
+            q = prog.preds['q'].call(prog, [VarRef('x'), VarRef('y')])
+            assert q.get_var_map().var_reps == p.get_var_map().var_reps
+            assert set(map(str, q.get_aut().ap())) == set(map(str, p.get_aut().ap()))
+
+            # Calling p with its own variables doesn't need to rename anything
+            performed, avoided = BuchiAutomaton.substitutions_performed, BuchiAutomaton.substitutions_avoided
+            same = prog.preds['p'].call(prog, [VarRef('x'), VarRef('y')])
+            assert BuchiAutomaton.substitutions_performed == performed
+            assert BuchiAutomaton.substitutions_avoided == avoided + 1
+            assert same.get_var_map().var_reps == p.get_var_map().var_reps
+        finally:
+            prog.exit_var_map_scope()
+    finally:
+        settings.set_quiet(orig_quiet)
+
+def test_pecan_bin_round_trip(tmp_path):
+    import spot
+    from pecan.tools.hoa_loader import load_hoa
+
+    aut = load_hoa('library/automata/has_zeros.aut')
+    path = str(tmp_path / 'has_zeros.pbin')
+    aut.save(path)
+
+    loaded = load_hoa(path)
+    assert loaded.get_var_map().var_reps == aut.get_var_map().var_reps
+    assert spot.are_equivalent(loaded.get_aut(), aut.get_aut())
@@ -53,6 +53,13 @@ def test_praline_accepting_word():
 [(x,[([false,false,true,true,true,false,true],[false])])]
 ''')
 
+def test_praline_accepting_values():
+    run_file('examples/test_praline_accepting_values.pn', '''
+[(x,92)]
+[(x,0)]
+[(i,-2)]
+''')
+
 def test_praline_examples():
     run_file('examples/test_praline_examples.pn', '''
 [(x,-2)]
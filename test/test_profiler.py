@@ -0,0 +1,46 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+import json
+
+from pecan.tools.profiler import Profiler
+
+class SizedAutomaton:
+    def __init__(self, states, edges):
+        self.states = states
+        self.edges = edges
+
+    def num_states(self):
+        return self.states
+
+    def num_edges(self):
+        return self.edges
+
+def test_profile_tree(tmp_path):
+    profiler = Profiler(str(tmp_path / 'prof.json'))
+
+    root = profiler.enter('thm', 'definition')
+    conj = profiler.enter('(a ∧ b)', 'Conjunction')
+    for name, size in [('a', 3), ('b', 4)]:
+        profiler.exit(profiler.enter(name, 'Call'), SizedAutomaton(size, 2 * size))
+    profiler.record_op('conjunction', SizedAutomaton(12, 30), conj.start)
+    profiler.exit(conj, SizedAutomaton(12, 30))
+    profiler.exit(root)
+
+    profiler.write()
+
+    with open(str(tmp_path / 'prof.json')) as f:
+        tree = json.load(f)
+
+    node = tree['roots'][0]['children'][0]
+    assert node['kind'] == 'product' and node['node'] == 'Conjunction'
+    assert (node['input_states'], node['input_edges']) == (7, 14)
+    assert (node['output_states'], node['output_edges']) == (12, 30)
+    assert node['self'] <= node['wall']
+    assert [child['name'] for child in node['children']] == ['a', 'b']
+
+    with open(str(tmp_path / 'prof.trace.json')) as f:
+        events = json.load(f)['traceEvents']
+
+    assert [e['name'] for e in events] == ['thm', '(a ∧ b)', 'conjunction', 'a', 'b']
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+from pecan.automata.automaton import Automaton
+from pecan.lang.ir.base import IRNode
+from pecan.lang.simplifier import Simplifier
+
+class CountingAutomaton(Automaton):
+    def __init__(self, states, merge_gain=0):
+        super().__init__('counting')
+        self.states = states
+        self.merge_gain = merge_gain
+        self.calls = []
+
+    def num_states(self):
+        return self.states
+
+    def num_edges(self):
+        return self.states
+
+    def purge(self):
+        self.calls.append('purge')
+        return self
+
+    def merge(self):
+        self.calls.append('merge')
+        self.states -= self.merge_gain
+        return self
+
+    def simplification_passes(self):
+        return [('purge', lambda aut: aut.purge(), False), ('merge', lambda aut: aut.merge(), True)]
+
+def test_skips_small_and_simplified():
+    simplifier = Simplifier()
+
+    small = CountingAutomaton(2)
+    simplifier.simplify(IRNode(), None, small)
+    assert small.calls == []
+
+    big = CountingAutomaton(100, merge_gain=10)
+    simplifier.simplify(IRNode(), None, big)
+    assert big.calls == ['purge', 'merge']
+
+    # Nothing changed since, so there's nothing to do
+    simplifier.simplify(IRNode(), None, big)
+    assert big.calls == ['purge', 'merge']
+
+    # Changing in place makes it worth another look, even if the size stays the same
+    big.mark_changed()
+    simplifier.simplify(IRNode(), None, big)
+    assert big.calls == ['purge', 'merge', 'purge', 'merge']
+
+    assert simplifier.skipped_small == 1 and simplifier.skipped_simplified == 1 and simplifier.runs == 2
+
+def test_skips_expensive_passes_without_payoff():
+    simplifier = Simplifier()
+
+    auts = [CountingAutomaton(100) for _ in range(Simplifier.warmup_runs + 3)]
+    for aut in auts:
+        simplifier.simplify(IRNode(), None, aut)
+
+    # Merging never removed anything, so after warming up we stop, but we always purge
+    assert all(aut.calls == ['purge', 'merge'] for aut in auts[:Simplifier.warmup_runs])
+    assert all(aut.calls == ['purge'] for aut in auts[Simplifier.warmup_runs:])
+    assert simplifier.pass_stats['merge'].skipped == 3
+
+    # ...but we still try again every so often
+    for _ in range(Simplifier.resample_every):
+        simplifier.simplify(IRNode(), None, CountingAutomaton(100))
+    assert simplifier.pass_stats['merge'].runs == Simplifier.warmup_runs + 1
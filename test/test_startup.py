@@ -0,0 +1,36 @@
+#!/usr/bin/env python3.6
+# -*- coding=utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+PECAN_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+# Modules that are expensive to import, and so should only be imported once we know we need them (see pecan.py)
+HEAVY_MODULES = ['spot', 'buddy', 'readline', 'colorama', 'pecan.program', 'pecan.lang.lark.parser', 'pecan.lang.ir', 'pecan.tools.theorem_generator']
+
+def imported_modules(*args):
+    # Each line of -X importtime output looks like: "import time: self [us] | cumulative | imported package"
+    proc = subprocess.run([sys.executable, '-X', 'importtime', 'pecan.py'] + list(args),
+                          cwd=PECAN_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert proc.returncode == 0, proc.stderr
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('imported package'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            modules[name.strip()] = int(cumulative)
+
+    return modules
+
+def test_help_skips_heavy_imports():
+    modules = imported_modules('--help')
+
+    heavy = [m for m in HEAVY_MODULES if m in modules]
+    assert heavy == [], 'pecan.py --help imported {} ({} us in total)'.format(heavy, sum(modules[m] for m in heavy))
+
+def test_no_args_skips_heavy_imports():
+    modules = imported_modules()
+
+    assert not any(m in modules for m in HEAVY_MODULES)